@@ -1,7 +1,7 @@
 """
 Vietnamese LLM Quantization Project
 
-A FastAPI-based application for running quantized Vietnamese language models
+A Flask-based application for running quantized Vietnamese language models
 with 4-bit and 8-bit quantization for financial analysis.
 """
 
@@ -9,13 +9,19 @@ __version__ = "1.0.0"
 __author__ = "Your Name"
 __description__ = "Multilingual LLM with Vietnamese support for CPU inference"
 
-# Import key components for easier access
-from app.controller.model_controller import router as api_router
-from app.service.model_service import ModelService
-from app.service.quantization_service import QuantizationService
+import importlib
 
-__all__ = [
-    'api_router',
-    'ModelService',
-    'QuantizationService'
-]
\ No newline at end of file
+# Key components are imported on first access to keep `import app` cheap
+_EXPORTS = {
+    'ModelService': 'app.service.model_service',
+    'QuantizationService': 'app.service.quantization_service',
+    'api_router': 'app.controller.api_controller'
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module_name), name)
@@ -0,0 +1,49 @@
+# ASGI entry point: the API on an event loop, served by uvicorn
+#
+# Usage (from the app directory):
+#   python asgi.py [--host 0.0.0.0] [--port 8000]
+#   uvicorn asgi:create_asgi_app --factory --host 0.0.0.0 --port 8000
+#
+# Serves the same routes as main.py, except the JSONL batch endpoint (use
+# batch_inference.py or the Flask app for bulk runs). Generations run on the
+# per-model scheduler threads and are awaited, so one server process handles
+# any number of waiting or streaming clients, and a client that disconnects
+# stops its generation.
+import argparse
+import sys
+from typing import TYPE_CHECKING
+from common.constants import SERVE_HOST, SERVE_PORT, WARMUP_ENABLED, WARMUP_MODELS
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+def create_asgi_app(warmup: bool = WARMUP_ENABLED) -> "FastAPI":
+    from fastapi import FastAPI
+    from controller.api_controller import api_router, model_service
+
+    app = FastAPI(
+        version='1.0',
+        title='Document Model API',
+        description='API for document model operations'
+    )
+    app.include_router(api_router)
+
+    # Load and warm models in the background; /model/ready reports when done
+    if warmup:
+        model_service.start_warmup(WARMUP_MODELS)
+
+    return app
+
+def main() -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the API with uvicorn")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    args = parser.parse_args()
+
+    uvicorn.run(create_asgi_app(), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# Offline batch inference over JSONL files of company data
+#
+# Usage (from the app directory):
+#   python batch_inference.py companies.jsonl results.jsonl [--model-type 4bit] [--max-tokens 500]
+#                             [--thinking off|on|<budget>] [--no-cache] [--restart]
+#
+# Each input line is a company record, either {"id": ..., "data": {...}} or the
+# company data itself. Results are appended to the output file as JSON lines in
+# completion order. The output file doubles as the checkpoint: when a killed job
+# is started again with the same arguments it skips every line that already has
+# a successful result and retries the rest.
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Set
+from common.constants import BATCH_CHECKPOINT_INTERVAL, THINKING_DEFAULT
+from service.model_service import ModelService
+
+class BatchCheckpoint:
+    """Tracks which input lines already have a successful result.
+
+    Lines are kept as a watermark below which every line is done plus the
+    set of done lines above it, so memory stays small on long runs.
+    """
+
+    def __init__(self, output_path: str, input_path: str):
+        self.output_path = output_path
+        self.input_path = input_path
+        self.state_path = f"{output_path}.checkpoint.json"
+        self.watermark = 0
+        self.done: Set[int] = set()
+        self.previous_elapsed = 0.0
+
+    def __contains__(self, line_number: int) -> bool:
+        return line_number <= self.watermark or line_number in self.done
+
+    def __len__(self) -> int:
+        return self.watermark + len(self.done)
+
+    def mark_done(self, line_number: int):
+        self.done.add(line_number)
+        while self.watermark + 1 in self.done:
+            self.watermark += 1
+            self.done.discard(self.watermark)
+
+    def _input_fingerprint(self) -> Dict[str, Any]:
+        stat = os.stat(self.input_path)
+        return {"input_path": os.path.abspath(self.input_path), "input_size": stat.st_size, "input_mtime": stat.st_mtime}
+
+    def load(self):
+        """Recover progress from an earlier run's output file"""
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            fingerprint = self._input_fingerprint()
+            if any(state.get(key) != value for key, value in fingerprint.items()):
+                raise ValueError(
+                    f"Checkpoint {self.state_path} belongs to a different input file. "
+                    "Use --restart or another output path."
+                )
+            self.previous_elapsed = state.get("elapsed_seconds", 0.0)
+
+        if not os.path.exists(self.output_path):
+            return
+
+        # Drop a line left half-written when the previous run was killed
+        with open(self.output_path, "rb+") as f:
+            content = f.read()
+            end = content.rfind(b"\n") + 1
+            if end < len(content):
+                f.truncate(end)
+
+        with open(self.output_path, encoding="utf-8") as f:
+            for line in f:
+                result = json.loads(line)
+                if result.get("success"):
+                    self.mark_done(result["line"])
+
+    def save(self, elapsed: float):
+        """Atomically record progress and the input the output belongs to"""
+        state = {
+            **self._input_fingerprint(),
+            "output_path": os.path.abspath(self.output_path),
+            "records_done": len(self),
+            "watermark": self.watermark,
+            "elapsed_seconds": round(self.previous_elapsed + elapsed, 2),
+            "updated_at": time.time()
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def clear(self):
+        """Forget earlier progress"""
+        for path in (self.output_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def run_batch(input_path: str, output_path: str, model_type: str = "4bit", max_tokens: int = 500,
+              use_cache: bool = True, restart: bool = False, thinking: str = THINKING_DEFAULT) -> Dict[str, Any]:
+    """Process an input file, resuming from the output file when possible"""
+    checkpoint = BatchCheckpoint(output_path, input_path)
+    if restart:
+        checkpoint.clear()
+    checkpoint.load()
+    if len(checkpoint):
+        print(f"Resuming: {len(checkpoint)} records already done")
+
+    model_service = ModelService()
+    load_start = time.time()
+    model_service.registry.load(model_type)
+    load_time = time.time() - load_start
+    print(f"Model {model_type} loaded in {load_time:.2f}s")
+
+    totals = {"succeeded": 0, "failed": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "decode_time": 0.0}
+    start_time = time.time()
+    since_checkpoint = 0
+
+    with open(input_path, encoding="utf-8") as input_file, open(output_path, "a", encoding="utf-8") as output_file:
+        results = model_service.generate_batch(
+            input_file,
+            model_type,
+            max_tokens,
+            use_cache=use_cache,
+            skip_lines=checkpoint,
+            thinking=thinking
+        )
+        for result in results:
+            if result.get("type") == "summary":
+                break
+
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+
+            if result["success"]:
+                checkpoint.mark_done(result["line"])
+                totals["succeeded"] += 1
+                totals["cached"] += int(result.get("cached", False))
+                totals["prompt_tokens"] += result.get("prompt_tokens", 0)
+                totals["completion_tokens"] += result.get("completion_tokens", 0)
+                totals["decode_time"] += result.get("timings", {}).get("decode", 0.0)
+            else:
+                totals["failed"] += 1
+                print(f"Record {result['id']} (line {result['line']}) failed: {result['error']}")
+
+            since_checkpoint += 1
+            if since_checkpoint >= BATCH_CHECKPOINT_INTERVAL:
+                os.fsync(output_file.fileno())
+                checkpoint.save(time.time() - start_time)
+                since_checkpoint = 0
+
+        os.fsync(output_file.fileno())
+    elapsed = time.time() - start_time
+    checkpoint.save(elapsed)
+
+    processed = totals["succeeded"] + totals["failed"]
+    return {
+        "input_path": input_path,
+        "output_path": output_path,
+        "model_type": model_type,
+        "records_processed": processed,
+        "records_succeeded": totals["succeeded"],
+        "records_failed": totals["failed"],
+        "records_cached": totals["cached"],
+        "records_skipped": len(checkpoint) - totals["succeeded"],
+        "model_load_time": round(load_time, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "total_elapsed_seconds": round(checkpoint.previous_elapsed + elapsed, 2),
+        "records_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0,
+        "prompt_tokens": totals["prompt_tokens"],
+        "completion_tokens": totals["completion_tokens"],
+        "completion_tokens_per_second": round(totals["completion_tokens"] / elapsed, 2) if elapsed > 0 else 0,
+        "decode_tokens_per_second": round(totals["completion_tokens"] / totals["decode_time"], 2) if totals["decode_time"] > 0 else 0
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run financial analysis over a JSONL file of company records")
+    parser.add_argument("input", help="Input JSONL file, one company record per line")
+    parser.add_argument("output", help="Output JSONL file; also used to resume an interrupted run")
+    parser.add_argument("--model-type", default="4bit", help="Model name or alias")
+    parser.add_argument("--max-tokens", type=int, default=500, help="Maximum tokens per response")
+    parser.add_argument("--thinking", default=THINKING_DEFAULT, help='Reasoning mode: "off", "on" or a reasoning token budget')
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--restart", action="store_true", help="Discard earlier progress and start over")
+    args = parser.parse_args()
+
+    try:
+        summary = run_batch(
+            args.input,
+            args.output,
+            model_type=args.model_type,
+            max_tokens=args.max_tokens,
+            use_cache=not args.no_cache,
+            restart=args.restart,
+            thinking=args.thinking
+        )
+    except (ValueError, RuntimeError, OSError, MemoryError) as e:
+        print(f"Batch failed: {e}")
+        return 1
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0 if summary["records_failed"] == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the Vietnamese LLM application.
+
+This package contains:
+- startup_benchmark: Cold-start import and app creation time
+- inference_benchmark: Prefill/decode throughput, TTFT, load time and peak RSS sweeps
+"""
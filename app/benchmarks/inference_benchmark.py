@@ -0,0 +1,277 @@
+# Inference throughput benchmark across models, threads, batch sizes and lengths
+#
+# Usage (from the app directory):
+#   python benchmarks/inference_benchmark.py [--models 4bit 8bit | --models path/to/tiny.gguf]
+#                                            [--threads 1,2,4] [--batch 64,512]
+#                                            [--prompt-lengths 64,256] [--gen-lengths 32] [--repeats 3]
+#                                            [--output results.json] [--baseline inference_baseline.json]
+#                                            [--save-baseline] [--tolerance 0.10]
+#                                            [--drafts prompt_lookup 4bit]
+#
+# Every (model, n_threads, n_batch) combination runs in a fresh interpreter so
+# that load time and peak RSS belong to that configuration alone. Decoding is
+# greedy over a fixed prompt, so runs are reproducible. For a regression gate on
+# a plain CPU box, point --models at a tiny GGUF (e.g. a few-million-parameter
+# test model) and keep the sweep small. Exits non-zero when a measurement
+# regresses past the tolerance against the baseline. With --drafts every
+# configuration is also run with speculative decoding and its decode speedup
+# over the plain run is reported.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+DEFAULT_BASELINE = os.path.join(APP_DIR, "benchmarks", "inference_baseline.json")
+DEFAULT_TOLERANCE = 0.10    # Allowed relative regression per metric
+
+# Fixed prompt text, repeated and truncated to each prompt length
+PROMPT_TEXT = (
+    "Công ty cổ phần ABC công bố doanh thu quý III đạt 1.250 tỷ đồng, tăng 12% so với cùng kỳ, "
+    "biên lợi nhuận gộp cải thiện nhờ chi phí nguyên vật liệu giảm và cơ cấu sản phẩm tốt hơn. "
+)
+
+# Metrics compared against the baseline and whether higher values are better
+COMPARED_METRICS = {
+    "prefill_tokens_per_second": True,
+    "decode_tokens_per_second": True,
+    "time_to_first_token": False,
+    "load_time": False,
+    "peak_rss_bytes": False
+}
+
+def parse_ints(value: str):
+    return [int(item) for item in value.split(",") if item]
+
+def run_worker(config: dict) -> dict:
+    """Load one model with one thread/batch setting and measure every length combination"""
+    import resource
+    from common.model_utils import create_optimized_llama
+
+    n_ctx = max(config["prompt_lengths"]) + max(config["gen_lengths"]) + 8
+    speculative = {}
+    if config.get("draft"):
+        from service.model_registry_service import ModelRegistryService
+        from service.speculative_service import SpeculativeService
+
+        drafts = SpeculativeService(ModelRegistryService(), targets={})
+        speculative = {"draft_model": drafts.create_draft(config["draft"]), "logits_all": True}
+
+    load_start = time.time()
+    model = create_optimized_llama(
+        config["model_path"],
+        threads=config["threads"],
+        use_mlock=False,
+        n_ctx=n_ctx,
+        n_batch=config["batch"],
+        **speculative
+    )
+    load_time = time.time() - load_start
+    tracker = speculative.get("draft_model")
+
+    text_tokens = model.tokenize(PROMPT_TEXT.encode("utf-8"), add_bos=False)
+    rows = []
+    for prompt_length in config["prompt_lengths"]:
+        prompt = (text_tokens * (prompt_length // len(text_tokens) + 1))[:prompt_length]
+        for gen_length in config["gen_lengths"]:
+            samples = []
+            for _ in range(config["repeats"]):
+                model.reset()
+                if tracker is not None:
+                    tracker.begin()
+                start_time = time.time()
+                first_token_at = None
+                generated = 0
+                for _ in model.generate(prompt, temp=0.0, reset=True):
+                    generated += 1
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    if generated >= gen_length:
+                        break
+                finished_at = time.time()
+                ttft = first_token_at - start_time
+                decode_time = finished_at - first_token_at
+                sample = {
+                    "time_to_first_token": ttft,
+                    "prefill_tokens_per_second": prompt_length / ttft,
+                    "decode_tokens_per_second": (generated - 1) / decode_time if decode_time > 0 else 0.0
+                }
+                if tracker is not None:
+                    stats = tracker.finish(model.input_ids.tolist(), generated)
+                    sample["acceptance_rate"] = stats["acceptance_rate"]
+                    sample["tokens_per_step"] = stats["tokens_per_step"]
+                samples.append(sample)
+            rows.append({
+                "prompt_tokens": prompt_length,
+                "gen_tokens": gen_length,
+                **{
+                    metric: round(statistics.median(sample[metric] for sample in samples), 4)
+                    for metric in samples[0]
+                }
+            })
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"load_time": round(load_time, 3), "peak_rss_bytes": peak_rss, "rows": rows}
+
+def run_configuration(config: dict) -> dict:
+    """Run a worker in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark worker failed: {result.stderr.strip()[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def resolve_models(names):
+    """Map model names, aliases or paths to (name, path, quant_type)"""
+    from service.model_registry_service import ModelRegistryService, parse_quant_type
+
+    registry = ModelRegistryService()
+    if not names:
+        return [(entry.name, entry.path, entry.quant_type) for entry in registry.scan()]
+    models = []
+    for name in names:
+        if os.path.isfile(name):
+            models.append((os.path.splitext(os.path.basename(name))[0], os.path.abspath(name), parse_quant_type(name)))
+        else:
+            entry = registry.resolve(name)
+            models.append((entry.name, entry.path, entry.quant_type))
+    return models
+
+def result_key(row: dict) -> str:
+    key = f"{row['model']}|t{row['threads']}|b{row['batch']}|p{row['prompt_tokens']}|g{row['gen_tokens']}"
+    return f"{key}|d{row['draft']}" if row.get("draft") else key
+
+def add_speculative_speedup(results: list):
+    """Decode speedup of each speculative row over the same configuration without a draft"""
+    plain = {result_key(row): row for row in results if not row.get("draft")}
+    for row in results:
+        if row.get("draft"):
+            base = plain.get(result_key({**row, "draft": None}))
+            if base and base["decode_tokens_per_second"]:
+                row["speculative_speedup"] = round(row["decode_tokens_per_second"] / base["decode_tokens_per_second"], 3)
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """List measurements that regressed more than ``tolerance`` against the baseline"""
+    baseline_rows = {result_key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        previous = baseline_rows.get(result_key(row))
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append({
+                    "key": result_key(row),
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 4)
+                })
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark prefill/decode throughput of GGUF models")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--models", nargs="*", help="Model names, aliases or GGUF paths (default: all registry models)")
+    parser.add_argument("--threads", type=parse_ints, default=[1, 2, 4])
+    parser.add_argument("--batch", type=parse_ints, default=[64, 512])
+    parser.add_argument("--prompt-lengths", type=parse_ints, default=[64, 256])
+    parser.add_argument("--gen-lengths", type=parse_ints, default=[32])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--drafts", nargs="*", default=[], help="Also run with these speculative drafters (prompt_lookup or a model)")
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return 0
+
+    models = resolve_models(args.models)
+    if not models:
+        print("No GGUF models found")
+        return 1
+
+    results = []
+    for name, path, quant_type in models:
+        for threads in args.threads:
+            for batch in args.batch:
+                for draft in [None, *args.drafts]:
+                    print(f"{name}: n_threads={threads} n_batch={batch} draft={draft}", file=sys.stderr)
+                    measured = run_configuration({
+                        "model_path": path,
+                        "threads": threads,
+                        "batch": batch,
+                        "draft": draft,
+                        "prompt_lengths": args.prompt_lengths,
+                        "gen_lengths": args.gen_lengths,
+                        "repeats": args.repeats
+                    })
+                    for row in measured["rows"]:
+                        results.append({
+                            "model": name,
+                            "quant_type": quant_type,
+                            "file_size": os.path.getsize(path),
+                            "threads": threads,
+                            "batch": batch,
+                            "draft": draft,
+                            **row,
+                            "load_time": measured["load_time"],
+                            "peak_rss_bytes": measured["peak_rss_bytes"]
+                        })
+    add_speculative_speedup(results)
+
+    report = {
+        "environment": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version()
+        },
+        "sweep": {
+            "threads": args.threads,
+            "batch": args.batch,
+            "prompt_lengths": args.prompt_lengths,
+            "gen_lengths": args.gen_lengths,
+            "repeats": args.repeats,
+            "drafts": args.drafts
+        },
+        "results": results
+    }
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        report["baseline"] = args.baseline
+    report["regressions"] = regressions
+    report["passed"] = not regressions
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    return 0 if not regressions else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# Cold-start benchmark for the API server
+#
+# Usage (from the app directory):
+#   python benchmarks/startup_benchmark.py [--runs 5] [--threshold 1.5]
+#                                          [--baseline startup_baseline.json] [--save-baseline]
+#
+# Each run starts a fresh interpreter, imports the server and builds the Flask
+# app without warm-up, so it measures what a container restart pays before it
+# can accept requests. Exits non-zero when the median exceeds the threshold,
+# regresses past the baseline tolerance, or a heavy module is imported eagerly.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_RUNS = 5
+DEFAULT_THRESHOLD_SECONDS = 1.5
+BASELINE_TOLERANCE = 0.25    # Allowed slowdown relative to the saved baseline
+
+# Modules the serving path must not import until they are needed
+DEFERRED_MODULES = ["llama_cpp", "huggingface_hub", "fastapi", "pydantic", "numpy"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app(warmup=False)
+created = time.perf_counter()
+print(json.dumps({
+    "import_time": imported - start,
+    "create_app_time": created - imported,
+    "total_time": created - start,
+    "loaded_deferred_modules": [name for name in %r if name in sys.modules]
+}))
+""" % (DEFERRED_MODULES,)
+
+def run_probe() -> dict:
+    """Measure one cold start in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed: {result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure API server cold-start time")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_SECONDS,
+                        help="Maximum allowed median startup time in seconds")
+    parser.add_argument("--baseline", default=os.path.join(APP_DIR, "benchmarks", "startup_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Write the measured median as the new baseline")
+    args = parser.parse_args()
+
+    # One untimed run to populate the OS file cache and __pycache__
+    run_probe()
+    samples = [run_probe() for _ in range(args.runs)]
+
+    summary = {
+        "runs": args.runs,
+        "median_total_time": statistics.median(s["total_time"] for s in samples),
+        "median_import_time": statistics.median(s["import_time"] for s in samples),
+        "median_create_app_time": statistics.median(s["create_app_time"] for s in samples),
+        "max_total_time": max(s["total_time"] for s in samples),
+        "loaded_deferred_modules": sorted({m for s in samples for m in s["loaded_deferred_modules"]})
+    }
+
+    failures = []
+    if summary["median_total_time"] > args.threshold:
+        failures.append(f"median startup {summary['median_total_time']:.3f}s exceeds threshold {args.threshold:.3f}s")
+    if summary["loaded_deferred_modules"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(summary['loaded_deferred_modules'])}")
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        limit = baseline["median_total_time"] * (1 + BASELINE_TOLERANCE)
+        summary["baseline_median_total_time"] = baseline["median_total_time"]
+        if summary["median_total_time"] > limit:
+            failures.append(
+                f"median startup {summary['median_total_time']:.3f}s regressed past baseline "
+                f"{baseline['median_total_time']:.3f}s (+{BASELINE_TOLERANCE:.0%})"
+            )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    summary["passed"] = not failures
+    summary["failures"] = failures
+    print(json.dumps(summary, indent=2))
+    return 0 if not failures else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
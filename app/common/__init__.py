@@ -5,6 +5,12 @@ This package contains:
 - constants: Application-wide constants
 - helpers: Utility functions for file operations, command execution, etc.
 - model_utils: Model-specific utilities and prompt generation
+- cache_utils: Byte-bounded RAM and disk caches
+- gguf_reader: Header-only GGUF metadata parser
+- pipeline: Incremental dependency-graph runner for the quantization setup
+- prompt_builder: Token-budgeted prompt construction and context overflow guard
+- host_tuning: CPU topology detection and llama.cpp thread/batch tuning
+- kv_cache: KV cache element types, memory estimates and context sizing
 """
 
 from common.constants import (
@@ -16,8 +22,10 @@ from common.constants import (
     DEFAULT_TEMPERATURE,
     DEFAULT_TOP_P,
     DEFAULT_THREADS,
+    THREADS_AUTO,
     DEFAULT_BATCH_SIZE,
     DEFAULT_CONTEXT_SIZE,
+    CONTEXT_SIZE_AUTO,
     QUANT_4BIT,
     QUANT_8BIT
 )
@@ -25,12 +33,61 @@ from common.constants import (
 from common.helpers import (
     ensure_directory_exists,
     run_command,
-    validate_json_input
+    run_logged_command,
+    CommandError,
+    validate_json_input,
+    format_sse,
+    format_json_line
 )
 
 from common.model_utils import (
     create_optimized_llama,
-    create_financial_prompt
+    get_thread_tuner,
+    create_financial_prompt,
+    create_financial_prompt_prefix,
+    serialize_company_data,
+    format_chat_prompt,
+    resolve_thinking_budget,
+    strip_thinking,
+    read_model_manifest,
+    GenerationTimer
+)
+
+from common.gguf_reader import (
+    read_gguf_header,
+    GGUFFormatError
+)
+
+from common.cache_utils import (
+    ByteLRUCache,
+    DiskCache
+)
+
+from common.prompt_builder import (
+    build_financial_prompt,
+    BuiltPrompt,
+    PromptTooLongError
+)
+
+from common.host_tuning import (
+    HostProfile,
+    ThreadTuner,
+    cgroup_cpu_limit,
+    partition_cpus
+)
+
+from common.kv_cache import (
+    KV_CACHE_TYPES,
+    kv_cache_bytes,
+    kv_cache_options,
+    recommend_context_size
+)
+
+from common.pipeline import (
+    PipelineRunner,
+    PipelineStep,
+    StepResult,
+    fingerprint_path
 )
 
 __all__ = [
@@ -43,17 +100,62 @@ __all__ = [
     'DEFAULT_TEMPERATURE',
     'DEFAULT_TOP_P',
     'DEFAULT_THREADS',
+    'THREADS_AUTO',
     'DEFAULT_BATCH_SIZE',
     'DEFAULT_CONTEXT_SIZE',
+    'CONTEXT_SIZE_AUTO',
     'QUANT_4BIT',
     'QUANT_8BIT',
     
     # Helpers
     'ensure_directory_exists',
     'run_command',
+    'run_logged_command',
+    'CommandError',
     'validate_json_input',
+    'format_sse',
+    'format_json_line',
     
     # Model Utilities
     'create_optimized_llama',
-    'create_financial_prompt'
+    'get_thread_tuner',
+    'create_financial_prompt',
+    'create_financial_prompt_prefix',
+    'serialize_company_data',
+    'format_chat_prompt',
+    'resolve_thinking_budget',
+    'strip_thinking',
+    'read_model_manifest',
+    'GenerationTimer',
+
+    # GGUF Reader
+    'read_gguf_header',
+    'GGUFFormatError',
+
+    # Cache Utilities
+    'ByteLRUCache',
+    'DiskCache',
+
+    # Prompt Builder
+    'build_financial_prompt',
+    'BuiltPrompt',
+    'PromptTooLongError',
+
+    # Host Tuning
+    'HostProfile',
+    'ThreadTuner',
+    'cgroup_cpu_limit',
+    'partition_cpus',
+
+    # KV Cache
+    'KV_CACHE_TYPES',
+    'kv_cache_bytes',
+    'kv_cache_options',
+    'recommend_context_size',
+
+    # Pipeline
+    'PipelineRunner',
+    'PipelineStep',
+    'StepResult',
+    'fingerprint_path'
 ]
\ No newline at end of file
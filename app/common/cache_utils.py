@@ -0,0 +1,176 @@
+# Cache utilities shared by the inference caches
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+from .helpers import ensure_directory_exists
+
+class ByteLRUCache:
+    """Thread-safe in-memory LRU cache bounded by the total size of its values.
+
+    ``on_evict(key, value)`` is called for entries evicted to make room,
+    e.g. to spill them to a ``DiskCache``.
+    """
+
+    def __init__(self, capacity_bytes: int, sizeof: Callable[[Any], int],
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.capacity_bytes = capacity_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.size_bytes = 0
+        self._items: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value and mark it as recently used"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, value: Any) -> bool:
+        """Store a value, evicting least recently used entries to make room"""
+        size = self.sizeof(value)
+        if size > self.capacity_bytes:
+            return False
+
+        evicted: List[Tuple[str, Any]] = []
+        with self._lock:
+            if key in self._items:
+                self.size_bytes -= self._items.pop(key)[1]
+            while self._items and self.size_bytes + size > self.capacity_bytes:
+                evicted_key, (evicted_value, evicted_size) = self._items.popitem(last=False)
+                self.size_bytes -= evicted_size
+                evicted.append((evicted_key, evicted_value))
+            self._items[key] = (value, size)
+            self.size_bytes += size
+
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+        return True
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Remove and return a value"""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            self.size_bytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._items.clear()
+            self.size_bytes = 0
+
+class DiskCache:
+    """Pickle-per-entry cache directory bounded by total file size.
+
+    Entries survive restarts. Least recently used files (by modification
+    time, refreshed on read) are deleted once the directory exceeds its cap.
+    """
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, directory: str, capacity_bytes: int):
+        self.directory = directory
+        self.capacity_bytes = capacity_bytes
+        self._lock = threading.Lock()
+        ensure_directory_exists(directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.SUFFIX}")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Load a value from disk, or None when missing or unreadable"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable cache entry {path}: {e}")
+            self.pop(key)
+            return None
+
+    def put(self, key: str, value: Any) -> bool:
+        """Write a value to disk atomically and enforce the size cap"""
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {path}: {e}")
+            return False
+        self._evict()
+        return True
+
+    def pop(self, key: str):
+        """Delete an entry if present"""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def expire(self, max_age_seconds: float) -> int:
+        """Delete entries not written or read for ``max_age_seconds``. Returns how many were deleted."""
+        cutoff = time.time() - max_age_seconds
+        deleted = 0
+        with self._lock:
+            for mtime, name, _ in self._entries():
+                if mtime >= cutoff:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    def size_bytes(self) -> int:
+        """Total size of all entries on disk"""
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used entries until under the size cap"""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            for _, name, size in entries:
+                if total <= self.capacity_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
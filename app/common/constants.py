@@ -12,10 +12,161 @@ DEFAULT_TEMPERATURE = 0.2
 DEFAULT_TOP_P = 0.9
 
 # Performance constants
-DEFAULT_THREADS = 48
+THREADS_AUTO = "auto"
+DEFAULT_THREADS = THREADS_AUTO  # Thread count, or THREADS_AUTO to size from the host CPU topology
 DEFAULT_BATCH_SIZE = 512
 DEFAULT_CONTEXT_SIZE = 4096
 
+# KV cache constants
+KV_CACHE_TYPE_K = "f16"                     # Element type of the K cache: "f16", "q8_0" or "q4_0"
+KV_CACHE_TYPE_V = "f16"                     # Element type of the V cache; quantized types turn on flash attention
+CONTEXT_SIZE_AUTO = "auto"                  # n_ctx sized from observed prompt and output lengths
+MODEL_SETTINGS = {}                         # Per-model n_ctx/type_k/type_v by name or alias, e.g.
+                                            # {"4bit": {"type_k": "q8_0", "type_v": "q8_0", "n_ctx": CONTEXT_SIZE_AUTO}}
+CONTEXT_STATS_PATH = f"{MODEL_DIR}/.tuning/context_stats.json"  # Observed sequence lengths per model
+CONTEXT_STATS_MAX_SAMPLES = 1000            # Most recent sequence lengths kept per model
+CONTEXT_STATS_MIN_SAMPLES = 50              # Below this, CONTEXT_SIZE_AUTO falls back to DEFAULT_CONTEXT_SIZE
+CONTEXT_STATS_SAVE_INTERVAL = 20            # Observations between saves of the statistics
+CONTEXT_SIZE_PERCENTILE = 0.99              # Sequence length the context must hold
+CONTEXT_SIZE_HEADROOM = 1.1                 # Margin on top of that percentile
+CONTEXT_SIZE_MIN = 1024
+CONTEXT_SIZE_STEP = 256                     # Context sizes are rounded up to a multiple of this
+MODEL_COMPUTE_BUFFER_BYTES = 512 * 1024**2  # Compute buffers on top of weights and KV cache
+
+# Host tuning constants (used when threads are THREADS_AUTO)
+TUNING_CALIBRATE = False                            # Time short generations on the first load of each model
+TUNING_CACHE_PATH = f"{MODEL_DIR}/.tuning/settings.json"  # Calibrated settings per host and model
+TUNING_PROMPT_TOKENS = 128                          # Calibration prompt length
+TUNING_DECODE_TOKENS = 16                           # Calibration generation length
+TUNING_BATCH_CANDIDATES = [256, 512, 1024]          # n_batch values tried by the calibration
+
+# Multi-process serving constants
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 8000
+SERVE_WORKERS = None                        # None = one per SERVE_CORES_PER_WORKER physical cores of each NUMA node
+SERVE_CORES_PER_WORKER = 12                 # Decode stops scaling with threads around memory bandwidth saturation
+SERVE_WORKER_BASE_PORT = 8100               # Workers listen on 127.0.0.1 from this port up
+SERVE_WORKER_START_TIMEOUT_SECONDS = 60     # Time for a worker to start accepting connections
+SERVE_HEALTH_INTERVAL_SECONDS = 5           # Worker liveness/readiness polling interval
+SERVE_PROXY_TIMEOUT_SECONDS = 600           # Upper bound on one proxied request
+
+# ASGI serving constants
+ASGI_DISCONNECT_POLL_SECONDS = 0.25         # How often a waiting request checks whether its client left
+
+# Qwen3 thinking constants
+THINKING_OFF = "off"
+THINKING_ON = "on"
+THINKING_DEFAULT = THINKING_OFF     # Per-request default: THINKING_OFF, THINKING_ON or a reasoning token budget
+THINKING_DEFAULT_BUDGET = 1024      # Reasoning tokens allowed when thinking is THINKING_ON
+
+# Prompt budget constants
+PROMPT_RESERVED_COMPLETION_TOKENS = 1024    # Context kept free for the answer before the input is trimmed
+PROMPT_MAX_STRING_CHARS = 300               # Longer strings are cut when trimming
+PROMPT_MAX_PERIODS = 2                      # Year-keyed series keep only their latest periods when trimming
+PROMPT_MAX_LIST_ITEMS = 5                   # Lists keep only their first items when trimming
+PROMPT_LOW_PRIORITY_FIELDS = [              # Dropped first, in this order (dotted paths)
+    "website",
+    "headquarters",
+    "founding_year",
+    "number_of_employees",
+    "analysis_summary.validation",
+    "estimated_cashflow_invest_last_3_years",
+    "estimated_expenses_last_3_years"
+]
+PROMPT_PROTECTED_FIELDS = ["company_name", "industry_sector"]   # Never dropped
+
 # Quantization types
 QUANT_4BIT = "Q4_K_M"
-QUANT_8BIT = "Q8_0"
\ No newline at end of file
+QUANT_8BIT = "Q8_0"
+
+# Quantization pipeline constants
+PIPELINE_STATE_DIR = f"{MODEL_DIR}/.pipeline"   # Step stamps, logs and last_run.json
+PIPELINE_CPU_BUDGET = None                      # Cores shared by concurrent steps; None = all cores
+PIPELINE_DISK_RESERVE_BYTES = 5 * 1024**3       # Free space a step must leave behind
+
+# Quantization matrix constants
+QUANT_CONFIG_PATH = "quant_config.json"         # Optional JSON file overriding QUANT_MATRIX
+QUANT_MATRIX = [                                # Source models and the llama-quantize types built from each
+    {
+        "hf_model_id": HF_MODEL_ID,
+        "quant_types": [QUANT_4BIT, QUANT_8BIT],
+        "calibration_file": None                # Text file used to compute an importance matrix
+    }
+]
+QUANT_MANIFEST_PATH = f"{MODEL_DIR}/manifest.json"
+IMATRIX_CHUNKS = 128                            # Calibration chunks evaluated by llama-imatrix
+IMATRIX_QUANT_TYPES = [                         # Low-bit types quantized with the imatrix when one is configured
+    "IQ1_S", "IQ1_M", "IQ2_XXS", "IQ2_XS", "IQ2_S", "IQ2_M", "IQ3_XXS", "IQ3_XS", "IQ3_S", "IQ3_M",
+    "IQ4_XS", "IQ4_NL", "Q2_K", "Q2_K_S", "Q3_K_S", "Q3_K_M", "Q3_K_L", "Q4_K_S", "Q4_K_M"
+]
+IMATRIX_REQUIRED_TYPES = ["IQ1_S", "IQ1_M", "IQ2_XXS", "IQ2_XS", "IQ2_S", "IQ2_M"]
+
+# Quantization quality evaluation constants
+EVAL_CORPUS_PATH = "eval/vi_financial_corpus.txt"  # Local Vietnamese financial text
+EVAL_OUTPUT_DIR = f"{MODEL_DIR}/.eval"              # Cached base log-probabilities and reports
+EVAL_CONTEXT_SIZE = 512                             # Tokens per chunk; the second half is scored
+EVAL_MAX_CHUNKS = 32
+EVAL_TOP_K = 10                                     # k for the top-k agreement
+EVAL_ROW_BLOCK = 64                                 # Logit rows converted per NumPy batch
+EVAL_MAX_KL_DIVERGENCE = 0.05                       # Quality bar: mean KL(FP16 || variant)
+EVAL_MAX_PERPLEXITY_INCREASE = 0.03                 # Quality bar: relative perplexity increase over FP16
+
+# Speculative decoding constants
+SPECULATIVE_PROMPT_LOOKUP = "prompt_lookup"
+SPECULATIVE_MODELS = {}                 # Target model name/alias -> SPECULATIVE_PROMPT_LOOKUP or a draft model name/alias,
+                                        # e.g. {"8bit": SPECULATIVE_PROMPT_LOOKUP}; both models must share a tokenizer
+SPECULATIVE_DRAFT_TOKENS = 10           # Tokens proposed per verification step
+SPECULATIVE_NGRAM_SIZE = 3              # Longest n-gram prompt lookup matches against the context
+
+# Scheduler constants
+SCHEDULER_QUEUE_SIZE = 32   # Max pending requests per model before rejecting
+SCHEDULER_MAX_BATCH = 8     # Max identical queued requests answered by one generation
+BATCH_DECODE_SEQUENCES = 4  # Distinct requests per model decoded together in shared batches; 1 = one at a time
+
+# Admission control constants
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITY_CLASSES = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 1}  # Lower runs first
+ADMISSION_MAX_CONCURRENT_GENERATIONS = 1        # Generations running at once across all models; they share the cores
+ADMISSION_MAX_QUEUED = {PRIORITY_INTERACTIVE: 8, PRIORITY_BULK: 24}  # Waiting requests per class before shedding (429)
+ADMISSION_EWMA_ALPHA = 0.2                      # Weight of the latest generation in the throughput estimates
+DEFAULT_DEADLINE_SECONDS = None                 # Per-request deadline when the client sets none
+
+# Batch analysis constants
+BATCH_MAX_IN_FLIGHT = SCHEDULER_MAX_BATCH   # Records queued at once per batch request
+BATCH_SUBMIT_TIMEOUT_SECONDS = 30           # How long a record waits for room in a full queue
+BATCH_CHECKPOINT_INTERVAL = 10              # Offline batch results between checkpoint syncs
+
+# Prompt prefix (KV state) cache constants
+PREFIX_CACHE_CAPACITY_BYTES = 2 * 1024**3       # RAM tier budget
+PREFIX_CACHE_DIR = None                         # e.g. f"{MODEL_DIR}/prefix_cache" to enable the disk tier
+PREFIX_CACHE_DISK_CAPACITY_BYTES = 8 * 1024**3  # Disk tier budget
+
+# Conversation session constants
+SESSION_CAPACITY_BYTES = 2 * 1024**3            # RAM budget for the KV states of sessions
+SESSION_DIR = f"{MODEL_DIR}/.sessions"          # Transcripts and KV states evicted from RAM
+SESSION_DISK_CAPACITY_BYTES = 16 * 1024**3      # Disk budget for evicted KV states
+SESSION_TTL_SECONDS = 24 * 3600                 # Sessions unused for this long are deleted
+
+# Response cache constants
+RESPONSE_CACHE_CAPACITY_BYTES = 64 * 1024**2        # RAM tier budget
+RESPONSE_CACHE_TTL_SECONDS = 3600                   # Entries older than this are discarded
+RESPONSE_CACHE_DIR = None                           # e.g. f"{MODEL_DIR}/response_cache" to enable the disk tier
+RESPONSE_CACHE_DISK_CAPACITY_BYTES = 512 * 1024**2  # Disk tier budget
+
+# Model registry constants
+MODEL_FILE_EXTENSION = ".gguf"
+MODEL_ALIASES = {                           # Legacy model types kept for API compatibility
+    "4bit": MODEL_4BIT_PATH,
+    "8bit": MODEL_8BIT_PATH
+}
+MODEL_MEMORY_BUDGET_BYTES = None            # None = MODEL_MEMORY_BUDGET_FRACTION of physical RAM
+MODEL_MEMORY_BUDGET_FRACTION = 0.75
+MODEL_MEMORY_OVERHEAD_BYTES = 1024**3       # KV cache and compute buffers when the KV size cannot be estimated
+MODEL_USE_MLOCK = True                      # Lock weights in RAM to prevent swapping
+
+# Startup warm-up constants
+WARMUP_ENABLED = True
+WARMUP_MODELS = ["4bit"]        # Models loaded and warmed in the background at startup
+WARMUP_MAX_TOKENS = 8           # Short generation that faults in weights and allocates the KV cache
+WARMUP_COMPANY_DATA = {"company_name": "Warm-up", "industry_sector": "Retail"}
@@ -0,0 +1,219 @@
+# Pure-Python reader for GGUF file headers
+import mmap
+import os
+import re
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+GGUF_MAGIC = b"GGUF"
+
+# Metadata value types
+GGUF_TYPE_UINT8 = 0
+GGUF_TYPE_INT8 = 1
+GGUF_TYPE_UINT16 = 2
+GGUF_TYPE_INT16 = 3
+GGUF_TYPE_UINT32 = 4
+GGUF_TYPE_INT32 = 5
+GGUF_TYPE_FLOAT32 = 6
+GGUF_TYPE_BOOL = 7
+GGUF_TYPE_STRING = 8
+GGUF_TYPE_ARRAY = 9
+GGUF_TYPE_UINT64 = 10
+GGUF_TYPE_INT64 = 11
+GGUF_TYPE_FLOAT64 = 12
+
+SCALAR_FORMATS = {
+    GGUF_TYPE_UINT8: "<B",
+    GGUF_TYPE_INT8: "<b",
+    GGUF_TYPE_UINT16: "<H",
+    GGUF_TYPE_INT16: "<h",
+    GGUF_TYPE_UINT32: "<I",
+    GGUF_TYPE_INT32: "<i",
+    GGUF_TYPE_FLOAT32: "<f",
+    GGUF_TYPE_BOOL: "<?",
+    GGUF_TYPE_UINT64: "<Q",
+    GGUF_TYPE_INT64: "<q",
+    GGUF_TYPE_FLOAT64: "<d",
+}
+
+# ggml tensor types
+GGML_TYPE_NAMES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 6: "Q5_0", 7: "Q5_1", 8: "Q8_0", 9: "Q8_1",
+    10: "Q2_K", 11: "Q3_K", 12: "Q4_K", 13: "Q5_K", 14: "Q6_K", 15: "Q8_K",
+    16: "IQ2_XXS", 17: "IQ2_XS", 18: "IQ3_XXS", 19: "IQ1_S", 20: "IQ4_NL", 21: "IQ3_S",
+    22: "IQ2_S", 23: "IQ4_XS", 24: "I8", 25: "I16", 26: "I32", 27: "I64", 28: "F64",
+    29: "IQ1_M", 30: "BF16", 34: "TQ1_0", 35: "TQ2_0",
+}
+
+# llama_ftype values stored in general.file_type
+FILE_TYPE_NAMES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16", 36: "TQ1_0", 37: "TQ2_0",
+}
+
+UINT64 = struct.Struct("<Q")
+
+# Arrays longer than this (e.g. the tokenizer vocabulary) are summarized, not returned
+MAX_ARRAY_ITEMS = 64
+
+BLOCK_PREFIX = re.compile(r"^blk\.\d+\.")
+
+class GGUFFormatError(ValueError):
+    """Raised when a file is not a readable GGUF file"""
+
+class _HeaderParser:
+    """Sequential reader over a memory-mapped GGUF header"""
+
+    def __init__(self, buffer: mmap.mmap):
+        self.buffer = buffer
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> Any:
+        try:
+            value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        except struct.error:
+            raise GGUFFormatError("Unexpected end of file while reading GGUF header")
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def string(self) -> str:
+        length = self.unpack("<Q")
+        end = self.offset + length
+        if end > len(self.buffer):
+            raise GGUFFormatError("String runs past the end of the file")
+        value = self.buffer[self.offset:end].decode("utf-8", errors="replace")
+        self.offset = end
+        return value
+
+    def value(self, value_type: int) -> Any:
+        if value_type == GGUF_TYPE_STRING:
+            return self.string()
+        if value_type == GGUF_TYPE_ARRAY:
+            return self.array()
+        fmt = SCALAR_FORMATS.get(value_type)
+        if fmt is None:
+            raise GGUFFormatError(f"Unknown GGUF value type: {value_type}")
+        return self.unpack(fmt)
+
+    def array(self) -> Any:
+        item_type = self.unpack("<I")
+        length = self.unpack("<Q")
+        if length <= MAX_ARRAY_ITEMS:
+            return [self.value(item_type) for _ in range(length)]
+
+        # Step over large arrays without materializing them
+        fmt = SCALAR_FORMATS.get(item_type)
+        if fmt is not None:
+            self.offset += struct.calcsize(fmt) * length
+        elif item_type == GGUF_TYPE_STRING:
+            # Hot loop for vocabularies of ~150k tokens
+            buffer, offset = self.buffer, self.offset
+            unpack_length = UINT64.unpack_from
+            for _ in range(length):
+                offset += 8 + unpack_length(buffer, offset)[0]
+            if offset > len(buffer):
+                raise GGUFFormatError("String array runs past the end of the file")
+            self.offset = offset
+        else:
+            for _ in range(length):
+                self.value(item_type)
+        return {"array_length": length}
+
+def read_gguf_header(path: str) -> Dict[str, Any]:
+    """Read metadata and tensor descriptors from a GGUF file without loading weights.
+
+    The file is memory-mapped read-only and only the header pages are touched.
+    """
+    start_time = time.time()
+    file_size = os.path.getsize(path)
+
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise GGUFFormatError(f"Empty file: {path}")
+        try:
+            parser = _HeaderParser(buffer)
+            if buffer[:4] != GGUF_MAGIC:
+                raise GGUFFormatError(f"Not a GGUF file: {path}")
+            parser.offset = 4
+            version = parser.unpack("<I")
+            if version < 2:
+                raise GGUFFormatError(f"Unsupported GGUF version: {version}")
+            tensor_count = parser.unpack("<Q")
+            kv_count = parser.unpack("<Q")
+
+            metadata: Dict[str, Any] = {}
+            for _ in range(kv_count):
+                key = parser.string()
+                metadata[key] = parser.value(parser.unpack("<I"))
+
+            tensors: List[Tuple[str, List[int], int]] = []
+            for _ in range(tensor_count):
+                name = parser.string()
+                n_dims = parser.unpack("<I")
+                dims = [parser.unpack("<Q") for _ in range(n_dims)]
+                tensor_type = parser.unpack("<I")
+                parser.unpack("<Q")  # data offset
+                tensors.append((name, dims, tensor_type))
+            header_size = parser.offset
+        finally:
+            buffer.close()
+
+    return _summarize(path, file_size, version, metadata, tensors, header_size, time.time() - start_time)
+
+def _summarize(path: str, file_size: int, version: int, metadata: Dict[str, Any],
+               tensors: List[Tuple[str, List[int], int]], header_size: int, parse_time: float) -> Dict[str, Any]:
+    architecture = metadata.get("general.architecture")
+
+    def arch_value(key: str) -> Optional[Any]:
+        return metadata.get(f"{architecture}.{key}") if architecture else None
+
+    parameter_count = 0
+    vocab_size = arch_value("vocab_size")
+    tensor_types: Dict[str, int] = {}
+    groups: Dict[str, Dict[str, int]] = {}
+    for name, dims, tensor_type in tensors:
+        if name == "token_embd.weight" and len(dims) == 2:
+            vocab_size = dims[1]
+        count = 1
+        for dim in dims:
+            count *= dim
+        parameter_count += count
+        type_name = GGML_TYPE_NAMES.get(tensor_type, str(tensor_type))
+        tensor_types[type_name] = tensor_types.get(type_name, 0) + 1
+        group = BLOCK_PREFIX.sub("", name)
+        groups.setdefault(group, {})
+        groups[group][type_name] = groups[group].get(type_name, 0) + 1
+
+    file_type = metadata.get("general.file_type")
+    return {
+        "path": path,
+        "file_size": file_size,
+        "gguf_version": version,
+        "name": metadata.get("general.name"),
+        "architecture": architecture,
+        "file_type": FILE_TYPE_NAMES.get(file_type, file_type) if file_type is not None else None,
+        "context_length": arch_value("context_length"),
+        "embedding_length": arch_value("embedding_length"),
+        "block_count": arch_value("block_count"),
+        "head_count": arch_value("attention.head_count"),
+        "head_count_kv": arch_value("attention.head_count_kv"),
+        "key_length": arch_value("attention.key_length"),
+        "value_length": arch_value("attention.value_length"),
+        "vocab_size": vocab_size,
+        "parameter_count": parameter_count,
+        "tensor_count": len(tensors),
+        "tensor_types": tensor_types,
+        "quantization_by_group": {
+            group: next(iter(types)) if len(types) == 1 else types
+            for group, types in sorted(groups.items())
+        },
+        "header_size": header_size,
+        "parse_time_ms": round(parse_time * 1000, 2),
+        "metadata": {key: value for key, value in metadata.items() if not key.startswith("tokenizer.")}
+    }
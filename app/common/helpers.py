@@ -2,7 +2,9 @@
 import json
 import os
 import subprocess
-from typing import Dict, Any
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
 
 def ensure_directory_exists(directory_path: str):
     """Ensure a directory exists, create if it doesn't"""
@@ -20,9 +22,54 @@ def run_command(cmd: list, cwd: str = None) -> bool:
         print(f"Error running command: {e}")
         return False
 
+class CommandError(RuntimeError):
+    """Raised when a command exits with a non-zero status"""
+
+    def __init__(self, cmd: List[str], returncode: int, output: str):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.output = output
+        super().__init__(f"Command {' '.join(cmd)} failed with exit code {returncode}:\n{output}")
+
+def run_logged_command(cmd: List[str], cwd: Optional[str] = None, log_path: Optional[str] = None,
+                       tail_lines: int = 20) -> float:
+    """Run a command, appending its combined output to ``log_path``.
+
+    Returns the duration in seconds and raises ``CommandError`` carrying the
+    last ``tail_lines`` lines of output when the command fails.
+    """
+    start_time = time.time()
+    if log_path is None:
+        result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output = result.stdout.splitlines()[-tail_lines:]
+    else:
+        ensure_directory_exists(os.path.dirname(log_path) or ".")
+        with open(log_path, "a") as log:
+            log.write(f"$ {' '.join(cmd)}  (cwd={cwd or os.getcwd()})\n")
+            log.flush()
+            result = subprocess.run(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, text=True)
+            log.write(f"# exit code {result.returncode} after {time.time() - start_time:.1f}s\n")
+        with open(log_path, errors="replace") as log:
+            output = [line.rstrip("\n") for line in deque(log, maxlen=tail_lines)]
+
+    if result.returncode != 0:
+        raise CommandError(cmd, result.returncode, "\n".join(output))
+    return time.time() - start_time
+
 def validate_json_input(json_input: str) -> Dict[str, Any]:
     """Validate and parse JSON input"""
     try:
         return json.loads(json_input)
     except json.JSONDecodeError:
-        raise ValueError("Invalid JSON input")
\ No newline at end of file
+        raise ValueError("Invalid JSON input")
+
+def format_sse(data: Dict[str, Any], event: str = None) -> str:
+    """Format a dictionary as a Server-Sent Events message"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+def format_json_line(data: Dict[str, Any]) -> str:
+    """Format a dictionary as a single JSON line"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
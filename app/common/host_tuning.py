@@ -0,0 +1,300 @@
+# Host CPU topology detection and llama.cpp thread/batch tuning
+import gc
+import glob
+import hashlib
+import json
+import math
+import os
+import socket
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set
+from .constants import DEFAULT_BATCH_SIZE, TUNING_BATCH_CANDIDATES, TUNING_CACHE_PATH, TUNING_PROMPT_TOKENS, TUNING_DECODE_TOKENS
+from .helpers import ensure_directory_exists
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+SYS_CPU_DIR = "/sys/devices/system/cpu"
+SYS_NODE_DIR = "/sys/devices/system/node"
+CGROUP_DIR = "/sys/fs/cgroup"
+
+# Text repeated into the calibration prompt
+CALIBRATION_TEXT = "Doanh thu thuần quý này tăng trưởng ổn định, biên lợi nhuận gộp cải thiện so với cùng kỳ năm trước. "
+
+def parse_cpu_list(value: str) -> Set[int]:
+    """Parse a kernel CPU list such as ``0-3,8,10-11``"""
+    cpus = set()
+    for part in value.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit(cgroup_dir: str = CGROUP_DIR) -> Optional[float]:
+    """CPU quota of the current cgroup in cores, or None when unlimited.
+
+    Supports both cgroup v2 (``cpu.max``) and v1 (``cpu.cfs_quota_us``).
+    """
+    cpu_max = _read_text(os.path.join(cgroup_dir, "cpu.max"))
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+
+    quota = _read_text(os.path.join(cgroup_dir, "cpu", "cpu.cfs_quota_us"))
+    period = _read_text(os.path.join(cgroup_dir, "cpu", "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+class HostProfile:
+    """CPUs this process may use and how they map to cores and NUMA nodes"""
+
+    def __init__(self, cpus: Iterable[int], cores: Dict[int, Any], numa_nodes: Dict[int, Set[int]],
+                 cpu_limit: Optional[float] = None, cpu_model: str = ""):
+        self.cpus = sorted(cpus)
+        self.cores = cores              # cpu -> (package, core) it belongs to
+        self.numa_nodes = numa_nodes    # node -> usable cpus on it
+        self.cpu_limit = cpu_limit
+        self.cpu_model = cpu_model
+
+    @classmethod
+    def detect(cls) -> "HostProfile":
+        """Read the affinity mask, cgroup quota, core siblings and NUMA layout"""
+        try:
+            cpus = os.sched_getaffinity(0)
+        except AttributeError:
+            cpus = set(range(os.cpu_count() or 1))
+
+        cores = {}
+        for cpu in cpus:
+            topology = os.path.join(SYS_CPU_DIR, f"cpu{cpu}", "topology")
+            package = _read_text(os.path.join(topology, "physical_package_id"))
+            core = _read_text(os.path.join(topology, "core_id"))
+            cores[cpu] = (package, core) if core is not None else (None, cpu)
+
+        numa_nodes = {}
+        for node_dir in glob.glob(os.path.join(SYS_NODE_DIR, "node[0-9]*")):
+            node_cpus = parse_cpu_list(_read_text(os.path.join(node_dir, "cpulist")) or "") & cpus
+            if node_cpus:
+                numa_nodes[int(os.path.basename(node_dir)[4:])] = node_cpus
+
+        cpu_model = ""
+        for line in (_read_text("/proc/cpuinfo") or "").splitlines():
+            if line.startswith("model name"):
+                cpu_model = line.split(":", 1)[1].strip()
+                break
+
+        return cls(cpus, cores, numa_nodes, cgroup_cpu_limit(), cpu_model)
+
+    @property
+    def logical_cpus(self) -> int:
+        return len(self.cpus)
+
+    @property
+    def physical_cores(self) -> int:
+        return len(set(self.cores.values())) or self.logical_cpus
+
+    @property
+    def usable_cpus(self) -> int:
+        """Logical CPUs actually available once the cgroup quota is applied"""
+        if self.cpu_limit is None:
+            return self.logical_cpus
+        return max(1, min(self.logical_cpus, math.floor(self.cpu_limit)))
+
+    def key(self) -> str:
+        """Identifies this host and CPU allotment in the tuning cache"""
+        parts = [socket.gethostname(), self.cpu_model, str(self.cpus), str(self.cpu_limit)]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "cpu_model": self.cpu_model,
+            "logical_cpus": self.logical_cpus,
+            "physical_cores": self.physical_cores,
+            "cpu_limit": self.cpu_limit,
+            "usable_cpus": self.usable_cpus,
+            "numa_nodes": {str(node): len(cpus) for node, cpus in sorted(self.numa_nodes.items())}
+        }
+
+def _split(cores: List[List[int]], parts: int) -> List[List[int]]:
+    """Split a list of cores into ``parts`` contiguous CPU sets"""
+    return [
+        sorted(cpu for siblings in cores[index * len(cores) // parts:(index + 1) * len(cores) // parts] for cpu in siblings)
+        for index in range(parts)
+    ]
+
+def partition_cpus(profile: HostProfile, workers: Optional[int] = None, cores_per_worker: int = 1) -> List[List[int]]:
+    """Split the usable CPUs into disjoint sets, one per worker process.
+
+    SMT siblings always stay in the same set. Without ``workers``, each
+    NUMA node gets one worker per ``cores_per_worker`` physical cores; an
+    explicit worker count is spread evenly over the nodes when it divides
+    them, otherwise sets may span nodes. The cgroup quota caps how many
+    CPUs are handed out.
+    """
+    node_of = {cpu: node for node, cpus in profile.numa_nodes.items() for cpu in cpus}
+    by_core: Dict[Any, List[int]] = {}
+    for cpu in profile.cpus:
+        by_core.setdefault((node_of.get(cpu, 0), profile.cores[cpu]), []).append(cpu)
+    cores = [by_core[key] for key in sorted(by_core, key=lambda key: (key[0], min(by_core[key])))]
+
+    # Respect the cgroup quota by dropping whole cores from the end
+    while len(cores) > 1 and sum(len(siblings) for siblings in cores) > profile.usable_cpus:
+        cores.pop()
+
+    nodes: Dict[int, List[List[int]]] = {}
+    for siblings in cores:
+        nodes.setdefault(node_of.get(siblings[0], 0), []).append(siblings)
+
+    if workers is None:
+        return [cpus for node_cores in nodes.values() for cpus in _split(node_cores, max(1, len(node_cores) // cores_per_worker))]
+    workers = max(1, min(workers, len(cores)))
+    if workers % len(nodes) == 0 and all(len(node_cores) >= workers // len(nodes) for node_cores in nodes.values()):
+        return [cpus for node_cores in nodes.values() for cpus in _split(node_cores, workers // len(nodes))]
+    return _split(cores, workers)
+
+def heuristic_settings(profile: HostProfile) -> Dict[str, Any]:
+    """Thread and batch settings derived from the topology alone.
+
+    Decode is memory-bandwidth bound and slows down when SMT siblings
+    compete for the same core, so it gets one thread per physical core.
+    Prefill is compute bound and uses every usable logical CPU.
+    """
+    usable = profile.usable_cpus
+    settings = {
+        "n_threads": max(1, min(profile.physical_cores, usable)),
+        "n_threads_batch": usable,
+        "n_batch": DEFAULT_BATCH_SIZE
+    }
+    if len(profile.numa_nodes) > 1:
+        settings["numa"] = True     # Spread threads and memory across nodes
+    return settings
+
+def _candidate_threads(profile: HostProfile) -> List[int]:
+    """Thread counts tried by the calibration"""
+    usable = profile.usable_cpus
+    physical = min(profile.physical_cores, usable)
+    candidates = {physical, usable, max(1, physical // 2), max(1, physical * 3 // 4)}
+    for node_cpus in profile.numa_nodes.values():
+        candidates.add(min(len(set(profile.cores[cpu] for cpu in node_cpus)), usable))
+    return sorted(candidates)
+
+def _measure(model: "Llama", prompt_tokens: int, decode_tokens: int) -> Dict[str, float]:
+    """Prefill and decode throughput of one greedy generation"""
+    text_tokens = model.tokenize(CALIBRATION_TEXT.encode("utf-8"), add_bos=False)
+    prompt = (text_tokens * (prompt_tokens // len(text_tokens) + 1))[:prompt_tokens]
+
+    model.reset()
+    start_time = time.time()
+    first_token_at = None
+    generated = 0
+    for _ in model.generate(prompt, temp=0.0, reset=True):
+        generated += 1
+        if first_token_at is None:
+            first_token_at = time.time()
+        if generated >= decode_tokens:
+            break
+    decode_time = time.time() - first_token_at
+    return {
+        "prefill_tokens_per_second": prompt_tokens / (first_token_at - start_time),
+        "decode_tokens_per_second": (generated - 1) / decode_time if decode_time > 0 else 0.0
+    }
+
+def calibrate_settings(model_path: str, profile: HostProfile, loader: Callable[..., "Llama"],
+                       prompt_tokens: int = TUNING_PROMPT_TOKENS, decode_tokens: int = TUNING_DECODE_TOKENS,
+                       batch_candidates: Iterable[int] = TUNING_BATCH_CANDIDATES) -> Dict[str, Any]:
+    """Pick thread counts and batch size by timing short generations.
+
+    Every thread count is loaded once and timed for both phases; the batch
+    sizes are then tried with the fastest prefill thread count. Weights are
+    memory mapped, so reloads after the first come from the page cache.
+    """
+    settings = heuristic_settings(profile)
+    numa = {"numa": settings["numa"]} if "numa" in settings else {}
+    n_ctx = prompt_tokens + decode_tokens + 8
+    measurements = []
+
+    def measure(threads: int, n_batch: int) -> Dict[str, float]:
+        model = loader(model_path, threads=threads, use_mlock=False, n_ctx=n_ctx,
+                       n_threads_batch=threads, n_batch=n_batch, **numa)
+        try:
+            _measure(model, min(prompt_tokens, 8), 2)   # Fault the weights in before timing
+            result = _measure(model, prompt_tokens, decode_tokens)
+        finally:
+            del model
+            gc.collect()
+        measurements.append({"threads": threads, "n_batch": n_batch, **result})
+        return result
+
+    by_threads = {threads: measure(threads, settings["n_batch"]) for threads in _candidate_threads(profile)}
+    settings["n_threads"] = max(by_threads, key=lambda t: by_threads[t]["decode_tokens_per_second"])
+    settings["n_threads_batch"] = max(by_threads, key=lambda t: by_threads[t]["prefill_tokens_per_second"])
+
+    by_batch = {settings["n_batch"]: by_threads[settings["n_threads_batch"]]}
+    for n_batch in batch_candidates:
+        if n_batch not in by_batch:
+            by_batch[n_batch] = measure(settings["n_threads_batch"], n_batch)
+    settings["n_batch"] = max(by_batch, key=lambda b: by_batch[b]["prefill_tokens_per_second"])
+
+    return {**settings, "calibrated": True, "measurements": measurements}
+
+class ThreadTuner:
+    """Chooses llama.cpp thread and batch settings per host and model.
+
+    Without calibration the settings come from the CPU topology. With
+    calibration a short benchmark runs on the first load of each model and
+    its result is cached in ``cache_path``, keyed by host and model file, so
+    later loads and restarts reuse it.
+    """
+
+    def __init__(self, cache_path: str = TUNING_CACHE_PATH, profile: Optional[HostProfile] = None):
+        self.cache_path = cache_path
+        self.profile = profile or HostProfile.detect()
+
+    def _cache_key(self, model_path: str) -> str:
+        stat = os.stat(model_path)
+        return f"{self.profile.key()}|{os.path.basename(model_path)}|{stat.st_size}"
+
+    def _read_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, key: str, settings: Dict[str, Any]):
+        cache = self._read_cache()
+        cache[key] = {**settings, "host": self.profile.to_dict(), "tuned_at": time.time()}
+        ensure_directory_exists(os.path.dirname(self.cache_path) or ".")
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def settings_for(self, model_path: str, calibrate: bool = False,
+                     loader: Optional[Callable[..., "Llama"]] = None) -> Dict[str, Any]:
+        """Llama keyword arguments for ``model_path`` on this host"""
+        key = self._cache_key(model_path)
+        cached = self._read_cache().get(key)
+        if cached is not None and (cached.get("calibrated") or not calibrate):
+            settings = cached
+        elif calibrate and loader is not None:
+            print(f"Calibrating thread settings for {os.path.basename(model_path)}")
+            settings = calibrate_settings(model_path, self.profile, loader)
+            self._write_cache(key, settings)
+        else:
+            settings = heuristic_settings(self.profile)
+        return {name: settings[name] for name in ("n_threads", "n_threads_batch", "n_batch", "numa") if name in settings}
@@ -0,0 +1,81 @@
+# KV cache element types, memory estimates and context sizing
+import math
+from typing import Any, Dict, Iterable, Optional
+from .constants import (
+    CONTEXT_SIZE_PERCENTILE,
+    CONTEXT_SIZE_HEADROOM,
+    CONTEXT_SIZE_MIN,
+    CONTEXT_SIZE_STEP
+)
+
+# KV cache types: GGML type id and bytes per element (block bytes / block size)
+KV_CACHE_TYPES = {
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q4_0": (2, 18 / 32)
+}
+
+def check_kv_cache_type(type_name: str) -> str:
+    """Validate a KV cache type name"""
+    if type_name not in KV_CACHE_TYPES:
+        raise ValueError(f"Unsupported KV cache type {type_name!r}; expected one of {sorted(KV_CACHE_TYPES)}")
+    return type_name
+
+def kv_cache_options(type_k: str, type_v: str) -> Dict[str, Any]:
+    """``Llama`` arguments for a K/V cache of the given types.
+
+    llama.cpp only supports a quantized V cache with flash attention, so it
+    is enabled whenever V is not F16.
+    """
+    options: Dict[str, Any] = {
+        "type_k": KV_CACHE_TYPES[check_kv_cache_type(type_k)][0],
+        "type_v": KV_CACHE_TYPES[check_kv_cache_type(type_v)][0]
+    }
+    if type_v != "f16":
+        options["flash_attn"] = True
+    return options
+
+def kv_cache_bytes(header: Dict[str, Any], n_ctx: int, type_k: str, type_v: str) -> Optional[int]:
+    """KV cache size of a model for ``n_ctx`` tokens, from its GGUF header.
+
+    Returns None when the header lacks the attention shape.
+    """
+    layers = header.get("block_count")
+    heads = header.get("head_count")
+    heads_kv = header.get("head_count_kv") or heads
+    if not layers or not heads_kv:
+        return None
+    head_dim = header.get("embedding_length", 0) // heads if heads else 0
+    key_length = header.get("key_length") or head_dim
+    value_length = header.get("value_length") or head_dim
+    if not key_length or not value_length:
+        return None
+    per_token = heads_kv * (key_length * KV_CACHE_TYPES[type_k][1] + value_length * KV_CACHE_TYPES[type_v][1])
+    return int(n_ctx * layers * per_token)
+
+def logits_bytes(header: Dict[str, Any], rows: int) -> Optional[int]:
+    """Size of ``rows`` float32 logit rows over the model's vocabulary, from its GGUF header.
+
+    llama_cpp keeps one row per batch position, or per context position
+    when loaded with ``logits_all``. Returns None when the vocabulary size
+    is unknown.
+    """
+    vocab_size = header.get("vocab_size")
+    return int(rows * vocab_size * 4) if vocab_size else None
+
+def recommend_context_size(lengths: Iterable[int], maximum: Optional[int] = None,
+                           percentile: float = CONTEXT_SIZE_PERCENTILE, headroom: float = CONTEXT_SIZE_HEADROOM,
+                           minimum: int = CONTEXT_SIZE_MIN, step: int = CONTEXT_SIZE_STEP) -> Optional[int]:
+    """Smallest context holding ``percentile`` of the observed sequence lengths, with headroom.
+
+    The result is rounded up to a multiple of ``step`` and kept within
+    ``minimum`` and ``maximum`` (the model's training context). Returns None
+    without observations.
+    """
+    ordered = sorted(lengths)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(percentile * len(ordered)) - 1))
+    size = math.ceil(ordered[index] * headroom / step) * step
+    size = max(size, minimum)
+    return min(size, maximum) if maximum else size
@@ -1,24 +1,87 @@
 # Model-related utilities
-from llama_cpp import Llama
-from .constants import DEFAULT_THREADS, DEFAULT_BATCH_SIZE, DEFAULT_CONTEXT_SIZE
+from .constants import (
+    DEFAULT_THREADS, DEFAULT_BATCH_SIZE, DEFAULT_CONTEXT_SIZE, MODEL_USE_MLOCK, QUANT_MANIFEST_PATH,
+    THREADS_AUTO, TUNING_CALIBRATE, THINKING_OFF, THINKING_ON, THINKING_DEFAULT_BUDGET, KV_CACHE_TYPE_K, KV_CACHE_TYPE_V
+)
+from .host_tuning import ThreadTuner
+from .kv_cache import kv_cache_options
 import json
+import re
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
-def create_optimized_llama(model_path: str, threads: int = DEFAULT_THREADS) -> Llama:
-    """Create an optimized Llama instance for inference"""
-    return Llama(
+# llama_cpp is imported on first model load to keep startup fast
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+@lru_cache(maxsize=1)
+def get_thread_tuner() -> ThreadTuner:
+    """Process-wide tuner; the host topology is detected once"""
+    return ThreadTuner()
+
+def create_optimized_llama(model_path: str, threads: Union[int, str] = DEFAULT_THREADS, use_mlock: bool = MODEL_USE_MLOCK,
+                           n_ctx: int = DEFAULT_CONTEXT_SIZE, calibrate: bool = TUNING_CALIBRATE,
+                           type_k: str = KV_CACHE_TYPE_K, type_v: str = KV_CACHE_TYPE_V,
+                           **overrides: Any) -> "Llama":
+    """Create an optimized Llama instance for inference.
+
+    With ``threads=THREADS_AUTO`` the prefill/decode thread counts and batch
+    size are chosen for this host (and calibrated and cached per model when
+    ``calibrate`` is set). ``type_k``/``type_v`` select the KV cache element
+    types ("f16", "q8_0" or "q4_0"). ``overrides`` are passed to ``Llama``
+    as-is, e.g. ``logits_all=True``, and win over the tuned values.
+    """
+    from llama_cpp import Llama
+
+    if threads == THREADS_AUTO:
+        tuned = get_thread_tuner().settings_for(model_path, calibrate, loader=create_optimized_llama)
+    else:
+        tuned = dict(n_threads=threads, n_threads_batch=threads, n_batch=DEFAULT_BATCH_SIZE)
+
+    params = dict(
         model_path=model_path,
-        n_ctx=DEFAULT_CONTEXT_SIZE,
-        n_batch=DEFAULT_BATCH_SIZE,
-        n_threads=threads,
+        n_ctx=n_ctx,
+        **tuned,
         n_gpu_layers=0,     # CPU-only
-        use_mlock=True,     # Lock memory to prevent swapping
+        use_mlock=use_mlock,  # Lock memory to prevent swapping
         use_mmap=True,      # Use memory mapping for faster loading
-        verbose=False
+        verbose=False,
+        **kv_cache_options(type_k, type_v)
     )
-    
-def create_financial_prompt(company_data) -> str:
-    """Create a financial analysis prompt from company data"""
-    base_prompt = """
+    params.update(overrides)
+    return Llama(**params)
+
+def read_model_manifest(manifest_path: str = QUANT_MANIFEST_PATH) -> Dict[str, Any]:
+    """Load the manifest of quantized models written by the quantization pipeline.
+
+    Model paths in the manifest are relative to the manifest's directory.
+    Returns an empty manifest when the file does not exist.
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"models": []}
+    manifest.setdefault("models", [])
+    return manifest
+
+# Qwen3 chat (ChatML) markers
+CHAT_TURN_START = "<|im_start|>"
+CHAT_TURN_END = "<|im_end|>"
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+# Appended when the reasoning budget runs out, as recommended for Qwen3
+THINK_BUDGET_EXHAUSTED = (
+    "\n\nConsidering the limited time by the user, I have to give the solution based on the thinking directly now.\n"
+)
+
+THINK_BLOCK_PATTERN = re.compile(rf"{re.escape(THINK_START)}.*?(?:{re.escape(THINK_END)}|$)\s*", re.DOTALL)
+
+FINANCIAL_SYSTEM_PROMPT = "Bạn là một chuyên gia phân tích đầu tư cao cấp."
+
+FINANCIAL_PROMPT_TEMPLATE = """
     Bạn là một chuyên gia phân tích đầu tư cao cấp tại một quỹ đầu tư lớn. 
     Nhiệm vụ của bạn là xem xét các kết quả định lượng và viết một báo cáo tổng hợp súc tích, chuyên nghiệp.
 
@@ -32,4 +95,90 @@ def create_financial_prompt(company_data) -> str:
 
     Văn phong chuyên nghiệp, tự tin và tập trung vào kết quả.
     """
-    return base_prompt.format(company_data=json.dumps(company_data, indent=2, ensure_ascii=False))
\ No newline at end of file
+
+def serialize_company_data(company_data) -> str:
+    """Compact JSON for the prompt: no indentation or spaces after separators, which tokenize to nothing useful"""
+    return json.dumps(company_data, ensure_ascii=False, separators=(",", ":"))
+
+def create_financial_prompt(company_data) -> str:
+    """Create a financial analysis prompt from company data"""
+    return FINANCIAL_PROMPT_TEMPLATE.format(company_data=serialize_company_data(company_data))
+
+def create_financial_prompt_prefix() -> str:
+    """Return the fixed part of the financial prompt that precedes the company data"""
+    return FINANCIAL_PROMPT_TEMPLATE.split("{company_data}")[0]
+
+def format_chat_prompt(messages: List[Dict[str, str]], add_generation_prompt: bool = True,
+                       enable_thinking: bool = True) -> str:
+    """Render chat messages with the Qwen3 ChatML template.
+
+    Like Qwen3's ``enable_thinking=False``, disabling thinking pre-fills an
+    empty reasoning block so the model answers directly.
+    """
+    prompt = "".join(
+        f"{CHAT_TURN_START}{message['role']}\n{message['content']}{CHAT_TURN_END}\n"
+        for message in messages
+    )
+    if add_generation_prompt:
+        prompt += f"{CHAT_TURN_START}assistant\n"
+        if not enable_thinking:
+            prompt += f"{THINK_START}\n\n{THINK_END}\n\n"
+    return prompt
+
+def resolve_thinking_budget(thinking: Union[str, int, None]) -> int:
+    """Reasoning token budget for a request's ``thinking`` setting; 0 disables thinking"""
+    if thinking is None or thinking == THINKING_OFF:
+        return 0
+    if thinking == THINKING_ON:
+        return THINKING_DEFAULT_BUDGET
+    try:
+        budget = int(thinking)
+    except (TypeError, ValueError):
+        raise ValueError(f"thinking must be '{THINKING_OFF}', '{THINKING_ON}' or a token budget, not {thinking!r}")
+    if budget < 0:
+        raise ValueError("The thinking budget cannot be negative")
+    return budget
+
+def strip_thinking(text: str) -> str:
+    """Remove <think> blocks, including an unterminated trailing one, from model output"""
+    return THINK_BLOCK_PATTERN.sub("", text)
+
+class GenerationTimer:
+    """Record the phase timestamps of a single generation.
+
+    An instance is also passed to llama_cpp as a stopping criterion; it is
+    called once per sampled token, which lets it time the first and last
+    decoded token. It only stops generation when ``cancelled`` returns
+    True, i.e. between tokens once the caller has gone away, or once the
+    ``deadline`` (epoch seconds) has passed. ``stop_reason`` tells which.
+    """
+
+    def __init__(self, enqueued_at: float, cancelled: Optional[Callable[[], bool]] = None,
+                 deadline: Optional[float] = None):
+        self.enqueued_at = enqueued_at
+        self.cancelled = cancelled
+        self.deadline = deadline
+        self.marks: Dict[str, float] = {}
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.sampled_tokens = 0
+        self.stopped = False
+        self.stop_reason: Optional[str] = None
+
+    def mark(self, phase: str):
+        """Record the end of a phase"""
+        self.marks[phase] = time.time()
+
+    def __call__(self, input_ids, logits) -> bool:
+        now = time.time()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.last_token_at = now
+        self.sampled_tokens += 1
+        if self.stopped:
+            return True
+        if self.cancelled is not None and self.cancelled():
+            self.stopped, self.stop_reason = True, "cancelled"
+        elif self.deadline is not None and now >= self.deadline:
+            self.stopped, self.stop_reason = True, "deadline"
+        return self.stopped
@@ -0,0 +1,291 @@
+# Incremental dependency-graph runner for build pipelines
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from .helpers import ensure_directory_exists
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024**2
+
+# Step statuses
+STEP_DONE = "done"
+STEP_UP_TO_DATE = "up_to_date"
+STEP_FAILED = "failed"
+STEP_BLOCKED = "blocked"
+
+def fingerprint_path(path: str, content_hash: bool = False, exclude: Iterable[str] = ()) -> Optional[str]:
+    """Fingerprint a file or directory tree.
+
+    By default only sizes and modification times are hashed, which is cheap
+    even for multi-gigabyte weights. ``content_hash`` hashes file contents
+    instead. Directory names in ``exclude`` are skipped. Returns None when
+    the path does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        excluded = set(exclude)
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in excluded)
+            files.extend(os.path.join(root, name) for name in sorted(names))
+
+    digest = hashlib.sha256()
+    for file_path in files:
+        digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+        if content_hash:
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+        else:
+            stat = os.stat(file_path)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+class PipelineStep:
+    """A node of the pipeline graph.
+
+    ``action`` receives the path of the step's log file and raises on
+    failure. The step is skipped when its outputs exist and neither its
+    inputs, its ``params`` nor its outputs changed since it last succeeded.
+    ``cpu`` and ``disk_bytes`` are the cores and free disk space it needs
+    while running; ``disk_bytes`` may be a callable evaluated when the step
+    is about to start, once its dependencies have produced their outputs.
+    """
+
+    def __init__(self, name: str, action: Callable[[str], Any], inputs: Iterable[str] = (),
+                 outputs: Iterable[str] = (), depends_on: Iterable[str] = (), params: Optional[Dict[str, Any]] = None,
+                 cpu: int = 1, disk_bytes: Union[int, Callable[[], int]] = 0, content_hash: bool = False, exclude: Iterable[str] = ()):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends_on = list(depends_on)
+        self.params = params or {}
+        self.cpu = cpu
+        self.disk_bytes = disk_bytes
+        self.content_hash = content_hash
+        self.exclude = list(exclude)
+
+    def required_disk_bytes(self) -> int:
+        return self.disk_bytes() if callable(self.disk_bytes) else self.disk_bytes
+
+    def fingerprint(self) -> Dict[str, Any]:
+        """Current fingerprints of inputs and outputs, plus the step parameters"""
+        return {
+            "params": self.params,
+            "inputs": {path: fingerprint_path(path, self.content_hash, self.exclude) for path in self.inputs},
+            "outputs": {path: fingerprint_path(path, False, self.exclude) for path in self.outputs}
+        }
+
+class StepResult:
+    """Outcome and timing of one pipeline step"""
+
+    def __init__(self, name: str, status: str, duration: float = 0.0, error: Optional[str] = None,
+                 log_path: Optional[str] = None):
+        self.name = name
+        self.status = status
+        self.duration = duration
+        self.error = error
+        self.log_path = log_path
+        self.finished_at = time.time()
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (STEP_DONE, STEP_UP_TO_DATE)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "duration": round(self.duration, 2),
+            "error": self.error,
+            "log_path": self.log_path,
+            "finished_at": self.finished_at
+        }
+
+class PipelineRunner:
+    """Runs pipeline steps in dependency order, skipping up-to-date ones.
+
+    Independent steps run concurrently as long as their combined ``cpu``
+    fits ``cpu_budget`` and the disk they need leaves ``disk_reserve_bytes``
+    free. A failing step only blocks the steps that depend on it. Success
+    stamps and per-step logs live under ``state_dir``.
+    """
+
+    def __init__(self, steps: List[PipelineStep], state_dir: str, cpu_budget: Optional[int] = None,
+                 disk_reserve_bytes: int = 0):
+        self.steps = {step.name: step for step in steps}
+        self.state_dir = state_dir
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.disk_reserve_bytes = disk_reserve_bytes
+        self._validate()
+
+    def _validate(self):
+        """Reject unknown dependencies and cycles"""
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step '{step.name}' depends on unknown step '{dependency}'")
+
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+            visiting.add(name)
+            for dependency in self.steps[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def _stamp_path(self, step: PipelineStep) -> str:
+        return os.path.join(self.state_dir, "stamps", f"{step.name}.json")
+
+    def log_path(self, step: PipelineStep) -> str:
+        return os.path.join(self.state_dir, "logs", f"{step.name}.log")
+
+    def is_up_to_date(self, step: PipelineStep) -> bool:
+        """True when the step's outputs exist and match its last successful run"""
+        if not step.outputs or not all(os.path.exists(path) for path in step.outputs):
+            return False
+        try:
+            with open(self._stamp_path(step)) as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return stamp.get("fingerprint") == step.fingerprint()
+
+    def _write_stamp(self, step: PipelineStep, duration: float):
+        path = self._stamp_path(step)
+        ensure_directory_exists(os.path.dirname(path))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": step.fingerprint(), "duration": duration, "finished_at": time.time()}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _free_disk_bytes(self, step: PipelineStep) -> int:
+        directory = os.path.dirname(os.path.abspath(step.outputs[0])) if step.outputs else self.state_dir
+        while not os.path.exists(directory):
+            directory = os.path.dirname(directory)
+        return shutil.disk_usage(directory).free
+
+    def execute(self, step: PipelineStep) -> StepResult:
+        """Run a single step, ignoring its dependencies, and stamp it on success"""
+        log_path = self.log_path(step)
+        ensure_directory_exists(os.path.dirname(log_path))
+        with open(log_path, "w") as log:
+            log.write(f"# step {step.name} started at {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+        start_time = time.time()
+        try:
+            step.action(log_path)
+            missing = [path for path in step.outputs if not os.path.exists(path)]
+            if missing:
+                raise RuntimeError(f"Step finished without producing {', '.join(missing)}")
+        except Exception as e:
+            return StepResult(step.name, STEP_FAILED, time.time() - start_time, str(e), log_path)
+
+        duration = time.time() - start_time
+        self._write_stamp(step, duration)
+        return StepResult(step.name, STEP_DONE, duration, log_path=log_path)
+
+    def run(self, targets: Optional[Iterable[str]] = None, force: bool = False) -> List[StepResult]:
+        """Run ``targets`` (default: every step) and their dependencies.
+
+        Returns the step results in completion order and writes them to
+        ``last_run.json`` in the state directory.
+        """
+        selected = self._with_dependencies(targets if targets is not None else self.steps)
+        results: Dict[str, StepResult] = {}
+        order: List[StepResult] = []
+        running: Dict[Future, PipelineStep] = {}
+        start_time = time.time()
+
+        def finish(result: StepResult):
+            results[result.name] = result
+            order.append(result)
+            level = logging.INFO if result.ok else logging.ERROR
+            logger.log(level, "step=%s status=%s duration=%.2fs%s", result.name, result.status, result.duration,
+                       f" error={result.error}" if result.error else "")
+
+        with ThreadPoolExecutor(max_workers=max(len(selected), 1), thread_name_prefix="pipeline") as executor:
+            while len(results) < len(selected):
+                for name in selected:
+                    step = self.steps[name]
+                    if name in results or step in running.values():
+                        continue
+                    dependencies = [results.get(dependency) for dependency in step.depends_on]
+                    if any(result is not None and not result.ok for result in dependencies):
+                        failed = [d for d, r in zip(step.depends_on, dependencies) if r is not None and not r.ok]
+                        finish(StepResult(name, STEP_BLOCKED, error=f"Blocked by failed step(s): {', '.join(failed)}"))
+                        continue
+                    if any(result is None for result in dependencies):
+                        continue
+                    if not force and self.is_up_to_date(step):
+                        finish(StepResult(name, STEP_UP_TO_DATE, log_path=self.log_path(step)))
+                        continue
+                    if not self._fits(step, running):
+                        if not running:
+                            finish(StepResult(name, STEP_FAILED, error=(
+                                f"Needs {step.required_disk_bytes()} bytes of free disk plus a {self.disk_reserve_bytes} byte reserve"
+                            )))
+                        continue
+                    logger.info("step=%s status=started cpu=%d", name, step.cpu)
+                    running[executor.submit(self.execute, step)] = step
+
+                if running:
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.pop(future)
+                        finish(future.result())
+
+        self._write_summary(order, time.time() - start_time)
+        return order
+
+    def _with_dependencies(self, targets: Iterable[str]) -> List[str]:
+        """Targets plus everything they depend on, in declaration order"""
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.steps:
+                raise ValueError(f"Unknown pipeline step: {name}")
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.steps[name].depends_on)
+        return [name for name in self.steps if name in needed]
+
+    def _fits(self, step: PipelineStep, running: Dict[Future, PipelineStep]) -> bool:
+        """Whether the step can start next to the running ones"""
+        if running and sum(s.cpu for s in running.values()) + step.cpu > self.cpu_budget:
+            return False
+        required = step.required_disk_bytes()
+        if required:
+            reserved = sum(s.required_disk_bytes() for s in running.values())
+            if self._free_disk_bytes(step) - reserved - required < self.disk_reserve_bytes:
+                return False
+        return True
+
+    def _write_summary(self, results: List[StepResult], duration: float):
+        ensure_directory_exists(self.state_dir)
+        with open(os.path.join(self.state_dir, "last_run.json"), "w") as f:
+            json.dump({
+                "duration": round(duration, 2),
+                "ok": all(result.ok for result in results),
+                "steps": [result.to_dict() for result in results]
+            }, f, indent=2)
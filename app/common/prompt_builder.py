@@ -0,0 +1,157 @@
+# Token-budgeted construction of financial analysis prompts
+import copy
+import re
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from .constants import (
+    PROMPT_RESERVED_COMPLETION_TOKENS,
+    PROMPT_MAX_STRING_CHARS,
+    PROMPT_MAX_PERIODS,
+    PROMPT_MAX_LIST_ITEMS,
+    PROMPT_LOW_PRIORITY_FIELDS,
+    PROMPT_PROTECTED_FIELDS
+)
+from .model_utils import FINANCIAL_SYSTEM_PROMPT, create_financial_prompt, format_chat_prompt, serialize_company_data
+
+YEAR_KEY_PATTERN = re.compile(r"^\d{4}$")
+
+# Key under which trimmed field paths are listed in the prompt data
+OMITTED_KEY = "_omitted"
+
+class PromptTooLongError(ValueError):
+    """Raised when the input does not fit the context even after trimming"""
+
+class BuiltPrompt:
+    """A tokenized chat prompt and the completion budget left beside it"""
+
+    def __init__(self, messages: List[Dict[str, str]], text: str, tokens: List[int], max_tokens: int,
+                 requested_max_tokens: int, original_tokens: int, trimmed: List[str]):
+        self.messages = messages
+        self.text = text
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.requested_max_tokens = requested_max_tokens
+        self.original_tokens = original_tokens
+        self.trimmed = trimmed
+
+    def budget(self) -> Dict[str, Any]:
+        return {
+            "max_tokens": self.max_tokens,
+            "max_tokens_clamped": self.max_tokens < self.requested_max_tokens,
+            "untrimmed_prompt_tokens": self.original_tokens,
+            "trimmed": self.trimmed
+        }
+
+def build_messages(company_data: Any) -> List[Dict[str, str]]:
+    """Chat messages for a financial analysis of ``company_data``"""
+    return [
+        {"role": "system", "content": FINANCIAL_SYSTEM_PROMPT},
+        {"role": "user", "content": create_financial_prompt(company_data)}
+    ]
+
+def _shorten_strings(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > PROMPT_MAX_STRING_CHARS:
+        return value[:PROMPT_MAX_STRING_CHARS] + "…"
+    if isinstance(value, dict):
+        return {key: _shorten_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shorten_strings(item) for item in value]
+    return value
+
+def _latest_periods(value: Any) -> Any:
+    """Keep the latest periods of year-keyed series and the head of long lists"""
+    if isinstance(value, dict):
+        if len(value) > PROMPT_MAX_PERIODS and all(YEAR_KEY_PATTERN.match(str(key)) for key in value):
+            kept = sorted(value, key=str)[-PROMPT_MAX_PERIODS:]
+            return {key: value[key] for key in kept}
+        return {key: _latest_periods(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_latest_periods(item) for item in value[:PROMPT_MAX_LIST_ITEMS]]
+    return value
+
+def _pop_path(data: Dict[str, Any], path: str) -> bool:
+    """Remove a dotted ``path`` from nested dicts. Returns whether it existed."""
+    *parents, leaf = path.split(".")
+    node = data
+    for key in parents:
+        node = node.get(key) if isinstance(node, dict) else None
+        if node is None:
+            return False
+    if isinstance(node, dict) and leaf in node:
+        del node[leaf]
+        return True
+    return False
+
+def trim_company_data(company_data: Any) -> Iterator[Tuple[str, Any]]:
+    """Yield ever smaller versions of ``company_data`` with a note of what was cut.
+
+    The order is fixed, so the same input is always trimmed the same way:
+    long strings are shortened, series are cut to their latest periods,
+    ``PROMPT_LOW_PRIORITY_FIELDS`` are dropped one by one, and finally the
+    largest remaining top-level fields outside ``PROMPT_PROTECTED_FIELDS``.
+    Dropped field paths are listed under ``_omitted`` so the model knows.
+    """
+    if not isinstance(company_data, dict):
+        return
+
+    data = _shorten_strings(copy.deepcopy(company_data))
+    if data != company_data:
+        yield "shortened long strings", data
+
+    shortened = _latest_periods(data)
+    if shortened != data:
+        data = shortened
+        yield f"kept the latest {PROMPT_MAX_PERIODS} periods and first {PROMPT_MAX_LIST_ITEMS} list items", data
+
+    omitted: List[str] = []
+
+    def drop(path: str) -> Dict[str, Any]:
+        omitted.append(path)
+        return {**data, OMITTED_KEY: list(omitted)}
+
+    for path in PROMPT_LOW_PRIORITY_FIELDS:
+        if _pop_path(data, path):
+            yield f"dropped {path}", drop(path)
+
+    while True:
+        droppable = [key for key in data if key not in PROMPT_PROTECTED_FIELDS]
+        if not droppable:
+            return
+        largest = max(droppable, key=lambda key: (len(serialize_company_data(data[key])), key))
+        del data[largest]
+        yield f"dropped {largest}", drop(largest)
+
+def build_financial_prompt(company_data: Any, tokenize: Callable[[str], List[int]], n_ctx: int, max_tokens: int,
+                           reserved_tokens: int = PROMPT_RESERVED_COMPLETION_TOKENS,
+                           enable_thinking: bool = True) -> BuiltPrompt:
+    """Build the chat prompt for ``company_data`` within the model's context.
+
+    The prompt must leave ``min(max_tokens, reserved_tokens)`` tokens for
+    the answer; while it does not, the data is trimmed step by step and
+    re-measured with ``tokenize``. ``max_tokens`` (reasoning included) is
+    then clamped to the space left in the context.
+    """
+    limit = n_ctx - max(1, min(max_tokens, reserved_tokens))
+    trimmed: List[str] = []
+    candidates = trim_company_data(company_data)
+    data = company_data
+    original_tokens = None
+
+    while True:
+        messages = build_messages(data)
+        text = format_chat_prompt(messages, enable_thinking=enable_thinking)
+        tokens = tokenize(text)
+        if original_tokens is None:
+            original_tokens = len(tokens)
+        if len(tokens) <= limit:
+            break
+        step = next(candidates, None)
+        if step is None:
+            raise PromptTooLongError(
+                f"Prompt needs {len(tokens)} tokens after trimming ({original_tokens} before), "
+                f"but only {limit} of the {n_ctx}-token context are available"
+            )
+        description, data = step
+        trimmed.append(description)
+
+    return BuiltPrompt(messages, text, tokens, min(max_tokens, n_ctx - len(tokens)), max_tokens,
+                       original_tokens, trimmed)
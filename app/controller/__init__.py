@@ -2,11 +2,25 @@
 Controller layer for the Vietnamese LLM API.
 
 This package contains:
-- api_controller: FastAPI routes for model inference and management
+- model_controller: Flask-RESTX routes for model inference and management
+- metrics_controller: Prometheus metrics endpoint
+- api_controller: FastAPI routes for model inference and management (ASGI serving)
 """
 
-from controller.model_controller import model_ns
+import importlib
 
-__all__ = [
-    'model_ns'
-]
\ No newline at end of file
+# Controllers are imported on first attribute access so that the Flask and
+# ASGI apps each load only their own framework and model service
+_EXPORTS = {
+    'model_ns': 'controller.model_controller',
+    'metrics_ns': 'controller.metrics_controller',
+    'api_router': 'controller.api_controller'
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module_name), name)
@@ -0,0 +1,227 @@
+# API controller for FastAPI endpoints (ASGI serving path)
+#
+# Endpoints are coroutines: inference runs on the model's scheduler thread
+# and is awaited through its future, so no server thread is held for the
+# length of a generation. A request whose client disconnects is cancelled:
+# dropped if still queued, otherwise stopped at the next token.
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Literal, Optional, Union
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from concurrent.futures import Future
+from service.model_service import ModelService
+from service.session_service import SessionNotFoundError
+from service.scheduler_service import QueueFullError
+from common.prompt_builder import PromptTooLongError
+from common.response_common import ResponseCommon
+from common.helpers import format_sse, format_json_line
+from common.constants import THINKING_DEFAULT, PRIORITY_INTERACTIVE, ASGI_DISCONNECT_POLL_SECONDS
+
+# Status reported when the client went away before the response was ready
+CLIENT_CLOSED_REQUEST = 499
+
+api_router = APIRouter()
+
+# Initialize model service
+model_service = ModelService()
+
+class AnalysisRequest(BaseModel):
+    json_input: Union[Dict[str, Any], str]     # Company data, or the same as JSON text
+    model_type: str = "4bit"
+    max_tokens: int = 500
+    thinking: str = THINKING_DEFAULT
+    priority: Literal["interactive", "bulk"] = PRIORITY_INTERACTIVE
+    deadline: Optional[float] = None
+    no_cache: bool = False
+    session: bool = False
+
+class StreamRequest(AnalysisRequest):
+    stream_format: Literal["sse", "jsonl"] = "sse"
+
+class FollowUpRequest(BaseModel):
+    question: str
+    max_tokens: int = 500
+    thinking: str = THINKING_DEFAULT
+    priority: Literal["interactive", "bulk"] = PRIORITY_INTERACTIVE
+    deadline: Optional[float] = None
+
+def _respond(code: int, success: bool, message: str, data: Any) -> JSONResponse:
+    return JSONResponse(ResponseCommon(code, success, message, data).to_json(), status_code=code)
+
+def _overloaded(e: QueueFullError) -> JSONResponse:
+    """Answer a shed request with its status code and a Retry-After header"""
+    response = _respond(e.status_code, False, str(e), {"retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+async def _client_gone(request: Request):
+    """Return once the client has disconnected"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(ASGI_DISCONNECT_POLL_SECONDS)
+
+@api_router.post("/model/generate_response")
+async def generate_response(body: AnalysisRequest, request: Request):
+    """Generate a response using the LLM"""
+    cancel = threading.Event()
+    try:
+        future = model_service.submit_response(
+            body.json_input,
+            body.model_type,
+            body.max_tokens,
+            use_cache=not body.no_cache,
+            thinking=body.thinking,
+            cancel=cancel,
+            priority=body.priority,
+            deadline=body.deadline,
+            session=body.session
+        )
+    except QueueFullError as e:
+        return _overloaded(e)
+    except Exception as e:
+        return _respond(500, False, str(e), {})
+    return await _await_response(future, cancel, request)
+
+async def _await_response(future: Future, cancel: threading.Event, request: Request) -> JSONResponse:
+    """Wait for a queued generation, cancelling it if the client disconnects first"""
+    result = asyncio.wrap_future(future)
+    disconnect = asyncio.ensure_future(_client_gone(request))
+    try:
+        await asyncio.wait({result, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        if not result.done():
+            cancel.set()
+            result.cancel()
+
+    if result.cancelled():
+        return _respond(CLIENT_CLOSED_REQUEST, False, "Client disconnected", {})
+    try:
+        data = result.result()
+    except QueueFullError as e:
+        return _overloaded(e)
+    except PromptTooLongError as e:
+        return _respond(413, False, str(e), {})
+    except SessionNotFoundError as e:
+        return _respond(404, False, str(e), {})
+    except Exception as e:
+        return _respond(500, False, str(e), {})
+    return _respond(200, True, "Response generated successfully", data)
+
+@api_router.post("/model/session/{session_id}")
+async def session_followup(session_id: str, body: FollowUpRequest, request: Request):
+    """Ask a follow-up question in a conversation session"""
+    cancel = threading.Event()
+    try:
+        future = model_service.submit_followup(
+            session_id,
+            body.question,
+            body.max_tokens,
+            thinking=body.thinking,
+            cancel=cancel,
+            priority=body.priority,
+            deadline=body.deadline
+        )
+    except QueueFullError as e:
+        return _overloaded(e)
+    except SessionNotFoundError as e:
+        return _respond(404, False, str(e), {})
+    except Exception as e:
+        return _respond(500, False, str(e), {})
+    return await _await_response(future, cancel, request)
+
+@api_router.get("/model/session/{session_id}")
+async def session_transcript(session_id: str):
+    """Transcript of a conversation session"""
+    try:
+        return _respond(200, True, "Session retrieved successfully", model_service.get_session(session_id))
+    except SessionNotFoundError as e:
+        return _respond(404, False, str(e), {})
+
+@api_router.delete("/model/session/{session_id}")
+async def session_delete(session_id: str):
+    """End a conversation session and free its KV state"""
+    if model_service.delete_session(session_id):
+        return _respond(200, True, "Session deleted", {})
+    return _respond(404, False, f"Session {session_id!r} does not exist", {})
+
+@api_router.post("/model/generate_response/stream")
+async def generate_response_stream(body: StreamRequest):
+    """Stream a response token by token as it is generated"""
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    cancel = threading.Event()
+    try:
+        model_service.start_response_stream(
+            body.json_input,
+            lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+            body.model_type,
+            body.max_tokens,
+            thinking=body.thinking,
+            cancel=cancel,
+            priority=body.priority,
+            deadline=body.deadline
+        )
+    except QueueFullError as e:
+        return _overloaded(e)
+
+    async def chunks() -> AsyncIterator[str]:
+        # Closed early when the client disconnects, which cancels the generation
+        try:
+            while True:
+                event = await events.get()
+                yield format_json_line(event) if body.stream_format == "jsonl" else format_sse(event, event["type"])
+                if event["type"] in ("done", "error"):
+                    return
+        finally:
+            cancel.set()
+
+    return StreamingResponse(
+        chunks(),
+        media_type="application/x-ndjson" if body.stream_format == "jsonl" else "text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/model/health")
+async def health_check(model_type: str = "4bit"):
+    """Health check endpoint. Reads the GGUF header only and never loads weights."""
+    model_info = model_service.get_model_info(model_type)
+    return JSONResponse(model_info, status_code=model_info["code"])
+
+@api_router.get("/model/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 once at least one model is resident, 503 otherwise"""
+    readiness = model_service.get_readiness()
+    code = 200 if readiness["ready"] else 503
+    return _respond(
+        code,
+        readiness["ready"],
+        "Ready" if readiness["ready"] else ("Warming up" if readiness["warming_up"] else "No model is resident yet"),
+        readiness
+    )
+
+@api_router.get("/model/models")
+async def model_list():
+    """Available GGUF models, which are resident and the memory budget"""
+    return _respond(200, True, "Models retrieved successfully", model_service.list_models())
+
+@api_router.get("/model/queue")
+async def queue_status():
+    """Inference queue depth and wait time per model"""
+    return _respond(200, True, "Queue statistics retrieved successfully", model_service.get_scheduler_stats())
+
+@api_router.get("/model/admission")
+async def admission_status():
+    """Admission control counters, throughput estimates and waiting requests per priority class"""
+    return _respond(200, True, "Admission statistics retrieved successfully", model_service.get_admission_stats())
+
+@api_router.get("/model/cache")
+async def cache_status():
+    """Inference cache sizes and hit rates"""
+    return _respond(200, True, "Cache statistics retrieved successfully", model_service.get_cache_stats())
+
+@api_router.get("/metrics")
+async def metrics():
+    """Inference metrics in the Prometheus text exposition format"""
+    return Response(model_service.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
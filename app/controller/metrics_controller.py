@@ -0,0 +1,16 @@
+# API controller for the metrics endpoint
+from flask import Response
+from flask_restx import Namespace, Resource
+from controller.model_controller import model_service
+
+# Create namespace
+metrics_ns = Namespace('metrics', description='Prometheus metrics')
+
+@metrics_ns.route("")
+class Metrics(Resource):
+    def get(self):
+        """Inference metrics in the Prometheus text exposition format"""
+        return Response(
+            model_service.render_metrics(),
+            mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -1,22 +1,56 @@
 # API controller for FastAPI endpoints
-from flask_restx import Namespace, Resource, fields
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from flask import Response, request, stream_with_context
+from flask_restx import Namespace, Resource, fields, inputs
 from service.model_service import ModelService
+from service.scheduler_service import QueueFullError
+from service.session_service import SessionNotFoundError
+from common.prompt_builder import PromptTooLongError
+from common.constants import THINKING_DEFAULT, PRIORITY_CLASSES, PRIORITY_INTERACTIVE, PRIORITY_BULK
 from common.response_common import ResponseCommon
+from common.helpers import format_sse, format_json_line
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def json_value(value):
+    """Argument type for JSON: a decoded object from a JSON body is kept, anything else is JSON text"""
+    return value if isinstance(value, (dict, list)) else str(value)
+
+json_value.__schema__ = {"type": "object"}
+
 # Create namespace
 model_ns = Namespace('model', description='Model-related operations')
 upload_parser = model_ns.parser()
-upload_parser.add_argument('json_input', type=str, required=True, help='JSON input for analysis')
+upload_parser.add_argument('json_input', type=json_value, required=True, help='Company data for analysis: a JSON object or JSON text')
 upload_parser.add_argument('model_type', type=str, default="4bit", help='Model type to use')
 upload_parser.add_argument('max_tokens', type=int, default=500, help='Maximum tokens for response')
+upload_parser.add_argument('thinking', type=str, default=THINKING_DEFAULT, help='Reasoning mode: "off", "on" or a reasoning token budget')
+upload_parser.add_argument('priority', type=str, default=PRIORITY_INTERACTIVE, choices=tuple(PRIORITY_CLASSES), help='Priority class; interactive requests are served before bulk ones')
+upload_parser.add_argument('deadline', type=float, default=None, help='Seconds after which generation stops and the partial answer is returned')
+
+generate_parser = upload_parser.copy()
+generate_parser.add_argument('no_cache', type=inputs.boolean, default=False, help='Bypass the response cache')
+generate_parser.add_argument('session', type=inputs.boolean, default=False, help='Keep the conversation for follow-up questions')
+
+followup_parser = model_ns.parser()
+followup_parser.add_argument('question', type=str, required=True, help='Follow-up question about the analysis')
+followup_parser.add_argument('max_tokens', type=int, default=500, help='Maximum tokens for response')
+followup_parser.add_argument('thinking', type=str, default=THINKING_DEFAULT, help='Reasoning mode: "off", "on" or a reasoning token budget')
+followup_parser.add_argument('priority', type=str, default=PRIORITY_INTERACTIVE, choices=tuple(PRIORITY_CLASSES), help='Priority class; interactive requests are served before bulk ones')
+followup_parser.add_argument('deadline', type=float, default=None, help='Seconds after which generation stops and the partial answer is returned')
+
+stream_parser = upload_parser.copy()
+stream_parser.add_argument('stream_format', type=str, default="sse", choices=("sse", "jsonl"), help='Streaming format: Server-Sent Events or JSON lines')
+
+batch_parser = model_ns.parser()
+batch_parser.add_argument('model_type', type=str, default="4bit", location='args', help='Model type to use')
+batch_parser.add_argument('max_tokens', type=int, default=500, location='args', help='Maximum tokens per response')
+batch_parser.add_argument('no_cache', type=inputs.boolean, default=False, location='args', help='Bypass the response cache')
+batch_parser.add_argument('thinking', type=str, default=THINKING_DEFAULT, location='args', help='Reasoning mode: "off", "on" or a reasoning token budget')
+batch_parser.add_argument('priority', type=str, default=PRIORITY_BULK, choices=tuple(PRIORITY_CLASSES), location='args', help='Priority class of the records')
+batch_parser.add_argument('deadline', type=float, default=None, location='args', help='Seconds each record may take from its submission')
 
 response_model = model_ns.model('Response', {
     'success': fields.Boolean,
@@ -28,23 +62,32 @@ response_model = model_ns.model('Response', {
 # Initialize model service
 model_service = ModelService()
 
-class AnalysisRequest(BaseModel):
-    json_input: str
-    model_type: Optional[str] = "4bit"
-    max_tokens: Optional[int] = 500
+def _overloaded(e: QueueFullError):
+    """Answer a shed request with its status code and a Retry-After header"""
+    return ResponseCommon(
+        code=e.status_code,
+        success=False,
+        message=str(e),
+        data={"retry_after": e.retry_after}
+    ).to_json(), e.status_code, {"Retry-After": str(e.retry_after)}
 
 @model_ns.route("/generate_response")
 class GenerateResponse(Resource):
-    @model_ns.expect(upload_parser)
+    @model_ns.expect(generate_parser)
     @model_ns.marshal_with(response_model)
     def post(self):
         """Generate a response using the LLM"""
         try:
-            args = upload_parser.parse_args()
+            args = generate_parser.parse_args()
             result = model_service.generate_response(
                 args['json_input'],
                 args['model_type'] if args['model_type'] is not None else "4bit",
-                args['max_tokens'] if args['max_tokens'] is not None else 500
+                args['max_tokens'] if args['max_tokens'] is not None else 500,
+                use_cache=not args['no_cache'],
+                thinking=args['thinking'],
+                priority=args['priority'],
+                deadline=args['deadline'],
+                session=args['session']
             )
             
             # FIX: Changed 'response' to 'result' and use proper structure
@@ -55,13 +98,157 @@ class GenerateResponse(Resource):
                 data=result,  # This should be the result from generate_response
             ).to_json()
 
+        except QueueFullError as e:
+            return _overloaded(e)
+        except PromptTooLongError as e:
+            return ResponseCommon(
+                code=413,
+                success=False,
+                message=str(e),
+                data={}
+            ).to_json(), 413
+        except Exception as e:
+            return ResponseCommon(
+                code=500,
+                success=False,
+                message=str(e),
+                data={}
+            ).to_json(), 500
+
+@model_ns.route("/session/<string:session_id>")
+class Session(Resource):
+    @model_ns.expect(followup_parser)
+    @model_ns.marshal_with(response_model)
+    def post(self, session_id):
+        """Ask a follow-up question in a conversation session"""
+        try:
+            args = followup_parser.parse_args()
+            result = model_service.generate_followup(
+                session_id,
+                args['question'],
+                args['max_tokens'] if args['max_tokens'] is not None else 500,
+                thinking=args['thinking'],
+                priority=args['priority'],
+                deadline=args['deadline']
+            )
+            return ResponseCommon(
+                code=200,
+                success=True,
+                message="Response generated successfully",
+                data=result
+            ).to_json()
+
+        except QueueFullError as e:
+            return _overloaded(e)
+        except SessionNotFoundError as e:
+            return ResponseCommon(
+                code=404,
+                success=False,
+                message=str(e),
+                data={}
+            ).to_json(), 404
+        except PromptTooLongError as e:
+            return ResponseCommon(
+                code=413,
+                success=False,
+                message=str(e),
+                data={}
+            ).to_json(), 413
         except Exception as e:
             return ResponseCommon(
                 code=500,
                 success=False,
                 message=str(e),
                 data={}
+            ).to_json(), 500
+
+    def get(self, session_id):
+        """Transcript of a conversation session"""
+        try:
+            return ResponseCommon(
+                code=200,
+                success=True,
+                message="Session retrieved successfully",
+                data=model_service.get_session(session_id)
             ).to_json()
+        except SessionNotFoundError as e:
+            return ResponseCommon(
+                code=404,
+                success=False,
+                message=str(e),
+                data={}
+            ).to_json(), 404
+
+    def delete(self, session_id):
+        """End a conversation session and free its KV state"""
+        if model_service.delete_session(session_id):
+            return ResponseCommon(
+                code=200,
+                success=True,
+                message="Session deleted",
+                data={}
+            ).to_json()
+        return ResponseCommon(
+            code=404,
+            success=False,
+            message=f"Session {session_id!r} does not exist",
+            data={}
+        ).to_json(), 404
+
+@model_ns.route("/generate_response/stream")
+class GenerateResponseStream(Resource):
+    @model_ns.expect(stream_parser)
+    def post(self):
+        """Stream a response token by token as it is generated"""
+        args = stream_parser.parse_args()
+        try:
+            events = model_service.generate_response_stream(
+                args['json_input'],
+                args['model_type'] if args['model_type'] is not None else "4bit",
+                args['max_tokens'] if args['max_tokens'] is not None else 500,
+                thinking=args['thinking'],
+                priority=args['priority'],
+                deadline=args['deadline']
+            )
+        except QueueFullError as e:
+            return _overloaded(e)
+
+        if args['stream_format'] == "jsonl":
+            body = (format_json_line(event) for event in events)
+            mimetype = "application/x-ndjson"
+        else:
+            body = (format_sse(event, event["type"]) for event in events)
+            mimetype = "text/event-stream"
+
+        return Response(
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+@model_ns.route("/generate_response/batch")
+class GenerateResponseBatch(Resource):
+    @model_ns.expect(batch_parser)
+    @model_ns.doc(description="Request body: one JSON company record per line (application/x-ndjson). "
+                              "Results stream back as JSON lines in completion order, tagged with the record id.")
+    def post(self):
+        """Analyze a JSONL stream of company records"""
+        args = batch_parser.parse_args()
+        results = model_service.generate_batch(
+            request.stream,
+            args['model_type'] if args['model_type'] is not None else "4bit",
+            args['max_tokens'] if args['max_tokens'] is not None else 500,
+            use_cache=not args['no_cache'],
+            thinking=args['thinking'],
+            priority=args['priority'],
+            deadline=args['deadline']
+        )
+
+        return Response(
+            stream_with_context(format_json_line(result) for result in results),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
 # @model_ns.route("/generate_response")
 # class GenerateResponse(Resource):
@@ -93,10 +280,71 @@ class GenerateResponse(Resource):
 #                 data={}
 #             ).to_json()
 
+health_parser = model_ns.parser()
+health_parser.add_argument('model_type', type=str, default="4bit", location='args', help='Model type to describe')
+
 @model_ns.route("/health")
 class HealthCheck(Resource):
-    def get(self, model_type: str = "4bit"):
-        """Health check endpoint"""
-        model_info = model_service.get_model_info(model_type)
+    @model_ns.expect(health_parser)
+    def get(self):
+        """Health check endpoint. Reads the GGUF header only and never loads weights."""
+        args = health_parser.parse_args()
+        model_info = model_service.get_model_info(args['model_type'] or "4bit")
         return model_info
-    
\ No newline at end of file
+
+@model_ns.route("/ready")
+class ReadinessCheck(Resource):
+    def get(self):
+        """Readiness endpoint: 200 once at least one model is resident, 503 otherwise"""
+        readiness = model_service.get_readiness()
+        code = 200 if readiness["ready"] else 503
+        return ResponseCommon(
+            code=code,
+            success=readiness["ready"],
+            message="Ready" if readiness["ready"] else ("Warming up" if readiness["warming_up"] else "No model is resident yet"),
+            data=readiness
+        ).to_json(), code
+
+@model_ns.route("/models")
+class ModelList(Resource):
+    def get(self):
+        """Available GGUF models, which are resident and the memory budget"""
+        return ResponseCommon(
+            code=200,
+            success=True,
+            message="Models retrieved successfully",
+            data=model_service.list_models()
+        ).to_json()
+
+@model_ns.route("/queue")
+class QueueStatus(Resource):
+    def get(self):
+        """Inference queue depth and wait time per model"""
+        return ResponseCommon(
+            code=200,
+            success=True,
+            message="Queue statistics retrieved successfully",
+            data=model_service.get_scheduler_stats()
+        ).to_json()
+
+@model_ns.route("/admission")
+class AdmissionStatus(Resource):
+    def get(self):
+        """Admission control counters, throughput estimates and waiting requests per priority class"""
+        return ResponseCommon(
+            code=200,
+            success=True,
+            message="Admission statistics retrieved successfully",
+            data=model_service.get_admission_stats()
+        ).to_json()
+
+@model_ns.route("/cache")
+class CacheStatus(Resource):
+    def get(self):
+        """Inference cache sizes and hit rates"""
+        return ResponseCommon(
+            code=200,
+            success=True,
+            message="Cache statistics retrieved successfully",
+            data=model_service.get_cache_stats()
+        ).to_json()
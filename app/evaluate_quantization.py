@@ -0,0 +1,73 @@
+# Quantization quality report: perplexity and KL divergence versus FP16
+#
+# Usage (from the app directory):
+#   python evaluate_quantization.py [VARIANT ...] [--base F16] [--corpus eval/vi_financial_corpus.txt]
+#                                   [--ctx 512] [--chunks 32]
+#
+# Variants and the base are model names, aliases or paths known to the model
+# registry. Without variants every quantized model in the registry is
+# evaluated. The JSON and Markdown reports are written to EVAL_OUTPUT_DIR.
+import argparse
+import json
+import os
+import sys
+from service.evaluation_service import EvaluationService
+from service.model_registry_service import ModelRegistryService
+from common.constants import EVAL_CORPUS_PATH, EVAL_CONTEXT_SIZE, EVAL_MAX_CHUNKS
+
+UNQUANTIZED_TYPES = ("F32", "F16", "BF16")
+
+def resolve_path(registry: ModelRegistryService, name: str) -> str:
+    """Accept a registry name or alias, or a path to a GGUF file"""
+    if os.path.isfile(name):
+        return name
+    return registry.resolve(name).path
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare quantized models with their FP16 base")
+    parser.add_argument("variants", nargs="*", help="Models to evaluate (default: every quantized model)")
+    parser.add_argument("--base", default="F16", help="Reference model, normally the FP16 GGUF")
+    parser.add_argument("--corpus", default=EVAL_CORPUS_PATH, help="UTF-8 text file to evaluate on")
+    parser.add_argument("--ctx", type=int, default=EVAL_CONTEXT_SIZE, help="Tokens per evaluation chunk")
+    parser.add_argument("--chunks", type=int, default=EVAL_MAX_CHUNKS, help="Maximum number of chunks")
+    args = parser.parse_args()
+
+    registry = ModelRegistryService()
+    try:
+        base_path = resolve_path(registry, args.base)
+        if args.variants:
+            variant_paths = [resolve_path(registry, name) for name in args.variants]
+        else:
+            base_real_path = os.path.realpath(base_path)
+            variant_paths = [
+                entry.path for entry in registry.scan()
+                if entry.path != base_real_path and entry.quant_type not in UNQUANTIZED_TYPES
+            ]
+    except ValueError as e:
+        print(f"Evaluation failed: {e}")
+        return 1
+
+    if not variant_paths:
+        print("No quantized models to evaluate")
+        return 1
+
+    service = EvaluationService(corpus_path=args.corpus, n_ctx=args.ctx, max_chunks=args.chunks)
+    report = service.evaluate(base_path, variant_paths)
+
+    summary = {
+        "base": {key: report["base"][key] for key in ("model_name", "perplexity", "prompt_tokens_per_second")},
+        "variants": [
+            {key: variant[key] for key in (
+                "model_name", "quant_type", "size_ratio", "perplexity_increase",
+                "kl_divergence_mean", "top1_agreement", "speedup", "meets_quality_bar"
+            )}
+            for variant in report["variants"]
+        ],
+        "recommended": report["recommended"],
+        "report_path": report["report_path"]
+    }
+    print(json.dumps(summary, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
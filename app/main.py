@@ -1,10 +1,11 @@
 import os
 from flask import Flask
 from flask_restx import Api
-from controller.model_controller import model_ns
-from service.model_service import ModelService
+from controller.model_controller import model_ns, model_service
+from controller.metrics_controller import metrics_ns
+from common.constants import WARMUP_ENABLED, WARMUP_MODELS
 
-def create_app():
+def create_app(warmup: bool = WARMUP_ENABLED):
     app = Flask(__name__)
 
     # Initialize the API with Swagger UI at '/'
@@ -17,6 +18,11 @@ def create_app():
 
     # Register namespace
     api.add_namespace(model_ns, path='/model')
+    api.add_namespace(metrics_ns, path='/metrics')
+
+    # Load and warm models in the background; /model/ready reports when done
+    if warmup:
+        model_service.start_warmup(WARMUP_MODELS)
 
     return app
   
@@ -3,10 +3,6 @@ import requests
 import json
 
 
-quant_service = QuantizationService()
-quant_service.setup_models()
-
-
 data = {
     "company_data": {
         "name": "Công ty ABC",
@@ -16,12 +12,16 @@ data = {
     }
 }
 
-response = requests.post(
-    "http://localhost:8000/api/v1/analyze",
-    json={
-        "json_input": json.dumps(data),
-        "model_type": "4bit"
-    }
-)
+if __name__ == "__main__":
+    quant_service = QuantizationService()
+    quant_service.setup_models()
+
+    response = requests.post(
+        "http://localhost:8000/model/generate_response",
+        json={
+            "json_input": json.dumps(data),
+            "model_type": "4bit"
+        }
+    )
 
-print(response.json())
\ No newline at end of file
+    print(response.json())
\ No newline at end of file
@@ -0,0 +1,203 @@
+# Production serving: a dispatcher in front of CPU-pinned inference workers
+#
+# Usage (from the app directory):
+#   python serve.py [--workers 4] [--cores-per-worker 12] [--host 0.0.0.0] [--port 8000] [--asgi]
+#
+# The dispatcher splits the usable CPUs into disjoint sets (keeping SMT
+# siblings and NUMA nodes together), starts one worker process per set and
+# proxies every request to the worker with the fewest requests in flight.
+# Workers map the GGUF files read-only and without mlock, so each model's
+# weights are held once in the page cache and shared by all workers; only
+# the KV cache and compute buffers are per worker. GET /dispatcher/workers
+# reports the workers and their load. With --asgi the workers serve the
+# FastAPI app (asgi.py) with uvicorn instead of the Flask app.
+import argparse
+import http.client
+import json
+import os
+import signal
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List
+from common.constants import (
+    SERVE_HOST,
+    SERVE_PORT,
+    SERVE_WORKERS,
+    SERVE_CORES_PER_WORKER,
+    SERVE_WORKER_BASE_PORT,
+    SERVE_PROXY_TIMEOUT_SECONDS
+)
+from common.host_tuning import HostProfile, parse_cpu_list, partition_cpus
+from common.response_common import ResponseCommon
+
+# Hop-by-hop headers that must not be forwarded
+HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "te", "trailer", "upgrade"}
+
+PROXY_CHUNK_BYTES = 64 * 1024
+
+def run_worker(port: int, cpus: List[int], asgi: bool = False):
+    """Serve the API on localhost, pinned to ``cpus``.
+
+    Pinning happens before llama_cpp is imported so that every ggml thread
+    inherits the CPU set, and auto thread tuning sizes itself to it.
+    """
+    os.sched_setaffinity(0, cpus)
+
+    from functools import partial
+    from common.model_utils import create_optimized_llama
+
+    if asgi:
+        import uvicorn
+        from asgi import create_asgi_app
+        from controller.api_controller import model_service
+
+        model_service.model_loader = partial(create_optimized_llama, use_mlock=False)
+        uvicorn.run(create_asgi_app(), host="127.0.0.1", port=port)
+        return
+
+    from werkzeug.serving import make_server
+    from main import create_app
+    from controller.model_controller import model_service
+
+    model_service.model_loader = partial(create_optimized_llama, use_mlock=False)
+    app = create_app()
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+class DispatcherHandler(BaseHTTPRequestHandler):
+    """Forwards each request to the least loaded worker and streams the reply"""
+
+    protocol_version = "HTTP/1.1"
+    pool = None     # Set by serve()
+
+    def _send_json(self, code: int, body: dict):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _request_body(self):
+        """Request body as bytes, or an iterator of chunks for chunked uploads"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            return self._read_chunked()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else None
+
+    def _read_chunked(self) -> Iterator[bytes]:
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            chunk = self.rfile.read(size)
+            self.rfile.readline()
+            yield chunk
+
+    def _proxy(self):
+        if self.path.rstrip("/") == "/dispatcher/workers":
+            self._send_json(200, ResponseCommon(200, True, "Workers retrieved successfully", self.pool.get_stats()).to_json())
+            return
+
+        try:
+            worker = self.pool.acquire()
+        except RuntimeError as e:
+            self._send_json(503, ResponseCommon(503, False, str(e), {}).to_json())
+            return
+
+        try:
+            body = self._request_body()
+            headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_HEADERS}
+            connection = http.client.HTTPConnection("127.0.0.1", worker.port, timeout=SERVE_PROXY_TIMEOUT_SECONDS)
+            try:
+                connection.request(self.command, self.path, body=body, headers=headers,
+                                   encode_chunked=not isinstance(body, (bytes, type(None))))
+                upstream = connection.getresponse()
+            except OSError as e:
+                connection.close()
+                self._send_json(502, ResponseCommon(502, False, f"Worker {worker.index} failed: {e}", {}).to_json())
+                return
+
+            # Stream the reply so SSE and JSON-lines responses are not buffered
+            self.send_response(upstream.status, upstream.reason)
+            for name, value in upstream.getheaders():
+                if name.lower() not in HOP_HEADERS:
+                    self.send_header(name, value)
+            chunked = upstream.getheader("Content-Length") is None
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("X-Worker", str(worker.index))
+            self.end_headers()
+            try:
+                while True:
+                    chunk = upstream.read1(PROXY_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                    self.wfile.flush()
+                if chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+            finally:
+                connection.close()
+        finally:
+            self.pool.release(worker)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _proxy
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host: str = SERVE_HOST, port: int = SERVE_PORT, workers: int = SERVE_WORKERS,
+          cores_per_worker: int = SERVE_CORES_PER_WORKER, base_port: int = SERVE_WORKER_BASE_PORT,
+          asgi: bool = False):
+    """Start the workers and run the dispatcher until interrupted"""
+    from service.worker_pool_service import WorkerPoolService
+
+    profile = HostProfile.detect()
+    cpusets = partition_cpus(profile, workers, cores_per_worker)
+    print(f"Host: {json.dumps(profile.to_dict())}; starting {len(cpusets)} worker(s)")
+
+    command = [sys.executable, os.path.abspath(__file__), "--worker"] + (["--asgi"] if asgi else [])
+    pool = WorkerPoolService(cpusets, base_port, command)
+    pool.start()
+    DispatcherHandler.pool = pool
+    server = ThreadingHTTPServer((host, port), DispatcherHandler)
+    server.daemon_threads = True
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+    print(f"Dispatcher listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.stop()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve the API from several CPU-pinned worker processes")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Worker processes (default: from CPU topology)")
+    parser.add_argument("--cores-per-worker", type=int, default=SERVE_CORES_PER_WORKER)
+    parser.add_argument("--base-port", type=int, default=SERVE_WORKER_BASE_PORT, help="First worker port on 127.0.0.1")
+    parser.add_argument("--asgi", action="store_true", help="Run the workers on the ASGI (FastAPI/uvicorn) app")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--cpus", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.port, sorted(parse_cpu_list(args.cpus)), args.asgi)
+        return 0
+
+    serve(args.host, args.port, args.workers, args.cores_per_worker, args.base_port, args.asgi)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,48 @@ Service layer for the Vietnamese LLM application.
 This package contains:
 - model_service: Handles model loading and inference
 - quantization_service: Handles model quantization and setup
+- scheduler_service: Per-model priority queue and inference worker
+- admission_service: Load shedding from the estimated queue wait and request deadlines
+- prefix_cache_service: KV state reuse for shared prompt prefixes
+- response_cache_service: Content-addressed cache of generated analyses
+- metrics_service: Prometheus-style counters, gauges and histograms
+- model_registry_service: GGUF model discovery and memory-budgeted loading
+- speculative_service: Prompt-lookup and draft-model speculative decoding
+- kv_cache_service: Per-model KV cache types and context sizing from observed lengths
+- batch_decode_service: Multi-sequence batched decoding of concurrent requests
+- session_service: Multi-turn conversation sessions with saved KV state
+- worker_pool_service: CPU-pinned inference worker processes for multi-process serving
 """
 
-from service.model_service import ModelService
-from service.quantization_service import QuantizationService
+import importlib
 
-__all__ = [
-    'ModelService',
-    'QuantizationService'
-]
\ No newline at end of file
+# Services are imported on first attribute access so that importing one
+# service module does not pull in the others (e.g. the quantization toolchain)
+_EXPORTS = {
+    'ModelService': 'service.model_service',
+    'QuantizationService': 'service.quantization_service',
+    'InferenceScheduler': 'service.scheduler_service',
+    'QueueFullError': 'service.scheduler_service',
+    'DeadlineExceededError': 'service.scheduler_service',
+    'AdmissionService': 'service.admission_service',
+    'AdmissionRejectedError': 'service.admission_service',
+    'PrefixCacheService': 'service.prefix_cache_service',
+    'ResponseCacheService': 'service.response_cache_service',
+    'MetricsService': 'service.metrics_service',
+    'ModelRegistryService': 'service.model_registry_service',
+    'SpeculativeService': 'service.speculative_service',
+    'KVCacheService': 'service.kv_cache_service',
+    'BatchDecodeService': 'service.batch_decode_service',
+    'SessionService': 'service.session_service',
+    'SessionNotFoundError': 'service.session_service',
+    'WorkerPoolService': 'service.worker_pool_service',
+    'NoWorkerAvailableError': 'service.worker_pool_service'
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module_name), name)
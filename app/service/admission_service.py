@@ -0,0 +1,133 @@
+# Service for admission control of inference requests
+import threading
+from typing import Any, Dict, Iterable, Optional
+from service.scheduler_service import InferenceScheduler, QueueFullError
+from common.constants import (
+    PRIORITY_CLASSES,
+    ADMISSION_MAX_CONCURRENT_GENERATIONS,
+    ADMISSION_MAX_QUEUED,
+    ADMISSION_EWMA_ALPHA
+)
+
+class AdmissionRejectedError(QueueFullError):
+    """Raised when a request is shed instead of queued"""
+
+def resolve_priority(priority: str) -> int:
+    """Queue priority of a priority class name"""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority {priority!r}; expected one of {sorted(PRIORITY_CLASSES)}")
+    return PRIORITY_CLASSES[priority]
+
+def check_deadline(deadline: Optional[float]) -> Optional[float]:
+    """Validate a deadline in seconds; None means no deadline"""
+    if deadline is not None and not deadline > 0:
+        raise ValueError(f"Deadline must be a positive number of seconds, got {deadline!r}")
+    return deadline
+
+class AdmissionService:
+    """Decides whether a request is queued or shed, from the estimated wait.
+
+    Generations of all models hold one of ``max_concurrent`` slots while
+    they run, since they share the same cores. The cost of a request is
+    estimated from the throughput observed per model: a moving average of
+    the per-request overhead (tokenize, prefill, post-processing), the
+    decode time per token and the completion length. The wait of a new
+    request is the estimated work queued ahead of it (its own priority
+    class or better, plus what is running) spread over the slots.
+
+    A request is rejected with 429 when its class already has
+    ``max_queued`` requests waiting, and with 503 when it would wait and
+    still not finish within its deadline. An idle server admits every
+    request; the deadline then truncates the generation. Until a model has
+    finished a generation its cost counts as zero.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT_GENERATIONS,
+                 max_queued: Optional[Dict[str, int]] = None, alpha: float = ADMISSION_EWMA_ALPHA):
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_queued = dict(ADMISSION_MAX_QUEUED if max_queued is None else max_queued)
+        self.alpha = alpha
+        self._estimates: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.admitted = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.rejected = {priority: {"queue_full": 0, "deadline": 0} for priority in PRIORITY_CLASSES}
+
+    def observe(self, model_name: str, metrics: Dict[str, Any], complete: bool = True):
+        """Update a model's throughput estimates from a finished generation.
+
+        The completion length is only learned from ``complete`` generations;
+        cancelled or truncated ones would understate it.
+        """
+        timings = metrics["timings"]
+        sample = {"overhead": timings["tokenize"] + timings["prefix_restore"] + timings["prefill"] + timings["post_process"]}
+        decode_tokens = metrics["completion_tokens"] - 1
+        if decode_tokens > 0 and timings["decode"] > 0:
+            sample["seconds_per_token"] = timings["decode"] / decode_tokens
+        if complete:
+            sample["completion_tokens"] = metrics["completion_tokens"]
+
+        with self._lock:
+            estimates = self._estimates.setdefault(model_name, {})
+            for name, value in sample.items():
+                previous = estimates.get(name)
+                estimates[name] = value if previous is None else previous + self.alpha * (value - previous)
+
+    def estimate(self, model_name: str, max_tokens: int) -> float:
+        """Expected run time in seconds of a generation of up to ``max_tokens``"""
+        with self._lock:
+            estimates = dict(self._estimates.get(model_name, {}))
+        if "seconds_per_token" not in estimates:
+            return 0.0
+        tokens = min(max_tokens, estimates.get("completion_tokens", max_tokens))
+        return estimates["overhead"] + tokens * estimates["seconds_per_token"]
+
+    def admit(self, schedulers: Iterable[InferenceScheduler], model_name: str, priority: str, max_tokens: int,
+              deadline: Optional[float] = None) -> float:
+        """Admit a request or raise ``AdmissionRejectedError``. Returns its estimated cost in seconds."""
+        level = resolve_priority(priority)
+        cost = self.estimate(model_name, max_tokens)
+        backlog, queued = 0.0, 0
+        for scheduler in schedulers:
+            seconds, waiting = scheduler.backlog(level)
+            backlog += seconds
+            queued += waiting
+        wait = backlog / self.max_concurrent
+
+        limit = self.max_queued.get(priority)
+        if limit is not None and queued >= limit:
+            with self._lock:
+                self.rejected[priority]["queue_full"] += 1
+            raise AdmissionRejectedError(
+                f"Too many {priority} requests waiting ({queued}), retry later",
+                status_code=429,
+                retry_after=wait / queued if queued else 1
+            )
+        if deadline is not None and wait > 0 and wait + cost > deadline:
+            with self._lock:
+                self.rejected[priority]["deadline"] += 1
+            raise AdmissionRejectedError(
+                f"Estimated completion in {wait + cost:.1f}s ({wait:.1f}s waiting) exceeds the {deadline:g}s deadline",
+                status_code=503,
+                retry_after=wait + cost - deadline
+            )
+
+        with self._lock:
+            self.admitted[priority] += 1
+        return cost
+
+    def stats(self) -> Dict[str, Any]:
+        """Admission counters and the throughput estimates per model"""
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queued": dict(self.max_queued),
+                "admitted": dict(self.admitted),
+                "rejected": {priority: dict(counts) for priority, counts in self.rejected.items()},
+                "estimates": {
+                    model_name: {name: round(value, 4) for name, value in estimates.items()}
+                    for model_name, estimates in self._estimates.items()
+                }
+            }
@@ -0,0 +1,319 @@
+# Service for decoding concurrent requests of one model in shared multi-sequence batches
+import weakref
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+from common.model_utils import GenerationTimer
+from common.kv_cache import kv_cache_bytes, logits_bytes
+from common.constants import (
+    BATCH_DECODE_SEQUENCES,
+    DEFAULT_TEMPERATURE,
+    DEFAULT_TOP_P,
+    MODEL_COMPUTE_BUFFER_BYTES,
+    MODEL_MEMORY_OVERHEAD_BYTES
+)
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+    from service.kv_cache_service import KVCacheService
+    from service.model_registry_service import ModelEntry
+
+# llama_cpp.create_completion's sampling defaults, so batched answers read like sequential ones
+SAMPLER_TOP_K = 40
+SAMPLER_MIN_P = 0.05
+SAMPLER_TYPICAL_P = 1.0
+
+class BatchSequence:
+    """A prompt decoded as one sequence of the shared batches.
+
+    ``timer`` is called once per sampled token and stops the sequence when
+    its caller cancels or its deadline passes. ``on_finish`` is called with
+    the sequence once it stops; ``text``, ``completion`` and
+    ``finish_reason`` then hold the answer.
+    """
+
+    def __init__(self, tokens: List[int], max_tokens: int, timer: GenerationTimer,
+                 on_finish: Callable[["BatchSequence"], None]):
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.timer = timer
+        self.on_finish = on_finish
+        self.completion: List[int] = []
+        self.text = ""
+        self.finish_reason: Optional[str] = None
+        self.seq_id = -1
+        self.n_past = 0
+        self.shared_tokens = 0      # Prompt tokens whose KV was copied from another sequence
+        self.batch_size = 0         # Most sequences that shared a decode step with this one
+        self.sampler = None
+
+class BatchDecoder:
+    """Decodes several prompts of one model at once.
+
+    A ``Llama`` context holds a single sequence, so the decoder keeps a
+    second llama.cpp context over the same weights with ``sequences``
+    sequence slots. Each decode step evaluates the next token of every
+    active sequence in one ``llama_batch``, which reads the weights once
+    for all of them; on a CPU decode is bound by memory bandwidth, so
+    aggregate tokens/s grows almost linearly with the sequences. The KV
+    cache is unified: a new prompt copies the cells of the longest prefix
+    it shares with a sequence already in the cache (the fixed financial
+    preamble) and only prefills the rest. Sequences join whenever a slot
+    is free and leave as soon as they finish. The prompt of a finished
+    sequence stays resident in a spare sequence, trimmed to the prefix the
+    next prompts share with it, so requests that arrive one at a time
+    skip the preamble too.
+    """
+
+    def __init__(self, model: "Llama", sequences: int):
+        from llama_cpp import llama_cpp, _internals as internals
+
+        self.sequences = sequences
+        self.n_ctx = model.n_ctx()
+        params = llama_cpp.llama_context_params.from_buffer_copy(model.context_params)
+        params.n_ctx = self.n_ctx * sequences
+        params.n_seq_max = sequences
+        # Copying part of a sequence needs all sequences in one KV buffer
+        self.share_prefixes = "kv_unified" in dict(llama_cpp.llama_context_params._fields_)
+        if self.share_prefixes:
+            params.kv_unified = True
+            params.n_seq_max = sequences + 1
+        self.n_batch = params.n_batch
+        self._llama_cpp = llama_cpp
+        self._internals = internals
+        # Only the weights are referenced, so the decoder does not keep the Llama alive
+        self._model = model._model
+        self._vocab = self._model.vocab
+        self.ctx = internals.LlamaContext(model=self._model, params=params, verbose=model.verbose)
+        self.batch = internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=model.verbose)
+        self._free_ids = list(range(sequences - 1, -1, -1))
+        # Holds the resident prefix in the spare sequence; its tokens are empty while there is none
+        self._resident = BatchSequence([], 0, GenerationTimer(0.0), lambda sequence: None)
+        self._resident.seq_id = sequences
+
+    def close(self):
+        self.batch.close()
+        self.ctx.close()
+
+    def _sampler(self):
+        """Sampler chain of one sequence, with the temperature and top_p of sequential requests"""
+        sampler = self._internals.LlamaSampler()
+        if DEFAULT_TEMPERATURE <= 0:
+            sampler.add_greedy()
+            return sampler
+        sampler.add_top_k(SAMPLER_TOP_K)
+        sampler.add_typical(SAMPLER_TYPICAL_P, 1)
+        sampler.add_top_p(DEFAULT_TOP_P, 1)
+        sampler.add_min_p(SAMPLER_MIN_P, 1)
+        sampler.add_temp(DEFAULT_TEMPERATURE)
+        sampler.add_dist(self._llama_cpp.LLAMA_DEFAULT_SEED)
+        return sampler
+
+    def _add(self, token: int, pos: int, seq_id: int, logits: bool) -> int:
+        """Append a token to the batch and return its index"""
+        batch = self.batch.batch
+        index = batch.n_tokens
+        batch.token[index] = token
+        batch.pos[index] = pos
+        batch.seq_id[index][0] = seq_id
+        batch.n_seq_id[index] = 1
+        batch.logits[index] = logits
+        batch.n_tokens += 1
+        return index
+
+    def _sample(self, sequence: BatchSequence, index: int):
+        """Sample the next token of ``sequence`` from the logits at batch ``index``"""
+        token = sequence.sampler.sample(self.ctx, index)
+        stopped = sequence.timer(None, None)
+        if self._llama_cpp.llama_vocab_is_eog(self._vocab, token):
+            sequence.finish_reason = "stop"
+            return
+        sequence.completion.append(token)
+        if stopped:
+            sequence.finish_reason = sequence.timer.stop_reason
+        elif len(sequence.completion) >= sequence.max_tokens or sequence.n_past >= self.n_ctx:
+            sequence.finish_reason = "length"
+
+    @staticmethod
+    def _shared_prefix(sequence: BatchSequence, candidates: List[BatchSequence]) -> Tuple[int, Optional[BatchSequence]]:
+        """Longest prompt prefix ``sequence`` shares with one of ``candidates``, leaving its last token
+        to evaluate, and that candidate"""
+        best, source = 0, None
+        for other in candidates:
+            n = 0
+            for a, b in zip(other.tokens, sequence.tokens[:-1]):
+                if a != b:
+                    break
+                n += 1
+            if n > best:
+                best, source = n, other
+        return best, source
+
+    def _prefill(self, joining: List[BatchSequence], ready: List[BatchSequence]):
+        """Evaluate the prompts of ``joining`` and sample their first tokens.
+
+        Prompts are packed into batches of up to ``n_batch`` tokens. A
+        prompt sharing a longer prefix with a prompt that is still waiting
+        in the batch flushes it first, so the prefix can be copied.
+        """
+        self.batch.reset()
+        waiting: List[Tuple[BatchSequence, int]] = []
+
+        def flush():
+            if self.batch.n_tokens() == 0:
+                return
+            self._decode()
+            self.batch.reset()
+            for sequence, index in waiting:
+                self._sample(sequence, index)
+                sources.append(sequence)
+            waiting.clear()
+
+        sources = list(ready)
+        resident = self._resident
+        for sequence in joining:
+            sequence.seq_id = self._free_ids.pop()
+            sequence.sampler = self._sampler()
+            if self.share_prefixes:
+                shared, source = self._shared_prefix(sequence, sources + [resident])
+                if self._shared_prefix(sequence, [other for other, _ in waiting])[0] > shared:
+                    flush()
+                    shared, source = self._shared_prefix(sequence, sources + [resident])
+                if source is not None:
+                    self.ctx.kv_cache_seq_cp(source.seq_id, sequence.seq_id, 0, shared)
+                    sequence.shared_tokens = sequence.n_past = shared
+                # Keep only what prompts have in common resident
+                kept = self._shared_prefix(sequence, [resident])[0]
+                if kept < len(resident.tokens):
+                    self.ctx.kv_cache_seq_rm(resident.seq_id, kept, -1)
+                    resident.tokens = resident.tokens[:kept]
+
+            last = len(sequence.tokens) - 1
+            for position in range(sequence.n_past, len(sequence.tokens)):
+                if self.batch.n_tokens() >= self.n_batch:
+                    flush()
+                index = self._add(sequence.tokens[position], position, sequence.seq_id, position == last)
+            sequence.n_past = len(sequence.tokens)
+            waiting.append((sequence, index))
+        flush()
+
+    def _decode(self):
+        """Evaluate the batch, dropping the resident prefix to make room when the KV cache is full"""
+        try:
+            self.ctx.decode(self.batch)
+        except RuntimeError:
+            if not self._resident.tokens:
+                raise
+            self._drop_resident()
+            self.ctx.decode(self.batch)
+
+    def _drop_resident(self):
+        self.ctx.kv_cache_seq_rm(self._resident.seq_id, -1, -1)
+        self._resident.tokens = []
+
+    def _step(self, active: List[BatchSequence]):
+        """Evaluate the last sampled token of every active sequence in one batch and sample the next"""
+        self.batch.reset()
+        for sequence in active:
+            self._add(sequence.completion[-1], sequence.n_past, sequence.seq_id, True)
+            sequence.n_past += 1
+            sequence.batch_size = max(sequence.batch_size, len(active))
+        self._decode()
+        for index, sequence in enumerate(active):
+            self._sample(sequence, index)
+
+    def _retire(self, sequence: BatchSequence):
+        """Free the slot of a finished sequence and hand it its answer.
+        Its prompt becomes the resident prefix when there is none."""
+        if self.share_prefixes and not self._resident.tokens:
+            self.ctx.kv_cache_seq_cp(sequence.seq_id, self._resident.seq_id, 0, len(sequence.tokens))
+            self._resident.tokens = sequence.tokens
+        self.ctx.kv_cache_seq_rm(sequence.seq_id, -1, -1)
+        self._free_ids.append(sequence.seq_id)
+        sequence.sampler.close()
+        sequence.sampler = None
+        sequence.text = self._model.detokenize(sequence.completion).decode("utf-8", errors="ignore")
+        sequence.on_finish(sequence)
+
+    def run(self, admit: Callable[[int], List[BatchSequence]]):
+        """Decode until no sequence is left.
+
+        ``admit(n)`` is asked for up to ``n`` new sequences whenever slots
+        are free, before each decode step. Sequences allowed no tokens finish
+        at once without a slot. If decoding fails, the KV cache is cleared,
+        sequences in flight are dropped and the error propagates.
+        """
+        active: List[BatchSequence] = []
+        joining: List[BatchSequence] = []
+        try:
+            while True:
+                joining = admit(self.sequences - len(active)) if len(active) < self.sequences else []
+                admitted = bool(joining)
+                for sequence in [sequence for sequence in joining if sequence.max_tokens <= 0]:
+                    joining.remove(sequence)
+                    sequence.finish_reason = "length"
+                    sequence.on_finish(sequence)
+                if joining:
+                    self._prefill(joining, active)
+                    active += joining
+                elif active:
+                    self._step(active)
+                elif not admitted:
+                    return
+                for sequence in [sequence for sequence in active if sequence.finish_reason is not None]:
+                    active.remove(sequence)
+                    self._retire(sequence)
+        except Exception:
+            for sequence in active + joining:
+                if sequence.sampler is not None:
+                    sequence.sampler.close()
+                    sequence.sampler = None
+            self.ctx.kv_cache_clear()
+            self._resident.tokens = []
+            self._free_ids = list(range(self.sequences - 1, -1, -1))
+            raise
+
+class BatchDecodeService:
+    """Creates a ``BatchDecoder`` next to each loaded model and counts its memory.
+
+    With ``sequences`` of 1, batched decoding is off and requests decode one
+    after another in the model's own context. The decoder's KV cache holds
+    the model's n_ctx for every sequence and is counted in the model's
+    memory estimate.
+    """
+
+    def __init__(self, kv_cache: "KVCacheService", sequences: int = BATCH_DECODE_SEQUENCES):
+        self.kv_cache = kv_cache
+        self.sequences = max(1, sequences)
+        self._decoders: "weakref.WeakKeyDictionary[Llama, BatchDecoder]" = weakref.WeakKeyDictionary()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sequences > 1
+
+    def attach(self, model: "Llama"):
+        """Create the decoder of a freshly loaded model"""
+        if self.enabled:
+            self._decoders[model] = BatchDecoder(model, self.sequences)
+
+    def detach(self, model: "Llama"):
+        """Free the decoder of a model before the model itself is closed"""
+        decoder = self._decoders.pop(model, None)
+        if decoder is not None:
+            decoder.close()
+
+    def decoder(self, model: "Llama") -> Optional[BatchDecoder]:
+        """The decoder of a loaded model, or None when it has none"""
+        return self._decoders.get(model)
+
+    def overhead_bytes(self, entry: "ModelEntry") -> int:
+        """Memory of the decoder of the model: KV cache, a logit row per sequence and compute buffers"""
+        if not self.enabled:
+            return 0
+        options = self.kv_cache.current_options(entry)
+        try:
+            header = entry.header()
+        except (OSError, ValueError):
+            return MODEL_MEMORY_OVERHEAD_BYTES
+        kv_bytes = kv_cache_bytes(header, options["n_ctx"] * self.sequences, options["type_k"], options["type_v"])
+        if kv_bytes is None:
+            return MODEL_MEMORY_OVERHEAD_BYTES
+        return kv_bytes + (logits_bytes(header, self.sequences) or 0) + MODEL_COMPUTE_BUFFER_BYTES
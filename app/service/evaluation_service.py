@@ -0,0 +1,264 @@
+# Service for measuring the quality cost of quantization
+import hashlib
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Union
+import numpy as np
+from common.helpers import ensure_directory_exists
+from common.model_utils import create_optimized_llama
+from common.gguf_reader import read_gguf_header
+from common.pipeline import fingerprint_path
+from common.constants import (
+    DEFAULT_THREADS,
+    EVAL_CORPUS_PATH,
+    EVAL_OUTPUT_DIR,
+    EVAL_CONTEXT_SIZE,
+    EVAL_MAX_CHUNKS,
+    EVAL_TOP_K,
+    EVAL_ROW_BLOCK,
+    EVAL_MAX_KL_DIVERGENCE,
+    EVAL_MAX_PERPLEXITY_INCREASE
+)
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    """Row-wise log-softmax of a (tokens, vocab) array"""
+    logits = logits.astype(np.float32, copy=False)
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+
+def compare_logprobs(base_logprobs: np.ndarray, logprobs: np.ndarray, targets: np.ndarray,
+                     top_k: int = EVAL_TOP_K) -> Dict[str, np.ndarray]:
+    """Per-token quality statistics of a variant against the base model.
+
+    All inputs are row-aligned: ``base_logprobs`` and ``logprobs`` are
+    (tokens, vocab) log-probabilities and ``targets`` the next token of each
+    row. Returns per-token arrays of the variant's negative log-likelihood,
+    KL(base || variant), top-1 agreement and top-k overlap.
+    """
+    base_logprobs = base_logprobs.astype(np.float32, copy=False)
+    rows = np.arange(len(targets))
+
+    kl = (np.exp(base_logprobs) * (base_logprobs - logprobs)).sum(axis=1)
+    base_top = np.argpartition(-base_logprobs, top_k, axis=1)[:, :top_k]
+    top = np.argpartition(-logprobs, top_k, axis=1)[:, :top_k]
+    overlap = (base_top[:, :, None] == top[:, None, :]).any(axis=2).sum(axis=1) / top_k
+
+    return {
+        "nll": -logprobs[rows, targets],
+        "kl": np.maximum(kl, 0.0),
+        "top1": base_logprobs.argmax(axis=1) == logprobs.argmax(axis=1),
+        "topk": overlap
+    }
+
+def summarize_quality(stats: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Aggregate per-token statistics into perplexity and divergence figures"""
+    nll = stats["nll"]
+    perplexity = float(np.exp(nll.mean()))
+    summary = {
+        "tokens": int(len(nll)),
+        "perplexity": round(perplexity, 4),
+        # Delta method: the standard error of the mean NLL scaled by the perplexity
+        "perplexity_stderr": round(perplexity * float(nll.std()) / max(np.sqrt(len(nll)), 1.0), 4)
+    }
+    if "kl" in stats:
+        kl = stats["kl"]
+        summary.update({
+            "kl_divergence_mean": round(float(kl.mean()), 6),
+            "kl_divergence_median": round(float(np.median(kl)), 6),
+            "kl_divergence_p99": round(float(np.percentile(kl, 99)), 6),
+            "kl_divergence_max": round(float(kl.max()), 6),
+            "top1_agreement": round(float(stats["top1"].mean()), 4),
+            "topk_agreement": round(float(stats["topk"].mean()), 4)
+        })
+    return summary
+
+class EvaluationService:
+    """Compares quantized GGUF variants with their FP16 base on a text corpus.
+
+    The corpus is split into ``n_ctx``-token chunks. In each chunk the first
+    half serves as context and the next-token predictions of the second half
+    are scored, as llama-perplexity does. The base model's log-probabilities
+    are computed once and kept on disk as float16, so every variant is
+    compared against the same reference without holding two models in
+    memory at once.
+    """
+
+    def __init__(self, corpus_path: str = EVAL_CORPUS_PATH, output_dir: str = EVAL_OUTPUT_DIR,
+                 n_ctx: int = EVAL_CONTEXT_SIZE, max_chunks: int = EVAL_MAX_CHUNKS, top_k: int = EVAL_TOP_K,
+                 threads: Union[int, str] = DEFAULT_THREADS, loader: Callable[..., "Llama"] = create_optimized_llama):
+        self.corpus_path = corpus_path
+        self.output_dir = output_dir
+        self.n_ctx = n_ctx
+        self.max_chunks = max_chunks
+        self.top_k = top_k
+        self.threads = threads
+        self.loader = loader
+
+    def _load(self, model_path: str) -> "Llama":
+        return self.loader(model_path, threads=self.threads, use_mlock=False, n_ctx=self.n_ctx, logits_all=True)
+
+    def _chunks(self, model: "Llama") -> List[List[int]]:
+        """Tokenize the corpus and split it into evaluation chunks"""
+        with open(self.corpus_path, encoding="utf-8") as f:
+            text = f.read()
+        tokens = model.tokenize(text.encode("utf-8"), add_bos=False)
+        chunks = [tokens[i:i + self.n_ctx] for i in range(0, len(tokens) - self.n_ctx + 1, self.n_ctx)]
+        if not chunks:
+            raise ValueError(f"Corpus {self.corpus_path} has {len(tokens)} tokens, fewer than one {self.n_ctx}-token chunk")
+        return chunks[:self.max_chunks]
+
+    def _chunk_logprobs(self, model: "Llama", chunk: List[int]) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], float]:
+        """Evaluate a chunk and return (log-probabilities, targets) blocks of its scored rows and the eval time"""
+        model.reset()
+        start_time = time.time()
+        model.eval(chunk)
+        eval_time = time.time() - start_time
+
+        first, last = self.n_ctx // 2, len(chunk) - 1
+        targets = np.asarray(chunk[first + 1:last + 1])
+        blocks = []
+        for start in range(first, last, EVAL_ROW_BLOCK):
+            end = min(start + EVAL_ROW_BLOCK, last)
+            blocks.append((log_softmax(np.asarray(model.scores[start:end])), targets[start - first:end - first]))
+        return blocks, eval_time
+
+    def _base_dir(self, base_path: str) -> str:
+        """Cache directory of the base log-probabilities for this model, corpus and settings"""
+        key = hashlib.sha256(json.dumps([
+            fingerprint_path(base_path),
+            fingerprint_path(self.corpus_path, content_hash=True),
+            self.n_ctx,
+            self.max_chunks
+        ]).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.output_dir, f"base-{key}")
+
+    def _evaluate_model(self, model_path: str, base_dir: str, is_base: bool) -> Dict[str, Any]:
+        """Run one model over the corpus and collect its per-token statistics"""
+        load_start = time.time()
+        model = self._load(model_path)
+        load_time = time.time() - load_start
+
+        try:
+            chunks = self._chunks(model)
+            stats: Dict[str, List[np.ndarray]] = {}
+            eval_time = 0.0
+            for index, chunk in enumerate(chunks):
+                blocks, chunk_time = self._chunk_logprobs(model, chunk)
+                eval_time += chunk_time
+                chunk_path = os.path.join(base_dir, f"chunk_{index:04d}.npy")
+                if is_base:
+                    logprobs = np.concatenate([block for block, _ in blocks])
+                    np.save(chunk_path, logprobs.astype(np.float16))
+                    nll = np.concatenate([-block[np.arange(len(targets)), targets] for block, targets in blocks])
+                    stats.setdefault("nll", []).append(nll)
+                    continue
+
+                base_logprobs = np.load(chunk_path, mmap_mode="r")
+                offset = 0
+                for block, targets in blocks:
+                    block_stats = compare_logprobs(base_logprobs[offset:offset + len(targets)], block, targets, self.top_k)
+                    offset += len(targets)
+                    for name, values in block_stats.items():
+                        stats.setdefault(name, []).append(values)
+        finally:
+            close = getattr(model, "close", None)
+            if close is not None:
+                close()
+
+        header = read_gguf_header(model_path)
+        tokens_evaluated = len(chunks) * self.n_ctx
+        return {
+            "model_path": model_path,
+            "model_name": os.path.splitext(os.path.basename(model_path))[0],
+            "quant_type": header["file_type"],
+            "file_size": header["file_size"],
+            "bits_per_weight": round(header["file_size"] * 8 / header["parameter_count"], 3) if header["parameter_count"] else None,
+            "chunks": len(chunks),
+            "load_time": round(load_time, 2),
+            "prompt_tokens_per_second": round(tokens_evaluated / eval_time, 2) if eval_time > 0 else 0,
+            **summarize_quality({name: np.concatenate(values) for name, values in stats.items()})
+        }
+
+    def evaluate(self, base_path: str, variant_paths: List[str]) -> Dict[str, Any]:
+        """Evaluate the base model and every variant, then write a comparison report"""
+        base_dir = self._base_dir(base_path)
+        ensure_directory_exists(base_dir)
+        start_time = time.time()
+
+        # The base pass is the slowest; reuse it while model, corpus and settings are unchanged
+        summary_path = os.path.join(base_dir, "summary.json")
+        if os.path.exists(summary_path):
+            with open(summary_path) as f:
+                base = json.load(f)
+            print(f"Reusing base model results from {base_dir}")
+        else:
+            print(f"Evaluating base model {base_path}")
+            base = self._evaluate_model(base_path, base_dir, is_base=True)
+            with open(summary_path, "w") as f:
+                json.dump(base, f, indent=2)
+        variants = []
+        for variant_path in variant_paths:
+            print(f"Evaluating {variant_path}")
+            result = self._evaluate_model(variant_path, base_dir, is_base=False)
+            result["perplexity_increase"] = round(result["perplexity"] / base["perplexity"] - 1, 4)
+            result["size_ratio"] = round(result["file_size"] / base["file_size"], 4)
+            result["speedup"] = (round(result["prompt_tokens_per_second"] / base["prompt_tokens_per_second"], 2)
+                                 if base["prompt_tokens_per_second"] else None)
+            result["meets_quality_bar"] = (
+                result["kl_divergence_mean"] <= EVAL_MAX_KL_DIVERGENCE
+                and result["perplexity_increase"] <= EVAL_MAX_PERPLEXITY_INCREASE
+            )
+            variants.append(result)
+
+        passing = [variant for variant in variants if variant["meets_quality_bar"]]
+        recommended = min(passing, key=lambda variant: variant["file_size"]) if passing else None
+        report = {
+            "corpus_path": self.corpus_path,
+            "n_ctx": self.n_ctx,
+            "chunks": base["chunks"],
+            "quality_bar": {
+                "max_kl_divergence": EVAL_MAX_KL_DIVERGENCE,
+                "max_perplexity_increase": EVAL_MAX_PERPLEXITY_INCREASE
+            },
+            "base": base,
+            "variants": sorted(variants, key=lambda variant: variant["file_size"]),
+            "recommended": recommended["model_name"] if recommended else None,
+            "evaluation_time": round(time.time() - start_time, 2)
+        }
+        self._write_report(report)
+        return report
+
+    def _write_report(self, report: Dict[str, Any]):
+        """Save the report as JSON and as a Markdown table"""
+        ensure_directory_exists(self.output_dir)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        json_path = os.path.join(self.output_dir, f"report-{stamp}.json")
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        lines = [
+            "| Model | Type | Size (GiB) | Size ratio | PPL | ΔPPL | KL mean | KL p99 | Top-1 | Top-k | Prompt tok/s | Meets bar |",
+            "|---|---|---|---|---|---|---|---|---|---|---|---|"
+        ]
+        base = report["base"]
+        lines.append(
+            f"| {base['model_name']} | {base['quant_type']} | {base['file_size'] / 1024**3:.2f} | 1.00 | "
+            f"{base['perplexity']:.4f} | - | - | - | - | - | {base['prompt_tokens_per_second']} | base |"
+        )
+        for variant in report["variants"]:
+            lines.append(
+                f"| {variant['model_name']} | {variant['quant_type']} | {variant['file_size'] / 1024**3:.2f} | "
+                f"{variant['size_ratio']:.2f} | {variant['perplexity']:.4f} | {variant['perplexity_increase']:+.2%} | "
+                f"{variant['kl_divergence_mean']:.4f} | {variant['kl_divergence_p99']:.4f} | "
+                f"{variant['top1_agreement']:.2%} | {variant['topk_agreement']:.2%} | "
+                f"{variant['prompt_tokens_per_second']} | {'yes' if variant['meets_quality_bar'] else 'no'} |"
+            )
+        lines.append("")
+        lines.append(f"Recommended: {report['recommended'] or 'no variant meets the quality bar'}")
+        with open(os.path.join(self.output_dir, f"report-{stamp}.md"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        report["report_path"] = json_path
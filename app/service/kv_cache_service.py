@@ -0,0 +1,172 @@
+# Service for per-model KV cache settings and context sizing
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, Optional
+from common.helpers import ensure_directory_exists
+from common.kv_cache import check_kv_cache_type, kv_cache_bytes, logits_bytes, recommend_context_size
+from common.constants import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONTEXT_SIZE,
+    KV_CACHE_TYPE_K,
+    KV_CACHE_TYPE_V,
+    CONTEXT_SIZE_AUTO,
+    MODEL_SETTINGS,
+    CONTEXT_STATS_PATH,
+    CONTEXT_STATS_MAX_SAMPLES,
+    CONTEXT_STATS_MIN_SAMPLES,
+    CONTEXT_STATS_SAVE_INTERVAL,
+    MODEL_COMPUTE_BUFFER_BYTES,
+    MODEL_MEMORY_OVERHEAD_BYTES
+)
+
+if TYPE_CHECKING:
+    from service.model_registry_service import ModelEntry, ModelRegistryService
+
+class KVCacheService:
+    """Chooses the context size and KV cache types each model is loaded with.
+
+    Defaults are ``DEFAULT_CONTEXT_SIZE`` and ``KV_CACHE_TYPE_K``/``_V``;
+    ``MODEL_SETTINGS`` overrides them per model name or alias, so the 4-bit
+    and 8-bit builds can differ. With ``n_ctx`` set to ``CONTEXT_SIZE_AUTO``
+    the context is sized from the sequence lengths (untrimmed prompt plus
+    completion) observed for the model. They are kept in ``stats_path``, so
+    the next load or restart uses them; until ``min_samples`` exist the
+    default context is used.
+    """
+
+    def __init__(self, registry: "ModelRegistryService", settings: Optional[Dict[str, Dict[str, Any]]] = None,
+                 stats_path: Optional[str] = CONTEXT_STATS_PATH, max_samples: int = CONTEXT_STATS_MAX_SAMPLES,
+                 min_samples: int = CONTEXT_STATS_MIN_SAMPLES):
+        self.registry = registry
+        self.settings = dict(MODEL_SETTINGS if settings is None else settings)
+        self.stats_path = stats_path
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self.loaded: Dict[str, Dict[str, Any]] = {}     # Settings of resident models, by path
+        self._samples: Dict[str, Deque[int]] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._read_stats()
+
+    def _read_stats(self):
+        if not self.stats_path:
+            return
+        try:
+            with open(self.stats_path) as f:
+                models = json.load(f).get("models", {})
+        except (OSError, ValueError):
+            return
+        for name, lengths in models.items():
+            self._samples[name] = deque(lengths, maxlen=self.max_samples)
+
+    def save(self):
+        """Write the observed sequence lengths to ``stats_path``"""
+        if not self.stats_path:
+            return
+        with self._lock:
+            stats = {"models": {name: list(lengths) for name, lengths in self._samples.items()}, "saved_at": time.time()}
+            self._unsaved = 0
+        ensure_directory_exists(os.path.dirname(self.stats_path) or ".")
+        tmp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, self.stats_path)
+
+    def observe(self, model_name: str, sequence_tokens: int):
+        """Record the context a finished generation needed"""
+        with self._lock:
+            self._samples.setdefault(model_name, deque(maxlen=self.max_samples)).append(sequence_tokens)
+            self._unsaved += 1
+            due = self._unsaved >= CONTEXT_STATS_SAVE_INTERVAL
+        if due:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Could not save context statistics: {e}")
+
+    def recommended_context(self, entry: "ModelEntry") -> Optional[int]:
+        """Context size covering the observed sequences, or None with too few observations"""
+        with self._lock:
+            lengths = list(self._samples.get(entry.name, ()))
+        if len(lengths) < self.min_samples:
+            return None
+        try:
+            maximum = entry.header().get("context_length")
+        except (OSError, ValueError):
+            maximum = None
+        return recommend_context_size(lengths, maximum=maximum)
+
+    def settings_for(self, entry: "ModelEntry") -> Dict[str, Any]:
+        """Configured n_ctx and KV cache types for a model, before context sizing"""
+        settings: Dict[str, Any] = {"n_ctx": DEFAULT_CONTEXT_SIZE, "type_k": KV_CACHE_TYPE_K, "type_v": KV_CACHE_TYPE_V}
+        for name, overrides in self.settings.items():
+            if name in self.registry and self.registry.resolve(name).path == entry.path:
+                settings.update(overrides)
+        check_kv_cache_type(settings["type_k"])
+        check_kv_cache_type(settings["type_v"])
+        return settings
+
+    def load_options(self, entry: "ModelEntry") -> Dict[str, Any]:
+        """``n_ctx``, ``type_k`` and ``type_v`` to load the model with"""
+        settings = self.settings_for(entry)
+        if settings["n_ctx"] == CONTEXT_SIZE_AUTO:
+            settings["n_ctx"] = self.recommended_context(entry) or DEFAULT_CONTEXT_SIZE
+        return {"n_ctx": int(settings["n_ctx"]), "type_k": settings["type_k"], "type_v": settings["type_v"]}
+
+    def current_options(self, entry: "ModelEntry") -> Dict[str, Any]:
+        """Settings the model is loaded with, or will be loaded with next"""
+        options = self.loaded.get(entry.path) if entry.model is not None else None
+        return options or self.load_options(entry)
+
+    def kv_bytes(self, entry: "ModelEntry", options: Dict[str, Any]) -> Optional[int]:
+        try:
+            header = entry.header()
+        except (OSError, ValueError):
+            return None
+        return kv_cache_bytes(header, options["n_ctx"], options["type_k"], options["type_v"])
+
+    def logits_bytes(self, entry: "ModelEntry", options: Dict[str, Any], logits_all: bool = False) -> Optional[int]:
+        """Size of llama_cpp's logits buffer: a row per batch position, or per context position with ``logits_all``"""
+        try:
+            header = entry.header()
+        except (OSError, ValueError):
+            return None
+        return logits_bytes(header, options["n_ctx"] if logits_all else DEFAULT_BATCH_SIZE)
+
+    def overhead_bytes(self, entry: "ModelEntry", logits_all: bool = False) -> int:
+        """Memory the model needs beyond its weights at the settings it will be loaded with"""
+        options = self.current_options(entry)
+        kv_bytes = self.kv_bytes(entry, options)
+        if kv_bytes is None:
+            return MODEL_MEMORY_OVERHEAD_BYTES
+        return kv_bytes + (self.logits_bytes(entry, options, logits_all) or 0) + MODEL_COMPUTE_BUFFER_BYTES
+
+    def state_key(self, entry: "ModelEntry") -> str:
+        """Name under which KV state snapshots of a resident model are cached.
+
+        Snapshots only restore into the same context size and cache types.
+        """
+        options = self.loaded.get(entry.path)
+        if options is None:
+            return entry.name
+        return f"{entry.name}|n_ctx={options['n_ctx']}|k={options['type_k']}|v={options['type_v']}"
+
+    def describe(self, entry: "ModelEntry", logits_all: bool = False) -> Dict[str, Any]:
+        """KV cache settings and memory estimate of a model, as loaded or as it would be loaded"""
+        options = self.current_options(entry)
+        with self._lock:
+            samples = len(self._samples.get(entry.name, ()))
+        kv_bytes = self.kv_bytes(entry, options)
+        return {
+            **options,
+            "configured_n_ctx": self.settings_for(entry)["n_ctx"],
+            "recommended_n_ctx": self.recommended_context(entry),
+            "observed_sequences": samples,
+            "kv_cache_bytes": kv_bytes,
+            "logits_bytes": self.logits_bytes(entry, options, logits_all),
+            "weights_bytes": entry.file_size,
+            "estimated_bytes": entry.file_size + self.overhead_bytes(entry, logits_all)
+        }
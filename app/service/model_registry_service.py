@@ -0,0 +1,306 @@
+# Service for discovering and loading GGUF models
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from common.model_utils import create_optimized_llama, read_model_manifest
+from common.gguf_reader import read_gguf_header
+from common.constants import (
+    MODEL_DIR,
+    HF_MODEL_ID,
+    QUANT_MANIFEST_PATH,
+    MODEL_FILE_EXTENSION,
+    MODEL_ALIASES,
+    MODEL_MEMORY_BUDGET_BYTES,
+    MODEL_MEMORY_BUDGET_FRACTION,
+    MODEL_MEMORY_OVERHEAD_BYTES
+)
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+QUANT_TYPE_PATTERN = re.compile(r"(?:^|[_\-.])(IQ\d_[A-Z]+|Q\d_K(?:_[SML])?|Q\d_\d|BF16|F16|F32)(?=$|[_\-.])")
+
+def parse_quant_type(file_name: str) -> Optional[str]:
+    """Extract the llama.cpp quantization type from a GGUF file name"""
+    stem = os.path.splitext(os.path.basename(file_name))[0].upper()
+    matches = QUANT_TYPE_PATTERN.findall(stem)
+    return matches[-1] if matches else None
+
+def physical_memory_bytes() -> Optional[int]:
+    """Total physical memory of the host, when available"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+class ModelEntry:
+    """A GGUF file known to the registry and, when resident, its Llama instance"""
+
+    def __init__(self, name: str, path: str, manifest: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.path = path
+        self.manifest = manifest
+        self.quant_type = (manifest or {}).get("quant_type") or parse_quant_type(path)
+        self.file_size = os.path.getsize(path)
+        self.model: Optional["Llama"] = None
+        self.load_time: Optional[float] = None
+        self.last_used = 0.0
+        self.in_use = 0
+        self.overhead_bytes = MODEL_MEMORY_OVERHEAD_BYTES
+        self._header: Optional[Dict[str, Any]] = None
+        self._header_mtime: Optional[float] = None
+
+    def header(self) -> Dict[str, Any]:
+        """GGUF header metadata, read once per file version without loading weights"""
+        mtime = os.path.getmtime(self.path)
+        if self._header is None or self._header_mtime != mtime:
+            self._header = read_gguf_header(self.path)
+            self._header_mtime = mtime
+            if self._header["file_type"]:
+                self.quant_type = self._header["file_type"]
+        return self._header
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Memory the model is expected to take once loaded"""
+        return self.file_size + self.overhead_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "quant_type": self.quant_type,
+            "source_model": (self.manifest or {}).get("source_model"),
+            "imatrix": (self.manifest or {}).get("imatrix"),
+            "file_size": self.file_size,
+            "loaded": self.model is not None,
+            "load_time": round(self.load_time, 2) if self.load_time is not None else None,
+            "in_use": self.in_use
+        }
+
+class ModelRegistryService:
+    """Registry of the GGUF models found under ``MODEL_DIR``.
+
+    Models are addressable by file name (without extension), by quantization
+    type when only one file has it, and by the legacy ``MODEL_ALIASES``.
+    Models listed in the quantization manifest carry their source model and
+    importance-matrix details. They are loaded on demand; when loading
+    would exceed the memory budget, the least recently used idle models
+    are unloaded first. Each file is only ever loaded once. ``overhead``
+    estimates the memory a model needs beyond its weights (KV cache and
+    buffers) at the settings it will be loaded with. ``on_unload`` is
+    called with a model before it is closed, to free what was built on it.
+    """
+
+    def __init__(self, model_dir: str = MODEL_DIR, memory_budget_bytes: Optional[int] = MODEL_MEMORY_BUDGET_BYTES,
+                 loader: Callable[[str], "Llama"] = create_optimized_llama,
+                 overhead: Optional[Callable[[ModelEntry], int]] = None,
+                 on_unload: Optional[Callable[["Llama"], None]] = None):
+        self.model_dir = model_dir
+        self.manifest_path = os.path.join(model_dir, os.path.relpath(QUANT_MANIFEST_PATH, MODEL_DIR))
+        self.loader = loader
+        self.overhead = overhead
+        self.on_unload = on_unload
+        if memory_budget_bytes is None:
+            total = physical_memory_bytes()
+            memory_budget_bytes = int(total * MODEL_MEMORY_BUDGET_FRACTION) if total else None
+        self.memory_budget_bytes = memory_budget_bytes
+
+        self.entries: Dict[str, ModelEntry] = {}
+        self.aliases: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self.evictions = 0
+        self.scan()
+
+    def scan(self) -> List[ModelEntry]:
+        """Discover GGUF files, keeping entries of models that are already loaded"""
+        found: Dict[str, str] = {}
+        manifest: Dict[str, Dict[str, Any]] = {}
+        manifest_dir = os.path.dirname(self.manifest_path)
+        for model in read_model_manifest(self.manifest_path)["models"]:
+            path = os.path.realpath(os.path.join(manifest_dir, model["path"]))
+            if os.path.isfile(path):
+                manifest[path] = model
+                found[path] = model.get("name") or os.path.splitext(os.path.basename(path))[0]
+        if os.path.isdir(self.model_dir):
+            for root, _, files in os.walk(self.model_dir):
+                for file_name in sorted(files):
+                    if file_name.endswith(MODEL_FILE_EXTENSION):
+                        path = os.path.realpath(os.path.join(root, file_name))
+                        found.setdefault(path, os.path.splitext(file_name)[0])
+        for path in MODEL_ALIASES.values():
+            if os.path.isfile(path):
+                found.setdefault(os.path.realpath(path), os.path.splitext(os.path.basename(path))[0])
+
+        with self._lock:
+            by_path = {entry.path: entry for entry in self.entries.values()}
+            entries: Dict[str, ModelEntry] = {}
+            for path, name in found.items():
+                entry = by_path.get(path) or ModelEntry(name, path, manifest.get(path))
+                entry.manifest = manifest.get(path, entry.manifest)
+                entries[entry.name] = entry
+            # Keep loaded models reachable even if their file disappeared
+            for entry in by_path.values():
+                if entry.model is not None:
+                    entries.setdefault(entry.name, entry)
+            self.entries = entries
+            self.aliases = self._build_aliases()
+            return list(entries.values())
+
+    def _build_aliases(self) -> Dict[str, str]:
+        aliases: Dict[str, str] = {}
+        by_quant: Dict[str, List[str]] = {}
+        for entry in self.entries.values():
+            if entry.quant_type:
+                by_quant.setdefault(entry.quant_type, []).append(entry.name)
+        for quant_type, names in by_quant.items():
+            if len(names) == 1:
+                aliases[quant_type] = names[0]
+        for alias, path in MODEL_ALIASES.items():
+            real_path = os.path.realpath(path)
+            for entry in self.entries.values():
+                if entry.path == real_path:
+                    aliases[alias] = entry.name
+            # Fall back to the manifest's build of the same type of the default model
+            if alias not in aliases:
+                quant_type = parse_quant_type(path)
+                for entry in self.entries.values():
+                    if entry.quant_type == quant_type and (entry.manifest or {}).get("source_model") == HF_MODEL_ID:
+                        aliases[alias] = entry.name
+        return aliases
+
+    def resolve(self, name: str) -> ModelEntry:
+        """Find a model by name or alias, rescanning the model directory once on a miss"""
+        for attempt in range(2):
+            with self._lock:
+                entry = self.entries.get(self.aliases.get(name, name))
+            if entry is not None:
+                return entry
+            if attempt == 0:
+                self.scan()
+        raise ValueError(f"Unsupported model type: {name}")
+
+    def find_by_path(self, path: str) -> Optional[ModelEntry]:
+        """Entry of the model file at ``path``, if known"""
+        path = os.path.realpath(path)
+        with self._lock:
+            return next((entry for entry in self.entries.values() if entry.path == path), None)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return self.aliases.get(name, name) in self.entries
+
+    def acquire(self, name: str) -> "Llama":
+        """Return the loaded model, loading it if needed, and mark it in use"""
+        return self.load(name, acquire=True).model
+
+    def release(self, name: str):
+        """Mark a model acquired with ``acquire`` as idle again"""
+        entry = self.resolve(name)
+        with self._lock:
+            entry.in_use = max(entry.in_use - 1, 0)
+            entry.last_used = time.time()
+
+    def load(self, name: str, acquire: bool = False) -> ModelEntry:
+        """Make a model resident, evicting idle models to stay within the memory budget.
+
+        With ``acquire`` the model is marked in use in the same step, so it
+        cannot be evicted before the caller gets hold of it.
+        """
+        entry = self.resolve(name)
+        if self._use_if_loaded(entry, acquire):
+            return entry
+
+        with self._load_lock:
+            if self._use_if_loaded(entry, acquire):
+                return entry
+            if self.overhead is not None:
+                entry.overhead_bytes = self.overhead(entry)
+            self._make_room(entry)
+            start_time = time.time()
+            model = self.loader(entry.path)
+            with self._lock:
+                entry.model = model
+                entry.load_time = time.time() - start_time
+                self._use_if_loaded(entry, acquire)
+        return entry
+
+    def _use_if_loaded(self, entry: ModelEntry, acquire: bool) -> bool:
+        """Touch a resident model, taking a use of it with ``acquire``. Returns whether it is resident."""
+        with self._lock:
+            if entry.model is None:
+                return False
+            if acquire:
+                entry.in_use += 1
+            entry.last_used = time.time()
+            return True
+
+    def _make_room(self, entry: ModelEntry):
+        """Unload least recently used idle models until ``entry`` fits in the budget"""
+        if self.memory_budget_bytes is None:
+            return
+        with self._lock:
+            resident = [e for e in self.entries.values() if e.model is not None and e is not entry]
+            used = sum(e.estimated_bytes for e in resident)
+            for candidate in sorted(resident, key=lambda e: e.last_used):
+                if used + entry.estimated_bytes <= self.memory_budget_bytes:
+                    break
+                if candidate.in_use:
+                    continue
+                self._unload(candidate)
+                self.evictions += 1
+                used -= candidate.estimated_bytes
+
+            if used + entry.estimated_bytes > self.memory_budget_bytes:
+                raise MemoryError(
+                    f"Cannot load model '{entry.name}' ({entry.estimated_bytes} bytes): "
+                    f"{used} of {self.memory_budget_bytes} budget bytes are held by models in use"
+                )
+
+    def _unload(self, entry: ModelEntry):
+        model = entry.model
+        entry.model = None
+        if model is not None:
+            print(f"Unloading model {entry.name}")
+            if self.on_unload is not None:
+                self.on_unload(model)
+            close = getattr(model, "close", None)
+            if close is not None:
+                close()
+
+    def unload(self, name: str) -> bool:
+        """Unload an idle model. Returns False when it is in use."""
+        entry = self.resolve(name)
+        with self._lock:
+            if entry.in_use:
+                return False
+            self._unload(entry)
+            return True
+
+    def get_loaded(self, name: str) -> Optional["Llama"]:
+        """Return the model if it is resident, without loading it"""
+        try:
+            return self.resolve(name).model
+        except ValueError:
+            return None
+
+    def loaded_entries(self) -> List[ModelEntry]:
+        with self._lock:
+            return [entry for entry in self.entries.values() if entry.model is not None]
+
+    def list_models(self) -> Dict[str, Any]:
+        """Describe every known model, the aliases and the memory budget"""
+        with self._lock:
+            entries = list(self.entries.values())
+            aliases = dict(self.aliases)
+        resident = [entry for entry in entries if entry.model is not None]
+        return {
+            "models": [entry.to_dict() for entry in entries],
+            "aliases": aliases,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "memory_used_bytes": sum(entry.estimated_bytes for entry in resident),
+            "evictions": self.evictions
+        }
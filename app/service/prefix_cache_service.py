@@ -0,0 +1,110 @@
+# Service for reusing the KV state of shared prompt prefixes
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from common.cache_utils import ByteLRUCache, DiskCache
+from common.constants import PREFIX_CACHE_CAPACITY_BYTES, PREFIX_CACHE_DIR, PREFIX_CACHE_DISK_CAPACITY_BYTES
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama, LlamaState
+
+def llama_state_nbytes(state: "LlamaState") -> int:
+    """Approximate memory held by a llama state snapshot"""
+    return int(state.llama_state_size) + state.scores.nbytes + state.input_ids.nbytes
+
+def compact_llama_state(state: "LlamaState") -> "LlamaState":
+    """Drop the logits buffer copied into a llama state snapshot.
+
+    ``save_state`` copies a float32 row over the vocabulary per batch
+    position (per context position with ``logits_all``), hundreds of MB to
+    GBs. Sampling reads the logits of the llama context instead, so a
+    single zero row is kept; ``load_state`` broadcasts it.
+    """
+    import numpy as np
+
+    state.scores = np.zeros((1, state.scores.shape[1]), dtype=state.scores.dtype)
+    return state
+
+class PrefixCacheService:
+    """Cache of llama states taken right after evaluating a shared prompt prefix.
+
+    Before a request the model is put in a state where the prefix is already
+    in the KV cache, so llama_cpp only prefills the request-specific suffix.
+    Lookups try, in order: the model's current state, the RAM tier and the
+    optional disk tier, before evaluating the prefix and snapshotting it.
+    """
+
+    def __init__(self, capacity_bytes: int = PREFIX_CACHE_CAPACITY_BYTES,
+                 disk_dir: Optional[str] = PREFIX_CACHE_DIR,
+                 disk_capacity_bytes: int = PREFIX_CACHE_DISK_CAPACITY_BYTES):
+        self.ram = ByteLRUCache(capacity_bytes, llama_state_nbytes)
+        self.disk = DiskCache(disk_dir, disk_capacity_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+        self.counts = {"resident": 0, "ram": 0, "disk": 0, "miss": 0}
+        self.prefix_tokens_reused = 0
+
+    @staticmethod
+    def make_key(model_type: str, prefix_tokens: List[int]) -> str:
+        """Key identifying a prefix for a given model"""
+        digest = hashlib.sha256(model_type.encode("utf-8"))
+        digest.update(",".join(map(str, prefix_tokens)).encode("ascii"))
+        return digest.hexdigest()
+
+    def prepare(self, model: "Llama", model_type: str, prefix_tokens: List[int]) -> str:
+        """Make ``prefix_tokens`` resident in the model's KV cache.
+
+        Returns where the prefix came from: "resident", "ram", "disk" or "miss".
+        """
+        if not prefix_tokens:
+            return "miss"
+
+        n_prefix = len(prefix_tokens)
+        if model.n_tokens >= n_prefix and model.input_ids[:n_prefix].tolist() == prefix_tokens:
+            return self._record("resident", n_prefix)
+
+        key = self.make_key(model_type, prefix_tokens)
+        state = self.ram.get(key)
+        if state is not None:
+            model.load_state(state)
+            return self._record("ram", n_prefix)
+
+        if self.disk is not None:
+            state = self.disk.get(key)
+            if state is not None:
+                self.ram.put(key, state)
+                model.load_state(state)
+                return self._record("disk", n_prefix)
+
+        model.reset()
+        model.eval(prefix_tokens)
+        state = compact_llama_state(model.save_state())
+        self.ram.put(key, state)
+        if self.disk is not None:
+            self.disk.put(key, state)
+        return self._record("miss", 0)
+
+    def _record(self, source: str, reused_tokens: int) -> str:
+        with self._lock:
+            self.counts[source] += 1
+            self.prefix_tokens_reused += reused_tokens
+        return source
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate and tier sizes"""
+        with self._lock:
+            counts = dict(self.counts)
+            reused = self.prefix_tokens_reused
+        lookups = sum(counts.values())
+        hits = lookups - counts["miss"]
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "misses": counts["miss"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0,
+            "hits_by_source": {source: count for source, count in counts.items() if source != "miss"},
+            "prefix_tokens_reused": reused,
+            "ram_entries": len(self.ram),
+            "ram_bytes": self.ram.size_bytes,
+            "ram_capacity_bytes": self.ram.capacity_bytes,
+            "disk_bytes": self.disk.size_bytes() if self.disk is not None else None
+        }
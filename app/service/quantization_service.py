@@ -1,107 +1,355 @@
 # Service for model quantization
+import json
 import os
-from huggingface_hub import snapshot_download
-from common.helpers import run_command, ensure_directory_exists
-from common.constants import HF_MODEL_ID, MODEL_DIR, QUANT_4BIT, QUANT_8BIT
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from common.helpers import run_logged_command, ensure_directory_exists
+from common.pipeline import PipelineRunner, PipelineStep
+from common.gguf_reader import FILE_TYPE_NAMES
+from common.model_utils import read_model_manifest
+from common.constants import (
+    HF_MODEL_ID,
+    MODEL_DIR,
+    PIPELINE_STATE_DIR,
+    PIPELINE_CPU_BUDGET,
+    PIPELINE_DISK_RESERVE_BYTES,
+    QUANT_CONFIG_PATH,
+    QUANT_MATRIX,
+    QUANT_MANIFEST_PATH,
+    IMATRIX_CHUNKS,
+    IMATRIX_QUANT_TYPES,
+    IMATRIX_REQUIRED_TYPES
+)
+
+# Types llama-quantize accepts by name
+SUPPORTED_QUANT_TYPES = set(FILE_TYPE_NAMES.values())
+
+# Approximate bits per weight, used to estimate output sizes before quantizing
+QUANT_BITS_PER_WEIGHT = {
+    "IQ1_S": 1.56, "IQ1_M": 1.75, "IQ2_XXS": 2.06, "IQ2_XS": 2.31, "IQ2_S": 2.5, "IQ2_M": 2.7,
+    "Q2_K_S": 2.97, "Q2_K": 3.35, "IQ3_XXS": 3.06, "IQ3_XS": 3.3, "IQ3_S": 3.44, "IQ3_M": 3.66,
+    "Q3_K_S": 3.41, "Q3_K_M": 3.74, "Q3_K_L": 4.03, "IQ4_XS": 4.25, "IQ4_NL": 4.5,
+    "Q4_0": 4.34, "Q4_1": 4.78, "Q4_K_S": 4.37, "Q4_K_M": 4.58, "Q5_0": 5.21, "Q5_1": 5.65,
+    "Q5_K_S": 5.21, "Q5_K_M": 5.33, "Q6_K": 6.14, "Q8_0": 8.5, "F16": 16.0, "BF16": 16.0, "F32": 32.0
+}
+
+def model_slug(hf_model_id: str) -> str:
+    """Short model name used in file and step names, e.g. ``Qwen3-8B``"""
+    return hf_model_id.rstrip("/").split("/")[-1]
+
+def quantized_model_path(hf_model_id: str, quantization_type: str, model_dir: str = MODEL_DIR) -> str:
+    """Output path of a quantized model: ``<model_dir>/<slug>/<slug>-<TYPE>.gguf``"""
+    slug = model_slug(hf_model_id)
+    return os.path.join(model_dir, slug, f"{slug}-{quantization_type}.gguf")
+
+def validate_quant_type(quantization_type: str, has_calibration: bool):
+    """Raise ValueError for types llama-quantize does not know or cannot build here"""
+    if quantization_type not in SUPPORTED_QUANT_TYPES:
+        raise ValueError(f"Unsupported quantization type: {quantization_type}")
+    if quantization_type in IMATRIX_REQUIRED_TYPES and not has_calibration:
+        raise ValueError(f"Quantization type {quantization_type} needs a calibration_file for its importance matrix")
+
+class QuantizationTarget:
+    """One source model of the quantization matrix and the types built from it"""
+
+    def __init__(self, hf_model_id: str, quant_types: Iterable[str], calibration_file: Optional[str] = None,
+                 imatrix_chunks: int = IMATRIX_CHUNKS, imatrix_types: Optional[Iterable[str]] = None):
+        self.hf_model_id = hf_model_id
+        self.slug = model_slug(hf_model_id)
+        self.quant_types = [quant_type.upper() for quant_type in quant_types]
+        self.calibration_file = os.path.abspath(calibration_file) if calibration_file else None
+        self.imatrix_chunks = imatrix_chunks
+        self.imatrix_types = set(imatrix_types if imatrix_types is not None else IMATRIX_QUANT_TYPES)
+
+        for quant_type in self.quant_types:
+            validate_quant_type(quant_type, self.calibration_file is not None)
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "QuantizationTarget":
+        if "hf_model_id" not in config:
+            raise ValueError("Quantization matrix entries need an hf_model_id")
+        return cls(
+            config["hf_model_id"],
+            config.get("quant_types", []),
+            calibration_file=config.get("calibration_file"),
+            imatrix_chunks=config.get("imatrix_chunks", IMATRIX_CHUNKS),
+            imatrix_types=config.get("imatrix_types")
+        )
+
+    def uses_imatrix(self, quantization_type: str) -> bool:
+        return self.calibration_file is not None and quantization_type in self.imatrix_types
+
+def load_quant_matrix(config_path: Optional[str] = QUANT_CONFIG_PATH) -> List[QuantizationTarget]:
+    """Read the quantization matrix from ``config_path``, falling back to ``QUANT_MATRIX``"""
+    matrix = QUANT_MATRIX
+    if config_path and os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+        matrix = config["models"] if isinstance(config, dict) else config
+    return [QuantizationTarget.from_dict(entry) for entry in matrix]
 
 class QuantizationService:
-    """Service for handling model quantization"""
-    
-    def __init__(self):
-        self.llama_cpp_dir = "llama.cpp"
-        self.quantized_dir = MODEL_DIR
-    
-    def download_model(self) -> bool:
-        """Download the model from Hugging Face Hub"""
-        try:
-            print(f"Downloading model {HF_MODEL_ID}...")
-            snapshot_download(
-                repo_id=HF_MODEL_ID, 
-                local_dir=f"{HF_MODEL_ID}", 
-                revision="main"
+    """Service for handling model quantization.
+
+    Setup is a graph of steps: build llama.cpp, then per source model a
+    download, an FP16 GGUF conversion, an optional importance matrix and one
+    quantization per configured type. Steps whose inputs and outputs are
+    unchanged since their last successful run are skipped, and the
+    quantizations run concurrently. Finished models are recorded in the
+    manifest read by the model registry.
+    """
+
+    def __init__(self, matrix: Optional[List[QuantizationTarget]] = None, config_path: Optional[str] = QUANT_CONFIG_PATH):
+        self.llama_cpp_dir = os.path.abspath("llama.cpp")
+        self.quantized_dir = os.path.abspath(MODEL_DIR)
+        self.manifest_path = os.path.abspath(QUANT_MANIFEST_PATH)
+        self.quantize_binary = os.path.join(self.llama_cpp_dir, "build", "bin", "llama-quantize")
+        self.imatrix_binary = os.path.join(self.llama_cpp_dir, "build", "bin", "llama-imatrix")
+        self.matrix = matrix if matrix is not None else load_quant_matrix(config_path)
+        self.state_dir = os.path.abspath(PIPELINE_STATE_DIR)
+        self.cpu_budget = PIPELINE_CPU_BUDGET or os.cpu_count() or 1
+        self._manifest_lock = threading.Lock()
+
+    def _target(self, hf_model_id: Optional[str] = None) -> QuantizationTarget:
+        """Matrix entry for a source model, by default the first one"""
+        hf_model_id = hf_model_id or (self.matrix[0].hf_model_id if self.matrix else HF_MODEL_ID)
+        for target in self.matrix:
+            if target.hf_model_id == hf_model_id:
+                return target
+        target = QuantizationTarget(hf_model_id, [])
+        self.matrix.append(target)
+        return target
+
+    def _hf_model_dir(self, target: QuantizationTarget) -> str:
+        return os.path.abspath(target.hf_model_id)
+
+    def _fp16_path(self, target: QuantizationTarget) -> str:
+        return os.path.abspath(quantized_model_path(target.hf_model_id, "F16", self.quantized_dir))
+
+    def _imatrix_path(self, target: QuantizationTarget) -> str:
+        return os.path.join(self.quantized_dir, target.slug, f"{target.slug}.imatrix")
+
+    def _quant_output(self, target: QuantizationTarget, quantization_type: str) -> str:
+        return os.path.abspath(quantized_model_path(target.hf_model_id, quantization_type, self.quantized_dir))
+
+    def _estimated_quant_bytes(self, target: QuantizationTarget, quantization_type: str) -> int:
+        fp16_path = self._fp16_path(target)
+        fp16_size = os.path.getsize(fp16_path) if os.path.exists(fp16_path) else 0
+        return int(fp16_size * QUANT_BITS_PER_WEIGHT.get(quantization_type, 16.0) / 16)
+
+    def build_pipeline(self) -> List[PipelineStep]:
+        """Describe the setup steps, their inputs, outputs and resource needs"""
+        quant_count = sum(len(target.quant_types) for target in self.matrix)
+        quant_threads = max(self.cpu_budget // max(quant_count, 1), 1)
+        steps = [
+            PipelineStep(
+                "build_llama_cpp",
+                self._build_llama_cpp,
+                inputs=[self.llama_cpp_dir],
+                outputs=[self.quantize_binary, self.imatrix_binary],
+                cpu=self.cpu_budget,
+                exclude=["build", ".git"]
             )
-            return True
-        except Exception as e:
-            print(f"Error downloading model: {e}")
-            return False
-    
-    def build_llama_cpp(self) -> bool:
-        """Build llama.cpp from source"""
-        print("Building llama.cpp...")
-        
-        # Create build directory and build
-        if not run_command(["cmake", "-B", "build"], self.llama_cpp_dir):
-            return False
-        
-        if not run_command(["cmake", "--build", "build", "--config", "Release"], self.llama_cpp_dir):
-            return False
-            
-        return True
-    
-    def convert_to_gguf(self) -> bool:
-        """Convert HF model to GGUF format"""
-        print("Converting model to GGUF format...")
-        
+        ]
+
+        for target in self.matrix:
+            hf_model_dir = self._hf_model_dir(target)
+            fp16_path = self._fp16_path(target)
+            steps.append(PipelineStep(
+                f"download_{target.slug}",
+                lambda log_path, t=target: self._download(t, log_path),
+                outputs=[hf_model_dir],
+                params={"repo_id": target.hf_model_id, "revision": "main"},
+                exclude=[".cache"]
+            ))
+            steps.append(PipelineStep(
+                f"convert_{target.slug}",
+                lambda log_path, t=target: self._convert_to_gguf(t, log_path),
+                inputs=[hf_model_dir, os.path.join(self.llama_cpp_dir, "convert_hf_to_gguf.py")],
+                outputs=[fp16_path],
+                depends_on=[f"download_{target.slug}", "build_llama_cpp"],
+                params={"outtype": "f16"},
+                exclude=[".cache"]
+            ))
+
+            if any(target.uses_imatrix(quant_type) for quant_type in target.quant_types):
+                steps.append(PipelineStep(
+                    f"imatrix_{target.slug}",
+                    lambda log_path, t=target: self._compute_imatrix(t, log_path),
+                    inputs=[fp16_path, target.calibration_file, self.imatrix_binary],
+                    outputs=[self._imatrix_path(target)],
+                    depends_on=[f"convert_{target.slug}"],
+                    params={"chunks": target.imatrix_chunks},
+                    cpu=self.cpu_budget
+                ))
+
+            for quant_type in target.quant_types:
+                uses_imatrix = target.uses_imatrix(quant_type)
+                inputs = [fp16_path, self.quantize_binary]
+                depends_on = [f"convert_{target.slug}"]
+                if uses_imatrix:
+                    inputs.append(self._imatrix_path(target))
+                    depends_on.append(f"imatrix_{target.slug}")
+                steps.append(PipelineStep(
+                    f"quantize_{target.slug}_{quant_type}",
+                    lambda log_path, t=target, q=quant_type, n=quant_threads: self._quantize(t, q, n, log_path),
+                    inputs=inputs,
+                    outputs=[self._quant_output(target, quant_type)],
+                    depends_on=depends_on,
+                    params={"quantization_type": quant_type, "imatrix": uses_imatrix},
+                    cpu=quant_threads,
+                    disk_bytes=lambda t=target, q=quant_type: self._estimated_quant_bytes(t, q)
+                ))
+        return steps
+
+    def _download(self, target: QuantizationTarget, log_path: str):
+        from huggingface_hub import snapshot_download
+
+        snapshot_download(
+            repo_id=target.hf_model_id,
+            local_dir=self._hf_model_dir(target),
+            revision="main"
+        )
+
+    def _build_llama_cpp(self, log_path: str):
+        # cmake rebuilds only the targets whose sources changed
+        run_logged_command(["cmake", "-B", "build"], self.llama_cpp_dir, log_path)
+        run_logged_command(
+            ["cmake", "--build", "build", "--config", "Release", "--parallel", str(self.cpu_budget),
+             "--target", "llama-quantize", "llama-imatrix"],
+            self.llama_cpp_dir,
+            log_path
+        )
+
+    def _convert_to_gguf(self, target: QuantizationTarget, log_path: str):
+        fp16_path = self._fp16_path(target)
+        ensure_directory_exists(os.path.dirname(fp16_path))
         cmd = [
-            "python", "convert_hf_to_gguf.py", 
-            f"../{HF_MODEL_ID}", 
-            "--outtype", "f16", 
-            "--outfile", f"../{MODEL_DIR}/Qwen3-8B_FP16.gguf"
+            "python", "convert_hf_to_gguf.py",
+            self._hf_model_dir(target),
+            "--outtype", "f16",
+            "--outfile", fp16_path
         ]
-        
-        return run_command(cmd, self.llama_cpp_dir)
-    
-    def quantize_model(self, quantization_type: str) -> bool:
-        """Quantize model to specified format"""
-        print(f"Quantizing model to {quantization_type}...")
-        
-        input_path = f"../{MODEL_DIR}/Qwen3-8B_FP16.gguf"
-        
-        if quantization_type == QUANT_4BIT:
-            output_path = f"../{MODEL_DIR}/4bit/Qwen3-8B_FP16_Q4_K_M.gguf"
-        elif quantization_type == QUANT_8BIT:
-            output_path = f"../{MODEL_DIR}/8bit/Qwen3-8B_FP16_Q8_0.gguf"
-        else:
-            raise ValueError(f"Unsupported quantization type: {quantization_type}")
-        
-        # Ensure output directory exists
-        ensure_directory_exists(os.path.dirname(output_path))
-        
+        run_logged_command(cmd, self.llama_cpp_dir, log_path)
+
+    def _compute_imatrix(self, target: QuantizationTarget, log_path: str):
+        """Compute the importance matrix shared by every low-bit variant of a model"""
+        output_path = self._imatrix_path(target)
+        tmp_path = f"{output_path}.tmp"
         cmd = [
-            "build/bin/llama-quantize", 
-            input_path, 
-            output_path, 
-            quantization_type
+            self.imatrix_binary,
+            "-m", self._fp16_path(target),
+            "-f", target.calibration_file,
+            "-o", tmp_path,
+            "--chunks", str(target.imatrix_chunks),
+            "-t", str(self.cpu_budget)
         ]
-        
-        return run_command(cmd, self.llama_cpp_dir)
-    
-    def setup_models(self) -> bool:
-        """Complete setup process for both 4-bit and 8-bit models"""
-        # Create directories
-        ensure_directory_exists(self.quantized_dir)
-        ensure_directory_exists(f"{self.quantized_dir}/4bit")
-        ensure_directory_exists(f"{self.quantized_dir}/8bit")
-        
-        # Download model
-        if not self.download_model():
-            return False
-        
-        # Build llama.cpp
-        if not self.build_llama_cpp():
-            return False
-        
-        # Convert to GGUF
-        if not self.convert_to_gguf():
-            return False
-        
-        # Quantize to 4-bit
-        if not self.quantize_model(QUANT_4BIT):
-            return False
-        
-        # Quantize to 8-bit
-        if not self.quantize_model(QUANT_8BIT):
+        run_logged_command(cmd, self.llama_cpp_dir, log_path)
+        os.replace(tmp_path, output_path)
+
+    def _quantize(self, target: QuantizationTarget, quantization_type: str, threads: int, log_path: str):
+        output_path = self._quant_output(target, quantization_type)
+        ensure_directory_exists(os.path.dirname(output_path))
+
+        # Write to a temporary file so an interrupted run never leaves a
+        # truncated model that looks finished
+        tmp_path = f"{output_path}.tmp"
+        cmd = [self.quantize_binary]
+        if target.uses_imatrix(quantization_type):
+            cmd += ["--imatrix", self._imatrix_path(target)]
+        cmd += [self._fp16_path(target), tmp_path, quantization_type, str(threads)]
+        run_logged_command(cmd, self.llama_cpp_dir, log_path)
+        os.replace(tmp_path, output_path)
+        self._record_manifest(target, quantization_type)
+
+    def _record_manifest(self, target: QuantizationTarget, quantization_type: str):
+        """Add or refresh a quantized model in the manifest"""
+        output_path = self._quant_output(target, quantization_type)
+        entry = {
+            "name": os.path.splitext(os.path.basename(output_path))[0],
+            "path": os.path.relpath(output_path, os.path.dirname(self.manifest_path)),
+            "source_model": target.hf_model_id,
+            "quant_type": quantization_type,
+            "file_size": os.path.getsize(output_path),
+            "imatrix": (os.path.relpath(self._imatrix_path(target), os.path.dirname(self.manifest_path))
+                        if target.uses_imatrix(quantization_type) else None),
+            "calibration_file": target.calibration_file if target.uses_imatrix(quantization_type) else None,
+            "created_at": time.time()
+        }
+        with self._manifest_lock:
+            manifest = read_model_manifest(self.manifest_path)
+            models = [model for model in manifest["models"] if model["path"] != entry["path"]]
+            models.append(entry)
+            manifest["models"] = sorted(models, key=lambda model: model["path"])
+            ensure_directory_exists(os.path.dirname(self.manifest_path))
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+
+    def _runner(self) -> PipelineRunner:
+        return PipelineRunner(
+            self.build_pipeline(),
+            self.state_dir,
+            cpu_budget=self.cpu_budget,
+            disk_reserve_bytes=PIPELINE_DISK_RESERVE_BYTES
+        )
+
+    def _run_step(self, name: str) -> bool:
+        """Run one step on its own unless it is up to date"""
+        runner = self._runner()
+        step = runner.steps[name]
+        if runner.is_up_to_date(step):
+            return True
+        result = runner.execute(step)
+        if not result.ok:
+            print(f"Step {name} failed: {result.error}")
+        return result.ok
+
+    def download_model(self, hf_model_id: Optional[str] = None) -> bool:
+        """Download the model from Hugging Face Hub"""
+        return self._run_step(f"download_{self._target(hf_model_id).slug}")
+
+    def build_llama_cpp(self) -> bool:
+        """Build llama.cpp from source"""
+        return self._run_step("build_llama_cpp")
+
+    def convert_to_gguf(self, hf_model_id: Optional[str] = None) -> bool:
+        """Convert HF model to GGUF format"""
+        return self._run_step(f"convert_{self._target(hf_model_id).slug}")
+
+    def quantize_model(self, quantization_type: str, hf_model_id: Optional[str] = None) -> bool:
+        """Quantize model to specified format, computing its importance matrix first if needed"""
+        quantization_type = quantization_type.upper()
+        target = self._target(hf_model_id)
+        validate_quant_type(quantization_type, target.calibration_file is not None)
+        if quantization_type not in target.quant_types:
+            target.quant_types.append(quantization_type)
+        if target.uses_imatrix(quantization_type) and not self._run_step(f"imatrix_{target.slug}"):
             return False
-        
-        print("Model setup completed successfully!")
-        return True
\ No newline at end of file
+        return self._run_step(f"quantize_{target.slug}_{quantization_type}")
+
+    def run_pipeline(self, targets: Optional[Iterable[str]] = None, force: bool = False) -> Dict[str, Any]:
+        """Run the setup graph and return per-step status and timings"""
+        results = self._runner().run(targets, force=force)
+        return {
+            "ok": all(result.ok for result in results),
+            "steps": [result.to_dict() for result in results]
+        }
+
+    def setup_models(self, force: bool = False) -> bool:
+        """Complete setup process for every model and type in the quantization matrix.
+
+        Finished artifacts are reused; pass ``force`` to rebuild everything.
+        """
+        summary = self.run_pipeline(force=force)
+        for step in summary["steps"]:
+            line = f"{step['name']}: {step['status']} ({step['duration']}s)"
+            if step["error"]:
+                line += f" - {step['error']}"
+            print(line)
+
+        if summary["ok"]:
+            print("Model setup completed successfully!")
+        return summary["ok"]
@@ -0,0 +1,113 @@
+# Service for caching generated analyses
+import copy
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+from common.cache_utils import ByteLRUCache, DiskCache
+from common.constants import (
+    RESPONSE_CACHE_CAPACITY_BYTES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_DISK_CAPACITY_BYTES
+)
+
+def _entry_nbytes(entry: Dict[str, Any]) -> int:
+    """Size of a cache entry as serialized JSON"""
+    return len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+class ResponseCacheService:
+    """Content-addressed cache of generation results.
+
+    Keys are derived from the canonicalized company data and every parameter
+    that affects the output. Entries expire after ``ttl_seconds`` and are
+    evicted LRU from a byte-bounded RAM tier, with an optional disk tier
+    that survives restarts.
+    """
+
+    def __init__(self, capacity_bytes: int = RESPONSE_CACHE_CAPACITY_BYTES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 disk_dir: Optional[str] = RESPONSE_CACHE_DIR,
+                 disk_capacity_bytes: int = RESPONSE_CACHE_DISK_CAPACITY_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.ram = ByteLRUCache(capacity_bytes, _entry_nbytes)
+        self.disk = DiskCache(disk_dir, disk_capacity_bytes) if disk_dir else None
+        self._lock = threading.Lock()
+        self.counts = {"ram_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "bypassed": 0, "stores": 0}
+
+    @staticmethod
+    def make_key(company_data: Any, **params: Any) -> str:
+        """Hash the parsed company data, with sorted keys, together with the generation parameters"""
+        canonical = json.dumps(
+            {"input": company_data, "params": params},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] <= self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result, or None on a miss"""
+        entry = self.ram.get(key)
+        source = "ram_hits"
+
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            source = "disk_hits"
+            if entry is not None and self._is_fresh(entry):
+                self.ram.put(key, entry)
+
+        if entry is not None and not self._is_fresh(entry):
+            self.ram.pop(key)
+            if self.disk is not None:
+                self.disk.pop(key)
+            self._count("expired")
+            entry = None
+
+        if entry is None:
+            self._count("misses")
+            return None
+
+        self._count(source)
+        result = copy.deepcopy(entry["result"])
+        result["cached"] = True
+        result["cache_age"] = round(time.time() - entry["created_at"], 2)
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Store a copy of a generation result"""
+        entry = {"result": copy.deepcopy(result), "created_at": time.time()}
+        self.ram.put(key, entry)
+        if self.disk is not None:
+            self.disk.put(key, entry)
+        self._count("stores")
+
+    def record_bypass(self):
+        """Count a request that skipped the cache"""
+        self._count("bypassed")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            counts = dict(self.counts)
+        hits = counts["ram_hits"] + counts["disk_hits"]
+        lookups = hits + counts["misses"]
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0,
+            **counts,
+            "ttl_seconds": self.ttl_seconds,
+            "ram_entries": len(self.ram),
+            "ram_bytes": self.ram.size_bytes,
+            "ram_capacity_bytes": self.ram.capacity_bytes,
+            "disk_bytes": self.disk.size_bytes() if self.disk is not None else None
+        }
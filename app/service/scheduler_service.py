@@ -0,0 +1,321 @@
+# Service for scheduling inference requests
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from common.constants import SCHEDULER_QUEUE_SIZE, SCHEDULER_MAX_BATCH
+
+class QueueFullError(RuntimeError):
+    """Raised when a scheduler queue cannot accept more requests.
+
+    ``status_code`` is the HTTP status to answer with and ``retry_after``
+    the whole seconds after which the client may try again.
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class DeadlineExceededError(QueueFullError):
+    """Raised when a job's deadline passes before it leaves the queue"""
+
+class InferenceJob:
+    """A unit of work waiting for the inference worker"""
+
+    def __init__(self, fn: Callable[[], Any], coalesce_key: Optional[str] = None,
+                 cancel: Optional[threading.Event] = None, priority: int = 0, cost: float = 0.0,
+                 deadline: Optional[float] = None, batch: Any = None):
+        self.fn = fn
+        self.coalesce_key = coalesce_key
+        self.batch = batch
+        self.cancel = cancel
+        self.priority = priority
+        self.cost = cost
+        self.deadline = deadline
+        self.future: Future = Future()
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the caller has given up on the job"""
+        return self.cancel is not None and self.cancel.is_set()
+
+    @property
+    def expired(self) -> bool:
+        """Whether the job's deadline has passed"""
+        return self.deadline is not None and time.time() >= self.deadline
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds the job spent in the queue before it started"""
+        return (self.started_at or time.time()) - self.enqueued_at
+
+    def remaining_cost(self, now: float) -> float:
+        """Estimated seconds of work left on the job"""
+        if self.started_at is None:
+            return self.cost
+        return max(0.0, self.cost - (now - self.started_at))
+
+class InferenceScheduler:
+    """Bounded priority queue with a dedicated inference worker for one model.
+
+    A ``Llama`` instance holds a single KV cache and is not thread-safe, so
+    every job for a model runs on one worker thread. Jobs run in priority
+    order (lower first), then in arrival order. When a job is picked, up to
+    ``max_batch - 1`` queued jobs sharing its coalesce key run with it, so
+    the generation happens once and every waiting caller gets its result.
+    With ``slots``, a semaphore shared by the schedulers of all models, the
+    worker holds a slot while a job runs.
+
+    Jobs submitted with a ``batch`` payload can be decoded together. When
+    one is picked and a ``batch_runner`` is set, the worker calls
+    ``batch_runner(scheduler, group)`` instead of the job's ``fn``. The
+    runner takes more batchable groups from the head of the queue with
+    ``take_batchable`` while it decodes and resolves each with ``finish``.
+    It returns False when it cannot batch, and the group runs alone.
+
+    Callers may pass a ``cancel`` event. Jobs cancelled while queued never
+    run; a running job can poll ``is_cancelled`` between tokens, which is
+    true once every caller sharing it has cancelled. Jobs whose deadline
+    passes while queued fail with ``DeadlineExceededError``.
+    """
+
+    def __init__(self, name: str, max_queue_size: int = SCHEDULER_QUEUE_SIZE, max_batch: int = SCHEDULER_MAX_BATCH,
+                 slots: Optional[threading.Semaphore] = None,
+                 batch_runner: Optional[Callable[["InferenceScheduler", List[InferenceJob]], bool]] = None):
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self.max_batch = max_batch
+        self.slots = slots
+        self.batch_runner = batch_runner
+        self._pending: List[Tuple[int, int, InferenceJob]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._worker: Optional[threading.Thread] = None
+        self._busy = False
+        self._running: List[InferenceJob] = []
+
+        # Statistics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.batches = 0
+        self.batched = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def submit(self, fn: Callable[[], Any], coalesce_key: Optional[str] = None,
+               cancel: Optional[threading.Event] = None, priority: int = 0, cost: float = 0.0,
+               deadline: Optional[float] = None, batch: Any = None) -> Future:
+        """Queue a job and return a future for its result.
+
+        ``cost`` is the job's estimated run time in seconds and ``deadline``
+        the time (epoch seconds) after which it must not start. ``batch`` is
+        the job's request for the batch runner, if it can be batched.
+        """
+        self._ensure_worker()
+        job = InferenceJob(fn, coalesce_key, cancel, priority, cost, deadline, batch)
+        with self._available:
+            if len(self._pending) >= self.max_queue_size:
+                self.rejected += 1
+                raise QueueFullError(f"Inference queue for model '{self.name}' is full ({self.max_queue_size} requests)")
+            heapq.heappush(self._pending, (priority, next(self._sequence), job))
+            self.submitted += 1
+            self._available.notify()
+        return job.future
+
+    def run(self, fn: Callable[[], Any], coalesce_key: Optional[str] = None, timeout: Optional[float] = None) -> Any:
+        """Queue a job and block until its result is available"""
+        return self.submit(fn, coalesce_key).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run_worker,
+                    name=f"inference-{self.name}",
+                    daemon=True
+                )
+                self._worker.start()
+
+    def _pop_group(self) -> List[InferenceJob]:
+        """Take the most urgent queued job and the queued jobs that share its coalesce key.
+        Called with the lock held."""
+        group = [heapq.heappop(self._pending)[2]]
+        key = group[0].coalesce_key
+        if key is not None:
+            matches = [item for item in sorted(self._pending) if item[2].coalesce_key == key][:self.max_batch - 1]
+            if matches:
+                taken = {id(item[2]) for item in matches}
+                self._pending = [item for item in self._pending if id(item[2]) not in taken]
+                heapq.heapify(self._pending)
+                group += [item[2] for item in matches]
+        self.batches += 1
+        self._running += group
+        return group
+
+    def _next_group(self) -> List[InferenceJob]:
+        """Block for the most urgent job and take the queued jobs that share its coalesce key"""
+        with self._available:
+            while not self._pending:
+                self._available.wait()
+            return self._pop_group()
+
+    def take_batchable(self, limit: int) -> List[List[InferenceJob]]:
+        """Take up to ``limit`` groups of batchable jobs from the head of the queue, without waiting.
+
+        Taking stops at the first job that cannot be batched, so it still runs
+        in priority order. Groups whose callers all gave up or whose deadline
+        passed are resolved here and skipped.
+        """
+        groups = []
+        while len(groups) < limit:
+            with self._lock:
+                if not self._pending or self._pending[0][2].batch is None:
+                    break
+                group = self._pop_group()
+            group = self.start(group)
+            if group:
+                groups.append(group)
+        with self._lock:
+            self.batched += len(groups)
+        return groups
+
+    def _run_worker(self):
+        """Worker loop: execute queued jobs one group at a time, or batchable groups together"""
+        while True:
+            jobs = self._next_group()
+            with self.slots if self.slots is not None else nullcontext():
+                jobs = self.start(jobs)
+                if jobs and not (jobs[0].batch is not None and self._run_batch(jobs)):
+                    self._run_group(jobs)
+            with self._lock:
+                self._running = []
+                self._busy = False
+
+    def is_cancelled(self) -> bool:
+        """Whether every caller of the running job has cancelled. Called from the job itself."""
+        running = self._running
+        return bool(running) and all(job.cancelled for job in running)
+
+    def start(self, jobs: List[InferenceJob]) -> List[InferenceJob]:
+        """Mark a group as started and return the jobs that still have a caller.
+
+        Jobs whose caller gave up are cancelled and jobs whose deadline passed
+        fail with ``DeadlineExceededError``.
+        """
+        abandoned = [job for job in jobs if job.cancelled]
+        expired = [job for job in jobs if job not in abandoned and job.expired]
+        if abandoned or expired:
+            with self._lock:
+                self.cancelled += len(abandoned)
+                self.expired += len(expired)
+                self._running = [job for job in self._running if job not in abandoned and job not in expired]
+            for job in abandoned:
+                job.future.cancel()
+            for job in expired:
+                job.future.set_exception(DeadlineExceededError(
+                    f"Deadline passed after {job.wait_time:.1f}s in the queue for model '{self.name}'"
+                ))
+            jobs = [job for job in jobs if job not in abandoned and job not in expired]
+            if not jobs:
+                return jobs
+
+        started_at = time.time()
+        for job in jobs:
+            job.started_at = started_at
+
+        with self._lock:
+            self._busy = True
+            self.coalesced += len(jobs) - 1
+            for job in jobs:
+                self.total_wait_time += job.wait_time
+                self.max_wait_time = max(self.max_wait_time, job.wait_time)
+        return jobs
+
+    def finish(self, jobs: List[InferenceJob], result: Any = None, error: Optional[BaseException] = None):
+        """Resolve every job of a started group with ``result``, or with ``error`` when given"""
+        with self._lock:
+            if error is None:
+                self.completed += len(jobs)
+            else:
+                self.failed += len(jobs)
+            self._running = [job for job in self._running if job not in jobs]
+            self._busy = bool(self._running)
+        for job in jobs:
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    def _run_group(self, jobs: List[InferenceJob]):
+        """Run the first job of a group and share its outcome with the rest"""
+        try:
+            result = jobs[0].fn()
+        except Exception as e:
+            self.finish(jobs, error=e)
+            return
+        self.finish(jobs, result)
+
+    def _run_batch(self, jobs: List[InferenceJob]) -> bool:
+        """Hand a batchable group to the batch runner. Returns False when the group must run alone."""
+        if self.batch_runner is None:
+            return False
+        with self._lock:
+            self.batched += 1
+        try:
+            batched = self.batch_runner(self, jobs)
+        except Exception as e:
+            with self._lock:
+                unfinished = [job for job in self._running if not job.future.done()]
+            self.finish(unfinished, error=e)
+            return True
+        if not batched:
+            with self._lock:
+                self.batched -= 1
+        return batched
+
+    def backlog(self, priority: int) -> Tuple[float, int]:
+        """Estimated seconds of work a new job of ``priority`` would wait behind,
+        and how many queued jobs of that class are waiting"""
+        now = time.time()
+        with self._lock:
+            ahead = [job for job_priority, _, job in self._pending if job_priority <= priority]
+            running = self._running
+        # Batched jobs run side by side, so the longest one sets the wait
+        seconds = sum(job.cost for job in ahead) + max((job.remaining_cost(now) for job in running), default=0.0)
+        return seconds, sum(1 for job in ahead if job.priority == priority)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, wait time and throughput counters"""
+        with self._lock:
+            started = self.completed + self.failed
+            return {
+                "model_type": self.name,
+                "queue_depth": len(self._pending),
+                "max_queue_size": self.max_queue_size,
+                "busy": self._busy,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "expired": self.expired,
+                "batches": self.batches,
+                "batched": self.batched,
+                "avg_wait_time": round(self.total_wait_time / started, 3) if started else 0,
+                "max_wait_time": round(self.max_wait_time, 3)
+            }
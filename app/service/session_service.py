@@ -0,0 +1,233 @@
+# Service for multi-turn conversation sessions
+import queue
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from common.cache_utils import ByteLRUCache, DiskCache
+from common.helpers import ensure_directory_exists
+from service.prefix_cache_service import compact_llama_state, llama_state_nbytes
+from common.constants import SESSION_CAPACITY_BYTES, SESSION_DIR, SESSION_DISK_CAPACITY_BYTES, SESSION_TTL_SECONDS
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama, LlamaState
+
+class SessionNotFoundError(LookupError):
+    """Raised for an unknown or expired session id"""
+
+class ConversationSession:
+    """A conversation about one analysis: its transcript and the tokens the model has seen"""
+
+    def __init__(self, session_id: str, model_name: str, state_key: str, messages: List[Dict[str, str]],
+                 tokens: List[int]):
+        self.session_id = session_id
+        self.model_name = model_name
+        self.state_key = state_key          # KV states only restore into the same context size and cache types
+        self.messages = messages
+        self.tokens = tokens
+        self.turns = 1
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "model_name": self.model_name,
+            "turns": self.turns,
+            "context_tokens": len(self.tokens),
+            "messages": self.messages,
+            "created_at": self.created_at,
+            "last_used": self.last_used
+        }
+
+class SessionService:
+    """Conversation sessions whose KV state survives between turns.
+
+    After each turn the model's state is snapshotted (without its logits
+    buffer), so the next turn only prefills the new question. States live
+    in a byte-bounded RAM LRU; those evicted from it are written to
+    ``disk_dir`` (bounded by ``disk_capacity_bytes``, least recently used
+    first) by a writer thread, so the inference worker never waits on the
+    disk. Transcripts and token histories are small and always written to
+    disk, so a session whose state was dropped, or that outlives a
+    restart, continues by prefilling its history again. Sessions unused
+    for ``ttl_seconds`` are deleted.
+    """
+
+    def __init__(self, capacity_bytes: int = SESSION_CAPACITY_BYTES, disk_dir: Optional[str] = SESSION_DIR,
+                 disk_capacity_bytes: int = SESSION_DISK_CAPACITY_BYTES, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.states = ByteLRUCache(capacity_bytes, llama_state_nbytes, on_evict=self._spill)
+        self.disk_states: Optional[DiskCache] = None
+        self.disk_sessions: Optional[DiskCache] = None
+        if disk_dir:
+            ensure_directory_exists(disk_dir)
+            self.disk_states = DiskCache(f"{disk_dir}/states", disk_capacity_bytes)
+            self.disk_sessions = DiskCache(f"{disk_dir}/transcripts", disk_capacity_bytes)
+        self._sessions: Dict[str, ConversationSession] = {}
+        self._lock = threading.Lock()
+        self._pending: Dict[str, "LlamaState"] = {}     # States queued for the disk, still readable
+        self._writes: "queue.Queue[Tuple[str, Optional[LlamaState]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.counts = {"created": 0, "expired": 0, "resident": 0, "ram": 0, "disk": 0, "miss": 0}
+
+    def _spill(self, session_id: str, state: "LlamaState"):
+        """Queue a state evicted from RAM for the disk"""
+        if self.disk_states is None:
+            return
+        with self._lock:
+            self._pending[session_id] = state
+        self._queue_write(session_id, state)
+
+    def _queue_write(self, session_id: str, state: Optional["LlamaState"]):
+        """Write (or with None, delete) a state on disk from the writer thread, in submission order"""
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name="session-writer", daemon=True)
+                self._writer.start()
+        self._writes.put((session_id, state))
+
+    def _run_writer(self):
+        while True:
+            session_id, state = self._writes.get()
+            if state is None:
+                self.disk_states.pop(session_id)
+                continue
+            self.disk_states.put(session_id, state)
+            with self._lock:
+                if self._pending.get(session_id) is state:
+                    del self._pending[session_id]
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] += n
+
+    def _is_fresh(self, session: ConversationSession) -> bool:
+        return time.time() - session.last_used <= self.ttl_seconds
+
+    def purge_expired(self):
+        """Delete sessions that have not been used within the TTL"""
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items() if not self._is_fresh(session)]
+            for session_id in expired:
+                del self._sessions[session_id]
+        for session_id in expired:
+            self.states.pop(session_id)
+        deleted = len(expired)
+        if self.disk_sessions is not None:
+            # Transcripts are rewritten on every turn, so their age is the session's idle time
+            deleted = self.disk_sessions.expire(self.ttl_seconds)
+            self.disk_states.expire(self.ttl_seconds)
+            for session_id in expired:
+                self._drop_disk_state(session_id)
+        if deleted:
+            self._count("expired", deleted)
+
+    def create(self, model_name: str, state_key: str, messages: List[Dict[str, str]], tokens: List[int],
+               state: "LlamaState") -> ConversationSession:
+        """Start a session from a finished first turn"""
+        self.purge_expired()
+        session = ConversationSession(uuid.uuid4().hex, model_name, state_key, messages, tokens)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self.counts["created"] += 1
+        self._store(session, state)
+        return session
+
+    def get(self, session_id: str) -> ConversationSession:
+        """Look up a live session"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None and self.disk_sessions is not None:
+            session = self.disk_sessions.get(session_id)
+            if session is not None:
+                with self._lock:
+                    session = self._sessions.setdefault(session_id, session)
+        if session is None or not self._is_fresh(session):
+            if session is not None:
+                self.delete(session_id)
+                self._count("expired")
+            raise SessionNotFoundError(f"Session {session_id!r} does not exist or has expired")
+        return session
+
+    def restore(self, model: "Llama", session: ConversationSession, state_key: str) -> str:
+        """Put the session's KV state into the model.
+
+        Returns where it came from: "resident", "ram", "disk" or "miss"
+        (the history has to be prefilled again).
+        """
+        n_tokens = len(session.tokens)
+        if model.n_tokens >= n_tokens and model.input_ids[:n_tokens].tolist() == session.tokens:
+            source = "resident"
+        elif state_key != session.state_key:
+            source = "miss"
+        else:
+            source, state = "ram", self.states.get(session.session_id)
+            if state is None:
+                with self._lock:
+                    state = self._pending.get(session.session_id)
+            if state is None and self.disk_states is not None:
+                source, state = "disk", self.disk_states.get(session.session_id)
+            # A state from before a lost write would not match the history
+            if state is None or state.input_ids[:state.n_tokens].tolist() != session.tokens:
+                source = "miss"
+            else:
+                model.load_state(state)
+        self._count(source)
+        return source
+
+    def update(self, session: ConversationSession, messages: List[Dict[str, str]], tokens: List[int],
+               state_key: str, state: "LlamaState"):
+        """Record a finished turn"""
+        session.messages = session.messages + messages
+        session.tokens = tokens
+        session.state_key = state_key
+        session.turns += 1
+        self._store(session, state)
+
+    def _store(self, session: ConversationSession, state: "LlamaState"):
+        session.last_used = time.time()
+        state = compact_llama_state(state)
+        self._drop_disk_state(session.session_id)       # Superseded by the new state
+        if not self.states.put(session.session_id, state):
+            # Larger than the whole RAM budget
+            self.states.pop(session.session_id)
+            self._spill(session.session_id, state)
+        if self.disk_sessions is not None:
+            self.disk_sessions.put(session.session_id, session)
+
+    def delete(self, session_id: str) -> bool:
+        """End a session. Returns whether it existed."""
+        with self._lock:
+            existed = self._sessions.pop(session_id, None) is not None
+        self.states.pop(session_id)
+        if self.disk_sessions is not None:
+            existed = existed or self.disk_sessions.get(session_id) is not None
+            self._drop_disk_state(session_id)
+            self.disk_sessions.pop(session_id)
+        return existed
+
+    def _drop_disk_state(self, session_id: str):
+        if self.disk_states is None:
+            return
+        with self._lock:
+            self._pending.pop(session_id, None)
+        self._queue_write(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return session counts, where restored states came from and tier sizes"""
+        with self._lock:
+            counts = dict(self.counts)
+            active = len(self._sessions)
+        lookups = counts["resident"] + counts["ram"] + counts["disk"] + counts["miss"]
+        return {
+            "active_sessions": active,
+            **counts,
+            "hit_rate": round((lookups - counts["miss"]) / lookups, 4) if lookups else 0,
+            "ttl_seconds": self.ttl_seconds,
+            "ram_states": len(self.states),
+            "ram_bytes": self.states.size_bytes,
+            "ram_capacity_bytes": self.states.capacity_bytes,
+            "pending_disk_writes": self._writes.qsize(),
+            "disk_bytes": self.disk_states.size_bytes() if self.disk_states is not None else None
+        }
@@ -0,0 +1,179 @@
+# Service for speculative decoding with prompt-lookup or draft-model drafting
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from common.model_utils import create_optimized_llama
+from common.kv_cache import kv_cache_bytes, logits_bytes
+from common.constants import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONTEXT_SIZE,
+    KV_CACHE_TYPE_K,
+    KV_CACHE_TYPE_V,
+    MODEL_COMPUTE_BUFFER_BYTES,
+    MODEL_MEMORY_OVERHEAD_BYTES,
+    SPECULATIVE_MODELS,
+    SPECULATIVE_PROMPT_LOOKUP,
+    SPECULATIVE_DRAFT_TOKENS,
+    SPECULATIVE_NGRAM_SIZE
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+    from llama_cpp import Llama
+    from service.model_registry_service import ModelRegistryService
+
+class ModelDraft:
+    """Drafts tokens by greedy decoding with a smaller model sharing the target's vocabulary.
+
+    The draft keeps its own KV cache; llama_cpp's ``generate`` reuses the
+    longest common prefix, so each step only evaluates the tokens the
+    target accepted since the previous draft.
+    """
+
+    def __init__(self, model: "Llama", num_pred_tokens: int = SPECULATIVE_DRAFT_TOKENS):
+        self.model = model
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids: "np.ndarray", **kwargs: Any) -> "np.ndarray":
+        import numpy as np
+
+        tokens: List[int] = []
+        if len(input_ids) + self.num_pred_tokens < self.model.n_ctx():
+            for token in self.model.generate(input_ids.tolist(), temp=0.0, reset=True):
+                tokens.append(token)
+                if len(tokens) >= self.num_pred_tokens:
+                    break
+        return np.array(tokens, dtype=np.intc)
+
+class DraftTracker:
+    """Draft model handed to llama_cpp that counts accepted tokens.
+
+    llama_cpp calls the draft with the context after every verification
+    step. Comparing the previous draft with the tokens that actually
+    followed tells how many of them the target accepted. Accepted tokens
+    are exactly the ones the target samples itself, so output quality is
+    that of the target model.
+    """
+
+    def __init__(self, draft: Callable[..., "np.ndarray"], name: str):
+        self.draft = draft
+        self.name = name
+        self._pending: Optional[tuple] = None
+        self.steps = self.drafted = self.accepted = 0
+
+    def _settle(self, input_ids: List[int]):
+        """Count how much of the previous draft ended up in the context"""
+        if self._pending is None:
+            return
+        start, drafted = self._pending
+        self._pending = None
+        for draft_token, token in zip(drafted, input_ids[start:start + len(drafted)]):
+            if draft_token != token:
+                break
+            self.accepted += 1
+
+    def __call__(self, input_ids: "np.ndarray", **kwargs: Any) -> "np.ndarray":
+        self._settle(input_ids.tolist())
+        drafted = self.draft(input_ids, **kwargs)
+        self._pending = (len(input_ids), drafted.tolist())
+        self.steps += 1
+        self.drafted += len(drafted)
+        return drafted
+
+    def begin(self):
+        """Start counting a new generation"""
+        self._pending = None
+        self.steps = self.drafted = self.accepted = 0
+
+    def finish(self, input_ids: List[int], completion_tokens: int) -> Dict[str, Any]:
+        """Statistics of the generation since ``begin``"""
+        self._settle(input_ids)
+        return {
+            "draft": self.name,
+            "steps": self.steps,
+            "drafted_tokens": self.drafted,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 3) if self.drafted else 0.0,
+            "tokens_per_step": round(completion_tokens / self.steps, 3) if self.steps else 1.0
+        }
+
+class SpeculativeService:
+    """Attaches drafters to the target models configured in ``SPECULATIVE_MODELS``.
+
+    A drafter is either prompt lookup, which proposes the tokens that
+    followed the latest matching n-gram in the context (cheap, and effective
+    when the analysis repeats names and figures from the input), or a
+    smaller GGUF model. llama_cpp only verifies drafts when the target keeps
+    logits for every position, so speculative targets are loaded with
+    ``logits_all``, which costs n_ctx x n_vocab floats of RAM. A draft
+    model gets its own instance next to the target; its mmapped weights are
+    shared with any copy the registry holds. Both are counted in the
+    target's memory estimate.
+    """
+
+    def __init__(self, registry: "ModelRegistryService", targets: Optional[Dict[str, str]] = None,
+                 num_pred_tokens: int = SPECULATIVE_DRAFT_TOKENS, max_ngram_size: int = SPECULATIVE_NGRAM_SIZE,
+                 loader: Callable[..., "Llama"] = create_optimized_llama):
+        self.registry = registry
+        self.targets = dict(SPECULATIVE_MODELS if targets is None else targets)
+        self.num_pred_tokens = num_pred_tokens
+        self.max_ngram_size = max_ngram_size
+        self.loader = loader
+
+    def draft_for(self, model_path: str) -> Optional[str]:
+        """Drafter configured for the model at ``model_path``, if any"""
+        path = os.path.realpath(model_path)
+        for target, draft in self.targets.items():
+            if target in self.registry and self.registry.resolve(target).path == path:
+                return draft
+        return None
+
+    def create_draft(self, draft: str) -> DraftTracker:
+        """Build a counting drafter for ``draft``: prompt lookup or a model name/alias"""
+        if draft == SPECULATIVE_PROMPT_LOOKUP:
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+            lookup = LlamaPromptLookupDecoding(max_ngram_size=self.max_ngram_size, num_pred_tokens=self.num_pred_tokens)
+            return DraftTracker(lookup, draft)
+
+        entry = self.registry.resolve(draft)
+        print(f"Loading draft model {entry.name}")
+        model = self.loader(entry.path, use_mlock=False)
+        return DraftTracker(ModelDraft(model, self.num_pred_tokens), entry.name)
+
+    def overhead_bytes(self, model_path: str) -> int:
+        """Memory of the draft model loaded next to the target at ``model_path``, if any.
+
+        Its weights are counted in full, although they may share pages with
+        a copy the registry holds.
+        """
+        draft = self.draft_for(model_path)
+        if draft is None or draft == SPECULATIVE_PROMPT_LOOKUP or draft not in self.registry:
+            return 0
+        entry = self.registry.resolve(draft)
+        try:
+            header = entry.header()
+        except (OSError, ValueError):
+            return entry.file_size + MODEL_MEMORY_OVERHEAD_BYTES
+        kv_bytes = kv_cache_bytes(header, DEFAULT_CONTEXT_SIZE, KV_CACHE_TYPE_K, KV_CACHE_TYPE_V)
+        if kv_bytes is None:
+            return entry.file_size + MODEL_MEMORY_OVERHEAD_BYTES
+        return (entry.file_size + kv_bytes + (logits_bytes(header, DEFAULT_BATCH_SIZE) or 0)
+                + MODEL_COMPUTE_BUFFER_BYTES)
+
+    def load_options(self, model_path: str) -> Dict[str, Any]:
+        """Extra ``Llama`` arguments for loading ``model_path``"""
+        draft = self.draft_for(model_path)
+        if draft is None:
+            return {}
+        return {"draft_model": self.create_draft(draft), "logits_all": True}
+
+    @staticmethod
+    def check_vocabulary(model: "Llama"):
+        """Reject a draft model whose vocabulary differs from the target's"""
+        tracker = getattr(model, "draft_model", None)
+        if isinstance(tracker, DraftTracker) and isinstance(tracker.draft, ModelDraft):
+            if tracker.draft.model.n_vocab() != model.n_vocab():
+                raise ValueError(
+                    f"Draft model {tracker.name} has {tracker.draft.model.n_vocab()} tokens, "
+                    f"the target has {model.n_vocab()}; both must share a tokenizer"
+                )
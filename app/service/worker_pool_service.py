@@ -0,0 +1,171 @@
+# Service for supervising pinned inference worker processes
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+from common.constants import (
+    SERVE_WORKER_BASE_PORT,
+    SERVE_WORKER_START_TIMEOUT_SECONDS,
+    SERVE_HEALTH_INTERVAL_SECONDS
+)
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class NoWorkerAvailableError(RuntimeError):
+    """Raised when no worker process can take a request"""
+
+class WorkerProcess:
+    """One inference worker: its CPU set, port, process and load"""
+
+    def __init__(self, index: int, cpus: List[int], port: int):
+        self.index = index
+        self.cpus = cpus
+        self.port = port
+        self.process: Optional[subprocess.Popen] = None
+        self.in_flight = 0
+        self.served = 0
+        self.restarts = 0
+        self.ready = False
+        self.started_at: Optional[float] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "port": self.port,
+            "cpus": self.cpus,
+            "alive": self.alive,
+            "ready": self.ready,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "restarts": self.restarts,
+            "uptime": round(time.time() - self.started_at, 1) if self.started_at and self.alive else 0
+        }
+
+class WorkerPoolService:
+    """Starts one worker process per CPU set and routes to the least loaded.
+
+    Workers run ``serve.py --worker`` pinned to their CPU set. They map the
+    same GGUF files read-only without mlock, so the weights live once in the
+    page cache however many workers serve them. A monitor thread restarts
+    workers that exit and tracks which ones report ``/model/ready``.
+    """
+
+    def __init__(self, cpusets: List[List[int]], base_port: int = SERVE_WORKER_BASE_PORT,
+                 command: Optional[List[str]] = None):
+        self.workers = [WorkerProcess(index, cpus, base_port + index) for index, cpus in enumerate(cpusets)]
+        self.command = command or [sys.executable, os.path.join(APP_DIR, "serve.py"), "--worker"]
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self._next = 0
+
+    def _spawn(self, worker: WorkerProcess):
+        cmd = self.command + ["--port", str(worker.port), "--cpus", ",".join(map(str, worker.cpus))]
+        worker.process = subprocess.Popen(cmd, cwd=APP_DIR)
+        worker.started_at = time.time()
+        worker.ready = False
+        print(f"Started worker {worker.index} (pid {worker.process.pid}) on port {worker.port}, CPUs {worker.cpus}")
+
+    def start(self, timeout: float = SERVE_WORKER_START_TIMEOUT_SECONDS):
+        """Spawn every worker and wait until each accepts connections"""
+        for worker in self.workers:
+            self._spawn(worker)
+
+        deadline = time.time() + timeout
+        pending = list(self.workers)
+        while pending and time.time() < deadline:
+            pending = [worker for worker in pending if self._probe(worker) is None]
+            if any(not worker.alive for worker in pending):
+                self.stop()
+                raise RuntimeError("A worker process exited during startup")
+            if pending:
+                time.sleep(0.5)
+        if pending:
+            self.stop()
+            raise RuntimeError(f"Workers {[worker.index for worker in pending]} did not start within {timeout}s")
+
+        self._monitor = threading.Thread(target=self._watch, name="worker-monitor", daemon=True)
+        self._monitor.start()
+
+    def stop(self):
+        """Terminate every worker"""
+        self._stopping.set()
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    worker.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+
+    def _probe(self, worker: WorkerProcess) -> Optional[bool]:
+        """Readiness of a worker, or None when it does not answer"""
+        try:
+            with urllib.request.urlopen(f"{worker.url}/model/ready", timeout=2) as response:
+                ready = json.load(response).get("success", False)
+        except urllib.error.HTTPError as e:
+            ready = False if e.code == 503 else None
+        except (OSError, ValueError):
+            ready = None
+        worker.ready = bool(ready)
+        return ready
+
+    def _watch(self):
+        """Restart exited workers and refresh readiness"""
+        while not self._stopping.wait(SERVE_HEALTH_INTERVAL_SECONDS):
+            for worker in self.workers:
+                if not worker.alive:
+                    print(f"Worker {worker.index} exited with code {worker.process.returncode}; restarting")
+                    with self._lock:
+                        worker.in_flight = 0
+                        worker.restarts += 1
+                    self._spawn(worker)
+                else:
+                    self._probe(worker)
+
+    def acquire(self) -> WorkerProcess:
+        """Reserve the least loaded worker, preferring ready ones.
+
+        Ties are broken round-robin so idle workers share the traffic.
+        """
+        with self._lock:
+            alive = [worker for worker in self.workers if worker.alive]
+            candidates = [worker for worker in alive if worker.ready] or alive
+            if not candidates:
+                raise NoWorkerAvailableError("No inference worker is running")
+            offset = self._next
+            self._next += 1
+            worker = min(
+                candidates,
+                key=lambda w: (w.in_flight, (w.index - offset) % len(self.workers))
+            )
+            worker.in_flight += 1
+            return worker
+
+    def release(self, worker: WorkerProcess):
+        with self._lock:
+            worker.in_flight = max(0, worker.in_flight - 1)
+            worker.served += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [worker.to_dict() for worker in self.workers],
+            "in_flight": sum(worker.in_flight for worker in self.workers),
+            "ready_workers": sum(1 for worker in self.workers if worker.alive and worker.ready)
+        }
@@ -126,7 +126,8 @@ def test_generate_response_endpoint():
             }
         },
         "model_type": "4bit",
-        "max_tokens": 1000
+        "max_tokens": 1000,
+        "deadline": 120
     }
     
     try:
@@ -134,7 +135,8 @@ def test_generate_response_endpoint():
         print("Sending request... (this may take a while)")
         
         start_time = time.time()
-        response = requests.post(url, headers=headers, json=data, timeout=10000)
+        # The deadline bounds generation, so the client timeout only covers the network
+        response = requests.post(url, headers=headers, json=data, timeout=data["deadline"] + 30)
         end_time = time.time()
         
         print(f"Response time: {end_time - start_time:.2f} seconds")
@@ -161,6 +163,9 @@ def test_generate_response_endpoint():
             if 'error' in response_data:
                 print(f"\n❌ Error: {response_data['error']}")
                 
+        elif response.status_code in (429, 503):
+            print(f"⏳ Server overloaded ({response.status_code}), retry after {response.headers.get('Retry-After')}s")
+            print(f"Response text: {response.text}")
         else:
             print(f"❌ Generate response failed with status: {response.status_code}")
             print(f"Response text: {response.text}")
@@ -175,6 +180,134 @@ def test_generate_response_endpoint():
         print(f"❌ JSON Decode Error: {e}")
         print(f"Response text: {response.text}")
 
+def test_generate_response_stream_endpoint():
+    """Test the streaming generate response endpoint"""
+    print("🧪 Testing Generate Response Stream Endpoint")
+    print("-" * 50)
+
+    url = f"{BASE}/model/generate_response/stream"
+    headers = {
+        'accept': 'text/event-stream',
+        'Content-Type': 'application/json'
+    }
+    data = {
+        "json_input": {
+            "company_name": "ABC",
+            "industry_sector": "Retail Electronics",
+            "estimated_profit_last_3_years": {"2022": 120000000, "2023": 150000000, "2024": 180000000}
+        },
+        "model_type": "4bit",
+        "max_tokens": 200
+    }
+
+    try:
+        print(f"URL: {url}")
+        start_time = time.time()
+        first_token_time = None
+        summary = None
+
+        with requests.post(url, headers=headers, json=data, stream=True, timeout=600) as response:
+            print(f"Status Code: {response.status_code}")
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "token":
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "done":
+                    summary = event
+                elif event["type"] == "error":
+                    print(f"\n❌ Error: {event['message']}")
+
+        print()
+        if first_token_time is not None:
+            print(f"⏱️ Client time to first token: {first_token_time - start_time:.2f} seconds")
+        if summary is not None:
+            print("✅ Stream completed!")
+            print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    except requests.exceptions.ConnectionError:
+        print("❌ Connection Error: Could not connect to the server.")
+    except requests.exceptions.Timeout:
+        print("❌ Request timeout: The server took too long to respond.")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request Exception: {e}")
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON Decode Error: {e}")
+
+def test_generate_response_batch_endpoint():
+    """Test the JSONL batch analysis endpoint"""
+    print("🧪 Testing Generate Response Batch Endpoint")
+    print("-" * 50)
+
+    url = f"{BASE}/model/generate_response/batch"
+    params = {"model_type": "4bit", "max_tokens": 100}
+    records = [
+        {"id": "abc", "data": {"company_name": "ABC", "industry_sector": "Retail Electronics"}},
+        {"id": "xyz", "company_name": "XYZ", "industry_sector": "Logistics"},
+        "not a record"
+    ]
+    body = "\n".join(json.dumps(record) if isinstance(record, dict) else record for record in records)
+
+    try:
+        print(f"URL: {url}")
+        with requests.post(url, params=params, data=body.encode("utf-8"), stream=True, timeout=600,
+                           headers={'Content-Type': 'application/x-ndjson'}) as response:
+            print(f"Status Code: {response.status_code}")
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                result = json.loads(line)
+                if result.get("type") == "summary":
+                    print(f"✅ Batch completed: {json.dumps(result, ensure_ascii=False)}")
+                elif result["success"]:
+                    print(f"   {result['id']}: {result['completion_tokens']} tokens in {result['processing_time']}s")
+                else:
+                    print(f"   {result['id']}: ❌ {result['error']}")
+
+    except requests.exceptions.ConnectionError:
+        print("❌ Connection Error: Could not connect to the server.")
+    except requests.exceptions.Timeout:
+        print("❌ Request timeout: The server took too long to respond.")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request Exception: {e}")
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON Decode Error: {e}")
+
+def test_metrics_endpoint():
+    """Test the Prometheus metrics endpoint"""
+    print("🧪 Testing Metrics Endpoint")
+    print("-" * 40)
+
+    url = f"{BASE}/metrics"
+
+    try:
+        response = requests.get(url, timeout=10)
+        print(f"URL: {url}")
+        print(f"Status Code: {response.status_code}")
+
+        if response.status_code == 200:
+            print("✅ Metrics endpoint successful!")
+            samples = [line for line in response.text.splitlines() if line and not line.startswith("#")]
+            print(f"📊 {len(samples)} samples")
+            for line in samples:
+                if line.startswith(("llm_requests_total", "llm_cache_hit_ratio", "llm_decode_tokens_per_second")):
+                    print(f"   {line}")
+        else:
+            print(f"❌ Metrics endpoint failed with status: {response.status_code}")
+
+    except requests.exceptions.ConnectionError:
+        print("❌ Connection Error: Could not connect to the server.")
+        return False
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Request Exception: {e}")
+        return False
+
+    print()  # Empty line for spacing
+    return response.status_code == 200
+
 def test_server_status():
     """Test basic server status"""
     print("🌐 Testing Server Status")
@@ -207,6 +340,9 @@ if __name__ == "__main__":
         # Only test generate response if health is OK
         if health_ok:
             test_generate_response_endpoint()
+            test_generate_response_stream_endpoint()
+            test_generate_response_batch_endpoint()
+            test_metrics_endpoint()
         else:
             print("❌ Skipping generate response test due to health check failure")
     else: